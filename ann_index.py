@@ -0,0 +1,55 @@
+import faiss
+import numpy as np
+
+DEFAULT_INDEX_SPEC = "Flat"
+
+# Search-time defaults: HNSW candidate list size (raised to k when k is
+# larger) and the number of IVF lists probed per query
+DEFAULT_EF_SEARCH = 64
+DEFAULT_NPROBE = 8
+
+# Upper bound on vectors used to train IVF centroids / PQ codebooks
+MAX_TRAINING_POINTS = 100_000
+
+
+def build_ann_index(vectors, index_spec=DEFAULT_INDEX_SPEC, seed=0):
+    """Build a FAISS index from a `faiss.index_factory` spec and add `vectors` in order.
+
+    Specs are e.g. "Flat" (exact), "HNSW32" (graph, no training) or
+    "IVF256,PQ32" / "IVF256,Flat" (inverted lists, trained on a sample of
+    the vectors). Vector i gets id i, as in the flat index LangChain builds.
+    Raises ValueError for a bad spec or too few vectors to train it.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    try:
+        index = faiss.index_factory(vectors.shape[1], index_spec, faiss.METRIC_L2)
+    except RuntimeError as e:
+        raise ValueError(f"Invalid FAISS index spec {index_spec!r}: {str(e)}")
+    if not index.is_trained:
+        training = vectors
+        if len(vectors) > MAX_TRAINING_POINTS:
+            rng = np.random.default_rng(seed)
+            training = vectors[rng.choice(len(vectors), MAX_TRAINING_POINTS, replace=False)]
+        try:
+            index.train(training)
+        except RuntimeError as e:
+            raise ValueError(f"Cannot train {index_spec!r} on {len(training)} vectors: {str(e)}")
+    index.add(vectors)
+    return index
+
+
+def index_vectors(index):
+    """All vectors of a flat (or otherwise reconstructable) index, in id order."""
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def search_parameters(index, k, selector=None, ef_search=DEFAULT_EF_SEARCH, nprobe=DEFAULT_NPROBE):
+    """SearchParameters for `index` carrying the HNSW/IVF knobs and an optional id selector."""
+    index = faiss.downcast_index(index)
+    # Passed to the constructor so the parameters keep the selector alive
+    kwargs = {} if selector is None else {"sel": selector}
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(efSearch=max(ef_search, k), **kwargs)
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(nprobe=min(nprobe, index.nlist), **kwargs)
+    return faiss.SearchParameters(**kwargs) if kwargs else None
@@ -1,104 +1,181 @@
-from flask import Flask, request, jsonify
-from recommendation_engine import RecommendationEngine
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+from metrics import finish_request_timing, format_timing_header, profiler, render_metrics, start_request_timing
+import service
+from service import ENABLE_PROFILER, batch_error, catalog_error, engines, get_engine, recommend_error
 import os
 import logging
+import time
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
+# Set up logging. DEBUG logs every request in detail, which costs time on the
+# hot path; use LOG_LEVEL=DEBUG only while investigating
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
-# Initialize Flask app
+# Initialize Flask app. Configuration, engines and validation live in
+# service.py, shared with asgi_app.py. Engines are loaded on first use, per
+# catalog; the default one can also be loaded up front in the gunicorn
+# master (see gunicorn.conf.py) so forked workers share the loaded index
 app = Flask(__name__)
 
-# Direct relative paths
-CSV_PATH = "data/shl_individual_assessments.csv"
-INDEX_DIR = "data/faiss_index"
+def error_response(error):
+    """JSON response for a `(message, status)` from service's validators."""
+    message, status = error
+    return jsonify({"error": message}), status
 
-# Initialize Recommendation Engine
-def init_recommendation_engine():
-    try:
-        if not os.path.exists(CSV_PATH):
-            raise FileNotFoundError(f"CSV file not found at {CSV_PATH}")
-        if not os.path.exists(os.path.join(INDEX_DIR, "index.faiss")):
-            raise FileNotFoundError(f"FAISS index not found at {INDEX_DIR}")
-        engine = RecommendationEngine(CSV_PATH, INDEX_DIR)
-        logger.info("Recommendation engine loaded successfully")
-        return engine
-    except Exception as e:
-        logger.error(f"Error loading recommendation engine: {str(e)}")
-        raise
+# Per-request latency and stage timings (embed, search, prompt, generate, parse)
+@app.before_request
+def start_timing():
+    g.request_started = time.perf_counter()
+    g.timing_token = start_request_timing()
+
+@app.after_request
+def record_timing(response):
+    if "timing_token" not in g:
+        return response
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    status = str(response.status_code)
+    if response.is_streamed:
+        # The body is generated after this returns, so the request is timed
+        # when the server closes the response. Its headers are sent by then:
+        # streamed endpoints report their timings in their last event
+        started, token = g.request_started, g.timing_token
+
+        def finish():
+            finish_request_timing(token)
+            service.observe_request(endpoint, status, time.perf_counter() - started)
 
-# Load engine globally
-try:
-    recommendation_engine = init_recommendation_engine()
-except Exception as e:
-    logger.error(f"Failed to initialize recommendation engine: {str(e)}")
-    raise
+        response.call_on_close(finish)
+        return response
+    elapsed = time.perf_counter() - g.request_started
+    timings = finish_request_timing(g.timing_token)
+    service.observe_request(endpoint, status, elapsed)
+    if service.timing_requested(request.headers):
+        response.headers["X-Timing"] = format_timing_header(timings, elapsed)
+    return response
 
-# Health Check Endpoint
+# Prometheus metrics for this process
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(render_metrics(service.metric_lines()), mimetype="text/plain; version=0.0.4")
+
+# Sampling profiler, switchable at runtime (ENABLE_PROFILER=1):
+# POST {"enabled": true, "interval": 0.005} starts it, {"enabled": false} stops it;
+# GET returns its status, or the collected stacks with ?format=collapsed
+@app.route('/debug/profiler', methods=['GET', 'POST'])
+def sampling_profiler():
+    if not ENABLE_PROFILER:
+        return jsonify({"error": "Profiler is disabled"}), 404
+    if request.method == 'POST':
+        error = service.update_profiler(request.get_json(silent=True))
+        if error:
+            return error_response(error)
+    elif request.args.get('format') == 'collapsed':
+        return Response(profiler.collapsed(), mimetype="text/plain")
+    return jsonify(profiler.status()), 200
+
+# Health Check Endpoint: liveness, plus readiness and startup timing
 @app.route('/health', methods=['GET'])
 def health_check():
-    return jsonify({"status": "healthy"}), 200
+    return jsonify(service.health()), 200
+
+# Readiness Endpoint: 503 until the engine has loaded
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    if not service.is_ready():
+        return jsonify({"status": "loading"}), 503
+    return jsonify({"status": "ready"}), 200
+
+# Query cache hit/miss counters, of the default catalog or of ?catalog=<id>
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    catalog = request.args.get('catalog')
+    error = catalog_error(catalog)
+    if error:
+        return error_response(error)
+    return jsonify(get_engine(catalog).cache_stats()), 200
+
+# Gemini prompt/response token counts, of the default catalog or of ?catalog=<id>
+@app.route('/tokens/stats', methods=['GET'])
+def token_stats():
+    catalog = request.args.get('catalog')
+    error = catalog_error(catalog)
+    if error:
+        return error_response(error)
+    return jsonify(get_engine(catalog).token_stats()), 200
+
+# Embedding and Gemini call deadlines, circuit breakers and fallbacks, of the
+# default catalog or of ?catalog=<id> (the upstream clients are shared)
+@app.route('/upstream/stats', methods=['GET'])
+def upstream_stats():
+    catalog = request.args.get('catalog')
+    error = catalog_error(catalog)
+    if error:
+        return error_response(error)
+    return jsonify(get_engine(catalog).upstream_stats()), 200
+
+# Loaded catalogs, their approximate memory and the eviction budget
+@app.route('/catalogs/stats', methods=['GET'])
+def catalog_stats():
+    return jsonify(engines.stats()), 200
 
 # Assessment Recommendation Endpoint (POST as specified)
 @app.route('/recommend', methods=['POST'])
 def get_recommendations():
     try:
         # Get JSON data from request
-        data = request.get_json()
-        if not data or 'query' not in data or not data['query'].strip():
-            return jsonify({"error": "Query field is required"}), 400
-
-        query = data['query']
-
-        # Generate recommendations
-        raw_recommendations = recommendation_engine.get_recommendations(query)
-        
-        # Parse markdown table into the required JSON format
-        lines = [line.strip() for line in raw_recommendations.split("\n") if line.strip()]
-        if len(lines) < 3 or not any("|" in line for line in lines):  # Check for table structure
-            return jsonify({"error": "No valid table found in the response"}), 500
-
-        # Extract headers
-        headers_line = lines[0]
-        headers = [h.strip() for h in headers_line.split("|")[1:-1] if h.strip()]
-        if len(headers) != 6:  # Expect 6 columns: Name, Remote, Adaptive, Type, Duration, URL
-            return jsonify({"error": f"Invalid table header format. Expected 6 columns, got {len(headers)}"}), 500
-
-        # Extract data rows (skip header and separator)
-        recommended_assessments = []
-        for line in lines[2:]:  # Start from the first data row
-            if line and "|" in line:
-                row = [cell.strip() for cell in line.split("|")[1:-1] if cell.strip()]
-                if len(row) == 6:  # Ensure exactly 6 columns
-                    # Convert duration to integer, handling range (e.g., "30-45 minutes" -> 30)
-                    duration_str = row[4].replace("minutes", "").strip()
-                    if "-" in duration_str:
-                        duration = int(duration_str.split("-")[0])  # Take the minimum value
-                    else:
-                        duration = int(duration_str)
-                    # Extract short test type code (e.g., "K" from "K (Knowledge-based)")
-                    test_type_str = row[3].split()[0] if row[3] else "Unknown"
-                    recommended_assessments.append({
-                        "url": f"https://www.shl.com{row[5]}",  # Prepend https://www.shl.com/ to URL
-                        "adaptive_support": row[2],
-                        "description": row[0],  # Use Assessment Name as description
-                        "duration": duration,
-                        "remote_support": row[1],
-                        "test_type": [test_type_str]  # Use short code as list
-                    })
-                else:
-                    logger.warning(f"Skipping malformed row: {row}")
+        data = request.get_json(silent=True)
+        error = recommend_error(data)
+        if error:
+            return error_response(error)
+
+        query, fusion = data['query'], data.get('fusion')
+        engine = get_engine(data.get('catalog'))
+
+        # Both modes return the same records; retrieval-only mode skips the LLM
+        if data.get('mode', 'llm') == 'retrieval':
+            recommended_assessments = engine.get_retrieval_recommendations(query, fusion=fusion)
+        else:
+            recommended_assessments = engine.get_recommendations(query, fusion=fusion)
 
         if not recommended_assessments:
             return jsonify({"error": "No valid recommendations found"}), 404
 
         # Return JSON without conflicting keyword arguments
         return jsonify({"recommended_assessments": recommended_assessments}), 200
-        
+
     except Exception as e:
         logger.error(f"Error processing request: {str(e)}")
         return jsonify({"error": f"Error generating recommendations: {str(e)}"}), 500
 
+# Streaming Recommendation Endpoint: one event per assessment as the LLM selects it.
+# JSON Lines by default; Server-Sent Events when the client accepts text/event-stream.
+# When timings are asked for, the "done" event carries them as X-Timing would
+@app.route('/recommend/stream', methods=['POST'])
+def stream_recommendations():
+    data = request.get_json(silent=True)
+    error = recommend_error(data, mode=False)
+    if error:
+        return error_response(error)
+    sse = request.accept_mimetypes.best_match(["application/x-ndjson", "text/event-stream"]) == "text/event-stream"
+    started = g.request_started if service.timing_requested(request.headers) else None
+    events = service.stream_events(get_engine(data.get('catalog')), data['query'], data.get('fusion'), sse,
+                                   started)
+    response = Response(stream_with_context(events), mimetype="text/event-stream" if sse else "application/x-ndjson")
+    # Keep reverse proxies from buffering the stream
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+# Batch Recommendation Endpoint: streams one JSON object per query (JSON Lines)
+@app.route('/recommend/batch', methods=['POST'])
+def get_recommendations_batch():
+    data = request.get_json(silent=True)
+    error = batch_error(data)
+    if error:
+        return error_response(error)
+    lines = service.batch_lines(get_engine(data.get('catalog')), data)
+    return Response(stream_with_context(lines), mimetype="application/x-ndjson")
+
 if __name__ == "__main__":
-    app.run(host='0.0.0.0', port=int(os.getenv("PORT", 5000)), debug=False)
\ No newline at end of file
+    get_engine()
+    app.run(host='0.0.0.0', port=int(os.getenv("PORT", 5000)), debug=False)
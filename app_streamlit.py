@@ -5,7 +5,7 @@ import pandas as pd
 import logging
 
 # Set up logging
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
 # Streamlit app configuration
@@ -19,8 +19,6 @@ INDEX_DIR = "data/faiss_index"
 @st.cache_resource
 def load_recommendation_engine():
     try:
-        if not os.path.exists(CSV_PATH):
-            raise FileNotFoundError(f"CSV file not found at {CSV_PATH}")
         if not os.path.exists(os.path.join(INDEX_DIR, "index.faiss")):
             raise FileNotFoundError(f"FAISS index not found at {INDEX_DIR}")
         engine = RecommendationEngine(CSV_PATH, INDEX_DIR)
@@ -48,56 +46,52 @@ query = st.text_area(
     height=100,
 )
 
-# Generate recommendations
-if st.button("Get Recommendations"):
-    if query.strip():
-        with st.spinner("Generating recommendations..."):
-            try:
-                raw_recommendations = engine.get_recommendations(query)
-                # Debug: Display raw response
-               # st.write("Raw Response from Gemini:", raw_recommendations)
-                
-                # Parse the markdown table into a DataFrame
-                lines = raw_recommendations.split("\n")
-                if len(lines) < 4 or not any("|" in line for line in lines):  # Check for table structure
-                    st.error("No valid table found in the response.")
-                    st.stop()
-
-                headers = [h.strip() for h in lines[1].split("|")[1:-1] if h.strip()]
-                if len(headers) < 6:  # Ensure minimum expected columns
-                    st.error("Invalid table header format.")
-                    st.stop()
+mode = st.radio(
+    "Recommendation mode",
+    ["LLM (Gemini)", "Retrieval only (fast)"],
+    horizontal=True,
+    help="Retrieval only skips Gemini and ranks assessments directly from the index.",
+)
 
-                data = []
-                for line in lines[3:-1]:  # Skip header and separator lines
-                    if line.strip() and "|" in line:
-                        row = [cell.strip() for cell in line.split("|")[1:-1] if cell.strip()]
-                        if len(row) >= 6:  # Ensure minimum row length
-                            # Convert duration to integer (e.g., "30-45 minutes" -> 45)
-                            duration_str = row[4]
-                            duration = int(duration_str.split("-")[-1].split()[0]) if "-" in duration_str else int(duration_str.split()[0])
-                            data.append({
-                                "Assessment Name": row[0],
-                                "Remote Testing Support": row[1],
-                                "Adaptive/IRT Support": row[2],
-                                "Test Type": [t.strip() for t in row[3].split(",")],
-                                "Duration": duration,
-                                "URL": f"{row[5]}"
-                            })
-                        else:
-                            logger.warning(f"Skipping malformed row: {row}")
+def records_to_frame(records):
+    return pd.DataFrame([{
+        "Assessment Name": r["description"],
+        "Remote Testing Support": r["remote_support"],
+        "Adaptive/IRT Support": r["adaptive_support"],
+        "Test Type": r["test_type"],
+        "Duration": r["duration"],
+        "URL": r["url"],
+        **({"Why": r["rationale"]} if "rationale" in r else {}),
+    } for r in records])
 
-                if not data:
-                    st.error("No valid recommendations found.")
-                else:
-                    df = pd.DataFrame(data)
-                    st.markdown("### Recommended SHL Assessments")
-                    st.table(df)
-                    with st.expander("View Raw Response"):
-                        st.text(raw_recommendations)
-            except Exception as e:
-                st.error(f"Error generating recommendations: {str(e)}")
-                logger.error(f"Exception in recommendations: {str(e)}")
+# Generate recommendations
+if st.button("Get Recommendations"):
+    if query.strip() and mode == "Retrieval only (fast)":
+        try:
+            records = engine.get_retrieval_recommendations(query)
+            if not records:
+                st.error("No valid recommendations found.")
+            else:
+                st.markdown("### Recommended SHL Assessments")
+                st.table(records_to_frame(records))
+        except Exception as e:
+            st.error(f"Error generating recommendations: {str(e)}")
+            logger.error(f"Exception in recommendations: {str(e)}")
+    elif query.strip():
+        st.markdown("### Recommended SHL Assessments")
+        table = st.empty()
+        records = []
+        try:
+            with st.spinner("Generating recommendations..."):
+                # Rows are shown as soon as Gemini selects them
+                for record in engine.iter_recommendations_stream(query):
+                    records.append(record)
+                    table.table(records_to_frame(records))
+            if not records:
+                st.error("No valid recommendations found.")
+        except Exception as e:
+            st.error(f"Error generating recommendations: {str(e)}")
+            logger.error(f"Exception in recommendations: {str(e)}")
     else:
         st.warning("Please enter a query to get recommendations.")
 else:
@@ -0,0 +1,204 @@
+"""Asyncio serving path for the recommendation API.
+
+Same endpoints and JSON contract as app.py, from the same service.py
+configuration, engines and validation, but each worker awaits the
+Gemini embedding and generation calls of /recommend instead of blocking on
+them, so one process serves many concurrent clients. /recommend/stream and
+/recommend/batch run the engine's blocking generators on the thread pool.
+Run with:
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port $PORT
+"""
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+from metrics import finish_request_timing, format_timing_header, profiler, render_metrics, start_request_timing
+import service
+from service import ENABLE_PROFILER, batch_error, catalog_error, engines, recommend_error
+import os
+import time
+import logging
+
+# Set up logging
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
+logger = logging.getLogger(__name__)
+
+# Endpoints whose body is generated while it is sent
+STREAMED_ENDPOINTS = ('/recommend/stream', '/recommend/batch')
+
+# Configuration, engines and validation live in service.py, shared with
+# app.py. The default catalog is loaded at startup, the others on first use
+service.get_engine()
+
+async def get_engine(catalog=None):
+    # Loading an index blocks, so a catalog not loaded yet is loaded off the event loop
+    if engines.peek(catalog) is None:
+        return await run_in_threadpool(service.get_engine, catalog)
+    return service.get_engine(catalog)
+
+def error_response(error):
+    """JSON response for a `(message, status)` from service's validators."""
+    message, status = error
+    return JSONResponse({"error": message}, status_code=status)
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+# Health Check Endpoint: liveness, plus readiness and startup timing, as in app.py
+async def health_check(request):
+    return JSONResponse(service.health(), status_code=200)
+
+# Readiness Endpoint: the default catalog is loaded at import, so a running worker is ready
+async def readiness_check(request):
+    if not service.is_ready():
+        return JSONResponse({"status": "loading"}, status_code=503)
+    return JSONResponse({"status": "ready"}, status_code=200)
+
+# Per-request latency and stage timings, as in app.py
+async def record_timing(request, call_next):
+    started = time.perf_counter()
+    request.state.timing_started = started
+    token = start_request_timing()
+    try:
+        response = await call_next(request)
+    finally:
+        # The endpoint's task (and the threads streaming its body) keep adding
+        # to the same timings dict after this
+        timings = finish_request_timing(token)
+    route = request.scope.get("route")
+    endpoint = route.path if route is not None else "unmatched"
+    status = str(response.status_code)
+    if endpoint in STREAMED_ENDPOINTS:
+        # Timed once the whole body is sent; the headers are gone by then, so
+        # streamed endpoints report their timings in their last event
+        body_iterator = response.body_iterator
+
+        async def timed_body():
+            try:
+                async for chunk in body_iterator:
+                    yield chunk
+            finally:
+                service.observe_request(endpoint, status, time.perf_counter() - started)
+
+        response.body_iterator = timed_body()
+        return response
+    elapsed = time.perf_counter() - started
+    service.observe_request(endpoint, status, elapsed)
+    if service.timing_requested(request.headers):
+        response.headers["X-Timing"] = format_timing_header(timings, elapsed)
+    return response
+
+# Prometheus metrics for this process
+async def metrics(request):
+    return PlainTextResponse(render_metrics(service.metric_lines()), media_type="text/plain; version=0.0.4")
+
+# Sampling profiler, as in app.py (ENABLE_PROFILER=1)
+async def sampling_profiler(request):
+    if not ENABLE_PROFILER:
+        return JSONResponse({"error": "Profiler is disabled"}, status_code=404)
+    if request.method == 'POST':
+        # Stopping joins the sampling thread, so off the event loop
+        error = await run_in_threadpool(service.update_profiler, await read_json(request))
+        if error:
+            return error_response(error)
+    elif request.query_params.get('format') == 'collapsed':
+        return PlainTextResponse(profiler.collapsed())
+    return JSONResponse(profiler.status(), status_code=200)
+
+# Query cache hit/miss counters, of the default catalog or of ?catalog=<id>
+async def cache_stats(request):
+    catalog = request.query_params.get('catalog')
+    error = catalog_error(catalog)
+    if error:
+        return error_response(error)
+    return JSONResponse((await get_engine(catalog)).cache_stats(), status_code=200)
+
+# Gemini prompt/response token counts, of the default catalog or of ?catalog=<id>
+async def token_stats(request):
+    catalog = request.query_params.get('catalog')
+    error = catalog_error(catalog)
+    if error:
+        return error_response(error)
+    return JSONResponse((await get_engine(catalog)).token_stats(), status_code=200)
+
+# Embedding and Gemini call deadlines, circuit breakers and fallbacks, as in app.py
+async def upstream_stats(request):
+    catalog = request.query_params.get('catalog')
+    error = catalog_error(catalog)
+    if error:
+        return error_response(error)
+    return JSONResponse((await get_engine(catalog)).upstream_stats(), status_code=200)
+
+# Loaded catalogs, their approximate memory and the eviction budget
+async def catalog_stats(request):
+    return JSONResponse(engines.stats(), status_code=200)
+
+# Assessment Recommendation Endpoint
+async def get_recommendations(request):
+    try:
+        data = await read_json(request)
+        error = recommend_error(data)
+        if error:
+            return error_response(error)
+
+        query, fusion = data['query'], data.get('fusion')
+        engine = await get_engine(data.get('catalog'))
+
+        if data.get('mode', 'llm') == 'retrieval':
+            recommended_assessments = await engine.aget_retrieval_recommendations(query, fusion=fusion)
+        else:
+            recommended_assessments = await engine.aget_recommendations(query, fusion=fusion)
+
+        if not recommended_assessments:
+            return JSONResponse({"error": "No valid recommendations found"}, status_code=404)
+        return JSONResponse({"recommended_assessments": recommended_assessments}, status_code=200)
+
+    except Exception as e:
+        logger.error(f"Error processing request: {str(e)}")
+        return JSONResponse({"error": f"Error generating recommendations: {str(e)}"}, status_code=500)
+
+# Streaming Recommendation Endpoint, as in app.py: JSON Lines, or Server-Sent
+# Events when the client accepts text/event-stream and not JSON Lines. When
+# timings are asked for, the "done" event carries them. The events come from
+# a plain generator, which Starlette iterates on the thread pool
+async def stream_recommendations(request):
+    data = await read_json(request)
+    error = recommend_error(data, mode=False)
+    if error:
+        return error_response(error)
+    accept = request.headers.get('accept', '')
+    sse = "text/event-stream" in accept and "application/x-ndjson" not in accept
+    started = request.state.timing_started if service.timing_requested(request.headers) else None
+    engine = await get_engine(data.get('catalog'))
+    return StreamingResponse(service.stream_events(engine, data['query'], data.get('fusion'), sse, started),
+                             media_type="text/event-stream" if sse else "application/x-ndjson",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Batch Recommendation Endpoint: streams one JSON object per query (JSON Lines)
+async def get_recommendations_batch(request):
+    data = await read_json(request)
+    error = batch_error(data)
+    if error:
+        return error_response(error)
+    engine = await get_engine(data.get('catalog'))
+    return StreamingResponse(service.batch_lines(engine, data), media_type="application/x-ndjson")
+
+app = Starlette(routes=[
+    Route('/health', health_check, methods=['GET']),
+    Route('/ready', readiness_check, methods=['GET']),
+    Route('/metrics', metrics, methods=['GET']),
+    Route('/debug/profiler', sampling_profiler, methods=['GET', 'POST']),
+    Route('/cache/stats', cache_stats, methods=['GET']),
+    Route('/tokens/stats', token_stats, methods=['GET']),
+    Route('/upstream/stats', upstream_stats, methods=['GET']),
+    Route('/catalogs/stats', catalog_stats, methods=['GET']),
+    Route('/recommend', get_recommendations, methods=['POST']),
+    Route('/recommend/stream', stream_recommendations, methods=['POST']),
+    Route('/recommend/batch', get_recommendations_batch, methods=['POST']),
+], middleware=[Middleware(BaseHTTPMiddleware, dispatch=record_timing)])
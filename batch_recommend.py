@@ -0,0 +1,97 @@
+import argparse
+import itertools
+import json
+import logging
+import os
+import sys
+
+logger = logging.getLogger(__name__)
+
+
+def iter_batch_lines(engine, queries, mode="llm", max_workers=4, ids=None, fusion=None):
+    """Run a batch through the engine, yielding one JSON Lines record per query as it completes.
+
+    Each record carries the query's position in the batch (`index`) and, when
+    `ids` is given, the caller's own id, since records arrive out of order.
+    """
+    valid = []
+    for position, query in enumerate(queries):
+        if isinstance(query, str) and query.strip():
+            valid.append(position)
+            continue
+        line = {"index": position, "query": query, "error": "Query field is required"}
+        if ids is not None:
+            line["id"] = ids[position]
+        yield line
+
+    batch = engine.iter_recommendations_batch([queries[p] for p in valid], mode=mode, max_workers=max_workers,
+                                              fusion=fusion)
+    for valid_position, result in batch:
+        position = valid[valid_position]
+        line = {"index": position, "query": queries[position]}
+        if ids is not None:
+            line["id"] = ids[position]
+        if isinstance(result, Exception):
+            line["error"] = f"Error generating recommendations: {str(result)}"
+        elif result:
+            line["recommended_assessments"] = result
+        else:
+            line["error"] = "No valid recommendations found"
+        yield line
+
+
+def read_requests(path):
+    """Yield (id, query) pairs from a JSON Lines file of {"id": ..., "query": ...} objects."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            yield item.get("id", item.get("request_id", line_number)), item.get("query", "")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate recommendations for every query in a JSON Lines file")
+    parser.add_argument("input", help="JSON Lines file with one {\"id\": ..., \"query\": ...} object per line")
+    parser.add_argument("-o", "--output", help="Output JSON Lines file (default: stdout)")
+    parser.add_argument("--mode", choices=["llm", "retrieval"], default="llm")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent LLM generations")
+    parser.add_argument("--chunk-size", type=int, default=100,
+                        help="Queries embedded and searched together; bounds memory for large files")
+    parser.add_argument("--vector-weight", type=float, default=1.0, help="Reciprocal-rank fusion weight of FAISS hits")
+    parser.add_argument("--lexical-weight", type=float, default=1.0,
+                        help="Reciprocal-rank fusion weight of BM25 keyword hits (0 for vector search only)")
+    parser.add_argument("--csv", default=os.path.join("data", "shl_individual_assessments.csv"))
+    parser.add_argument("--index-dir", default=os.path.join("data", "faiss_index"))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from recommendation_engine import RecommendationEngine
+    engine = RecommendationEngine(args.csv, args.index_dir)
+    fusion = {"vector": args.vector_weight, "lexical": args.lexical_weight}
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    processed = 0
+    try:
+        requests_iter = read_requests(args.input)
+        while True:
+            chunk = list(itertools.islice(requests_iter, args.chunk_size))
+            if not chunk:
+                break
+            ids = [item_id for item_id, _ in chunk]
+            queries = [query for _, query in chunk]
+            for line in iter_batch_lines(engine, queries, mode=args.mode, max_workers=args.workers, ids=ids,
+                                         fusion=fusion):
+                # Positions are reported within the whole file, not the chunk
+                line["index"] += processed
+                out.write(json.dumps(line) + "\n")
+            out.flush()
+            processed += len(chunk)
+            logger.info(f"Processed {processed} queries")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""Local stand-ins for the Google embedding and Gemini APIs, with injected latency and faults.
+
+Both sleep for a configurable time per call to model network and inference
+cost, then answer deterministically from local state, so the full request
+path (embedding, search, prompt, generation, parsing) runs offline. Faults
+make a share of calls fail with a 503 or stall, as an overloaded API does.
+"""
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+from typing import List
+
+from google.api_core import exceptions as google_exceptions
+from langchain_core.embeddings import Embeddings
+
+from embeddings import HashingEmbeddings
+from recommendation_engine import MAX_RECOMMENDATIONS
+from token_budget import estimate_tokens
+
+# "[3] Core Java (Entry Level) (New) | K | 13 | remote" in the engine's prompt
+_CANDIDATE_LINE = re.compile(r"^\[(\d+)\] ", re.MULTILINE)
+
+
+class Latency:
+    """Per-call delays of `seconds` on average, log-normally spread by `jitter` (0 for constant).
+
+    A log-normal tail is what remote API latencies usually look like: most
+    calls close to the median, a few several times slower.
+    """
+
+    def __init__(self, seconds=0.0, jitter=0.0, seed=0):
+        self.seconds = seconds
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self):
+        if self.seconds <= 0:
+            return 0.0
+        if not self.jitter:
+            return self.seconds
+        with self._lock:
+            factor = self._random.lognormvariate(-self.jitter ** 2 / 2, self.jitter)
+        return self.seconds * factor
+
+
+class Faults:
+    """Injected failures: `error_rate` of calls raise ServiceUnavailable (503) and
+    `hang_rate` of them stall for `hang_seconds` first.
+
+    The attributes can be changed while a benchmark runs, to switch an
+    outage on and off.
+    """
+
+    def __init__(self, error_rate=0.0, hang_rate=0.0, hang_seconds=30.0, seed=0):
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def draw(self):
+        """(extra delay in seconds, exception to raise or None) for one call."""
+        with self._lock:
+            hang = self._random.random() < self.hang_rate
+            error = self._random.random() < self.error_rate
+        return (self.hang_seconds if hang else 0.0,
+                google_exceptions.ServiceUnavailable("Injected fault") if error else None)
+
+
+def _wait(delay, timeout):
+    # A call made with a deadline gives up at the deadline, as a gRPC call would
+    if timeout is not None and delay > timeout:
+        time.sleep(timeout)
+        raise google_exceptions.DeadlineExceeded("Injected deadline exceeded")
+    time.sleep(delay)
+
+
+async def _await(delay, timeout):
+    if timeout is not None and delay > timeout:
+        await asyncio.sleep(timeout)
+        raise google_exceptions.DeadlineExceeded("Injected deadline exceeded")
+    await asyncio.sleep(delay)
+
+
+def _timeout(request_options):
+    return (request_options or {}).get("timeout")
+
+
+class SlowEmbeddings(Embeddings):
+    """Wraps a local backend (HashingEmbeddings by default), sleeping before every call.
+
+    It reports the wrapped backend's name, model and dimension, so it loads
+    against indexes that backend built. A call given a `timeout` gives up
+    at it, as a Google embedding request carrying that deadline does.
+    """
+
+    requires_api_key = False
+    supports_timeout = True
+
+    def __init__(self, latency=None, inner=None, faults=None):
+        self.inner = inner if inner is not None else HashingEmbeddings()
+        self.latency = latency if latency is not None else Latency()
+        self.faults = faults if faults is not None else Faults()
+        self.calls = 0
+
+    @property
+    def backend(self):
+        return self.inner.backend
+
+    @property
+    def model(self):
+        return self.inner.model
+
+    @property
+    def dim(self):
+        return getattr(self.inner, "dim", None)
+
+    def _call(self, timeout):
+        self.calls += 1
+        extra, error = self.faults.draw()
+        _wait(self.latency.sample() + extra, timeout)
+        if error is not None:
+            raise error
+
+    def embed_documents(self, texts: List[str], timeout=None) -> List[List[float]]:
+        self._call(timeout)
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text: str, timeout=None) -> List[float]:
+        self._call(timeout)
+        return self.inner.embed_query(text)
+
+    async def aembed_query(self, text: str, timeout=None) -> List[float]:
+        self.calls += 1
+        extra, error = self.faults.draw()
+        await _await(self.latency.sample() + extra, timeout)
+        if error is not None:
+            raise error
+        return self.inner.embed_query(text)
+
+
+def _response(text, prompt):
+    """An object shaped like the parts of a Gemini response the engine reads."""
+    return SimpleNamespace(
+        text=text,
+        candidates=[SimpleNamespace(content=SimpleNamespace(parts=[SimpleNamespace(text=text)]))],
+        usage_metadata=SimpleNamespace(prompt_token_count=estimate_tokens(prompt),
+                                       candidates_token_count=estimate_tokens(text)),
+    )
+
+
+class FakeGenerativeModel:
+    """Answers prompts like Gemini would, without judgement: it picks the
+    first `max_results` candidates in the order the prompt lists them.
+
+    The engine lists candidates best-ranked first, so recommendation
+    quality measured through this model is that of retrieval, the
+    constraint filters and the prompt budget, while its latency includes
+    everything the engine does around the LLM call.
+    """
+
+    def __init__(self, latency=None, max_results=MAX_RECOMMENDATIONS, chunk_size=24, faults=None):
+        self.latency = latency if latency is not None else Latency()
+        self.max_results = max_results
+        self.chunk_size = chunk_size
+        self.faults = faults if faults is not None else Faults()
+        self.calls = 0
+
+    def _answer(self, prompt):
+        ids = [int(short_id) for short_id in _CANDIDATE_LINE.findall(prompt)][:self.max_results]
+        return json.dumps({"recommendations": [
+            {"id": short_id, "rationale": f"Ranked {rank} of the retrieved candidates."}
+            for rank, short_id in enumerate(ids, start=1)
+        ]})
+
+    def generate_content(self, prompt, generation_config=None, stream=False, request_options=None, **kwargs):
+        self.calls += 1
+        delay = self.latency.sample()
+        extra, error = self.faults.draw()
+        text = self._answer(prompt)
+        if not stream:
+            _wait(delay + extra, _timeout(request_options))
+            if error is not None:
+                raise error
+            return _response(text, prompt)
+        # Like Gemini's, the call returns once the first chunk has arrived,
+        # after half the delay; the rest are spread evenly
+        _wait(delay / 2 + extra, _timeout(request_options))
+        if error is not None:
+            raise error
+        return self._stream(text, prompt, delay)
+
+    def _stream(self, text, prompt, delay):
+        chunks = [text[start:start + self.chunk_size] for start in range(0, len(text), self.chunk_size)]
+        for chunk in chunks:
+            yield _response(chunk, prompt)
+            time.sleep(delay / 2 / len(chunks))
+
+    async def generate_content_async(self, prompt, generation_config=None, request_options=None, **kwargs):
+        self.calls += 1
+        extra, error = self.faults.draw()
+        await _await(self.latency.sample() + extra, _timeout(request_options))
+        if error is not None:
+            raise error
+        return _response(self._answer(prompt), prompt)
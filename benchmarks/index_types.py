@@ -0,0 +1,132 @@
+"""Recall, speed and size of FAISS index types on synthetic embedding catalogs.
+
+For each catalog size, every index spec is built with ann_index.build_ann_index
+(the same code path create_faiss_index uses) and queried one query at a time,
+as the API does. Reported per spec and search setting:
+
+- recall@10: overlap of its top 10 with exact (Flat) search
+- QPS and p50 latency of single-query searches
+- index size in bytes as written to disk, a close proxy for resident memory
+- build time, including training
+
+Run from the repository root:
+
+    python -m benchmarks.index_types --sizes 1000,10000,100000
+    python -m benchmarks.index_types --sizes 1000000 --queries 200   # ~3 GB of vectors at 768-d
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+from ann_index import DEFAULT_EF_SEARCH, DEFAULT_NPROBE, build_ann_index, search_parameters
+
+DEFAULT_SPECS = ["Flat", "HNSW32", "IVF{nlist},Flat", "IVF{nlist},PQ{pq_m}"]
+
+
+def synthetic_catalog(n, dim, seed=0, clusters=None, chunk_size=100_000):
+    """L2-normalised vectors drawn around random centres, like topic-clustered text embeddings."""
+    rng = np.random.default_rng(seed)
+    clusters = clusters or max(8, int(np.sqrt(n)))
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, chunk_size):
+        end = min(start + chunk_size, n)
+        chunk = centres[rng.integers(0, clusters, end - start)]
+        chunk += 0.6 * rng.standard_normal(chunk.shape).astype(np.float32)
+        vectors[start:end] = chunk / np.linalg.norm(chunk, axis=1, keepdims=True)
+    return vectors
+
+
+def expand_spec(spec, n, dim):
+    """Fill the {nlist} (about 4 * sqrt(n) lists) and {pq_m} (dim / 16 sub-quantizers) placeholders."""
+    return spec.format(nlist=max(1, min(int(4 * np.sqrt(n)), n // 39)), pq_m=max(1, dim // 16))
+
+
+def index_size(index):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "index.faiss")
+        faiss.write_index(index, path)
+        return os.path.getsize(path)
+
+
+def run_queries(index, queries, k, params):
+    ids = np.empty((len(queries), k), dtype=np.int64)
+    latencies = np.empty(len(queries))
+    for i, query in enumerate(queries):
+        started = time.perf_counter()
+        _, ids[i] = index.search(query[None, :], k, params=params)
+        latencies[i] = time.perf_counter() - started
+    return ids, latencies
+
+
+def recall_at_k(ids, truth):
+    return float(np.mean([len(np.intersect1d(row[row != -1], expected)) / len(expected)
+                          for row, expected in zip(ids, truth)]))
+
+
+def search_settings(index, ef_search_values, nprobe_values):
+    """(label, ef_search, nprobe) combinations that matter for this index type."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return [(f"efSearch={ef}", ef, DEFAULT_NPROBE) for ef in ef_search_values]
+    if isinstance(index, faiss.IndexIVF):
+        return [(f"nprobe={nprobe}", DEFAULT_EF_SEARCH, nprobe) for nprobe in nprobe_values]
+    return [("exact", DEFAULT_EF_SEARCH, DEFAULT_NPROBE)]
+
+
+def benchmark(n, dim, specs, num_queries, k, ef_search_values, nprobe_values):
+    vectors = synthetic_catalog(n, dim)
+    queries = synthetic_catalog(num_queries, dim, seed=1)
+    exact = faiss.IndexFlatL2(dim)
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+    del exact
+
+    rows = []
+    for spec in specs:
+        spec = expand_spec(spec, n, dim)
+        started = time.perf_counter()
+        try:
+            index = build_ann_index(vectors, spec)
+        except ValueError as e:
+            print(f"  skipping {spec}: {e}")
+            continue
+        build_seconds = time.perf_counter() - started
+        size = index_size(index)
+        for label, ef_search, nprobe in search_settings(index, ef_search_values, nprobe_values):
+            params = search_parameters(index, k, ef_search=ef_search, nprobe=nprobe)
+            ids, latencies = run_queries(index, queries, k, params)
+            rows.append((n, spec, label, recall_at_k(ids, truth), len(queries) / latencies.sum(),
+                         np.percentile(latencies, 50) * 1000, size / 2**20, build_seconds))
+        del index
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare FAISS index types on synthetic catalogs")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="Comma-separated catalog sizes")
+    parser.add_argument("--dim", type=int, default=768, help="Vector size (embedding-001 is 768)")
+    parser.add_argument("--specs", default=";".join(DEFAULT_SPECS),
+                        help="Semicolon-separated faiss.index_factory specs; {nlist} and {pq_m} are filled in per size")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--ef-search", default="16,64,256", help="HNSW efSearch values to sweep")
+    parser.add_argument("--nprobe", default="1,8,32", help="IVF nprobe values to sweep")
+    args = parser.parse_args()
+
+    ef_search_values = [int(v) for v in args.ef_search.split(",")]
+    nprobe_values = [int(v) for v in args.nprobe.split(",")]
+    print(f"{'rows':>9} {'index':<18} {'search':<14} {'recall@' + str(args.k):>9} {'QPS':>9} "
+          f"{'p50 ms':>8} {'size MB':>9} {'build s':>8}")
+    for n in (int(size) for size in args.sizes.split(",")):
+        for row in benchmark(n, args.dim, args.specs.split(";"), args.queries, args.k,
+                             ef_search_values, nprobe_values):
+            print("{:>9} {:<18} {:<14} {:>9.3f} {:>9.0f} {:>8.3f} {:>9.1f} {:>8.1f}".format(*row), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Build time and peak memory of catalog ingestion on a synthetic catalog.
+
+A catalog CSV of the requested size is generated with the shapes the real
+one has (multi-line test type cells, blank Yes/No fields, durations such as
+"0", "30" or "20-25 minutes"), then each stage runs in its own child
+process so its peak resident memory can be read in isolation:
+
+- normalize: catalog.read_catalog, chunked read plus column-wise cleaning
+- documents: catalog.load_documents, the LangChain Documents the index is built from,
+  streamed a chunk at a time as the builder consumes them
+- legacy: the row-by-row df.iterrows() loader this replaced, on --legacy-rows
+  rows (it is slow), for comparison
+
+Peak memory is the growth of the child's maximum RSS over its size after
+imports. Run from the repository root:
+
+    python -m benchmarks.ingestion                  # 1M rows
+    python -m benchmarks.ingestion --rows 100000 --chunksize 20000
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from catalog import DEFAULT_CHUNK_SIZE, load_documents, read_catalog
+
+_TEST_TYPES = np.array(["K", "P", "A", "S", "K\nS", "A\nE\nB\nC\nD\nP", "C\nP", "B\nP\nS"], dtype=object)
+_FLAGS = np.array(["Yes", "No", ""], dtype=object)
+_DURATIONS = np.array(["0", "5", "12", "30", "45", "20-25 minutes", "", "60"], dtype=object)
+
+
+def synthetic_catalog(rows, path, seed=0):
+    """Write a catalog CSV of `rows` rows to `path`."""
+    rng = np.random.default_rng(seed)
+    ids = pd.Series(np.arange(rows)).astype(str)
+    test_type = _TEST_TYPES[rng.integers(0, len(_TEST_TYPES), rows)]
+    name = "Assessment " + ids + " (New)"
+    pd.DataFrame({
+        "name": name,
+        "url": "/solutions/products/product-catalog/view/assessment-" + ids + "/",
+        "remote": _FLAGS[rng.integers(0, 2, rows)],
+        "adaptive": _FLAGS[rng.integers(0, 3, rows)],
+        "test_type": test_type,
+        "description": name + " - " + test_type,
+        "duration": _DURATIONS[rng.integers(0, len(_DURATIONS), rows)],
+    }).to_csv(path, index=False)
+
+
+def legacy_load_documents(csv_path, rows):
+    """The previous create_faiss_index.load_documents, for comparison."""
+    from langchain.schema import Document
+    df = pd.read_csv(csv_path, nrows=rows)
+    df.fillna("", inplace=True)
+    documents = []
+    for _, row in df.iterrows():
+        metadata = {
+            "name": row.get("name", ""),
+            "url": row.get("url", ""),
+            "remote": row.get("remote", "Yes"),
+            "adaptive": row.get("adaptive", "No"),
+            "test_type": row.get("test_type", ""),
+            "duration": row.get("duration", ""),
+        }
+        page_content = f"""
+        Assessment: {row.get('name', '')}
+        Description: {row.get('description', '')}
+        Test Type: {row.get('test_type', '')}
+        Remote Testing: {row.get('remote', 'Yes')}
+        Adaptive Testing: {row.get('adaptive', 'No')}
+        Duration: {row.get('duration', '')}
+        """
+        documents.append(Document(page_content=page_content, metadata=metadata))
+    return documents
+
+
+def _max_rss_bytes():
+    # VmHWM belongs to the process image; ru_maxrss survives exec on Linux
+    # and so would start at the size of the parent that spawned us
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # Kilobytes on Linux, bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _run_stage(stage, csv_path, chunksize, legacy_rows, results):
+    baseline = _max_rss_bytes()
+    started = time.perf_counter()
+    if stage == "normalize":
+        count = len(read_catalog(csv_path, chunksize))
+    elif stage == "documents":
+        count = sum(1 for _ in load_documents(csv_path, chunksize))
+    else:
+        count = len(legacy_load_documents(csv_path, legacy_rows))
+    results.put((stage, count, time.perf_counter() - started, _max_rss_bytes() - baseline))
+
+
+def run_stage(stage, csv_path, chunksize, legacy_rows):
+    """(rows, seconds, peak memory growth in bytes) of one stage, measured in a fresh process."""
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_run_stage, args=(stage, csv_path, chunksize, legacy_rows, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result[1:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark catalog ingestion on a synthetic catalog")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--legacy-rows", type=int, default=100_000,
+                        help="Rows for the row-by-row baseline (0 to skip)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "catalog.csv")
+        started = time.perf_counter()
+        synthetic_catalog(args.rows, csv_path)
+        print(f"Synthetic catalog: {args.rows} rows, {os.path.getsize(csv_path) / 2**20:.0f} MB "
+              f"(generated in {time.perf_counter() - started:.1f}s)")
+        stages = ["normalize", "documents"] + (["legacy"] if args.legacy_rows else [])
+        print(f"{'stage':<10} {'rows':>9} {'seconds':>8} {'rows/s':>10} {'peak MB':>8}")
+        for stage in stages:
+            rows, seconds, peak = run_stage(stage, csv_path, args.chunksize, args.legacy_rows)
+            print(f"{stage:<10} {rows:>9} {seconds:>8.2f} {rows / seconds:>10.0f} {peak / 2**20:>8.0f}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""Offline latency, throughput and quality benchmark for RecommendationEngine.
+
+Every query in a labeled corpus is sent through the engine's
+get_recommendations / get_retrieval_recommendations and through the Flask
+/recommend endpoint, at each concurrency level, with the Google APIs
+replaced by the local stand-ins in benchmarks.fakes: hashing embeddings
+behind an injected embedding latency, and a model that picks the first
+candidates of the prompt after an injected generation latency. Nothing
+touches the network, so runs are repeatable and fit in CI.
+
+Reported per target, mode and concurrency:
+
+- p50 / p95 / p99 latency and throughput (requests per second of wall time)
+- MAP@k and Recall@k against the corpus labels; with the stand-in model
+  these measure retrieval, constraint filtering and the prompt budget
+
+Each pass starts with empty query caches unless --warm is given, so every
+request pays for its embedding and generation. Run from the repository root:
+
+    python -m benchmarks.recommend_eval
+    python -m benchmarks.recommend_eval --concurrency 1,8,32 --llm-latency-ms 800 --output results.json
+    python -m benchmarks.recommend_eval --min-map 0.3 --max-p95-ms 500   # exit 1 on a regression
+"""
+import argparse
+import json
+import logging
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import numpy as np
+
+from benchmarks.fakes import FakeGenerativeModel, Latency, SlowEmbeddings
+from create_faiss_index import create_faiss_index
+from recommendation_engine import RecommendationEngine
+
+DEFAULT_CORPUS = "benchmarks/labeled_queries.jsonl"
+DEFAULT_CSV = "data/updated_assessments.csv"
+
+
+def load_corpus(path):
+    """`[(query, [relevant url, ...]), ...]` from a JSON Lines file of {"query", "relevant"} objects."""
+    corpus = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                corpus.append((item["query"], item["relevant"]))
+    return corpus
+
+
+def _url_key(url):
+    # Labels and records may carry the catalog path with or without the host
+    return urlparse(url).path.rstrip("/")
+
+
+def average_precision(recommended, relevant, k):
+    relevant = {_url_key(url) for url in relevant}
+    hits = 0
+    total = 0.0
+    for rank, url in enumerate(recommended[:k], start=1):
+        if _url_key(url) in relevant:
+            hits += 1
+            total += hits / rank
+    return total / min(len(relevant), k) if relevant else 0.0
+
+
+def recall(recommended, relevant, k):
+    relevant = {_url_key(url) for url in relevant}
+    found = {_url_key(url) for url in recommended[:k]} & relevant
+    return len(found) / len(relevant) if relevant else 0.0
+
+
+def engine_caller(engine, mode):
+    if mode == "llm":
+        return engine.get_recommendations
+    return engine.get_retrieval_recommendations
+
+
+def flask_caller(engine, mode):
+    import app as flask_app
+    from engine_registry import DEFAULT_CATALOG
+    flask_app.engines.add(DEFAULT_CATALOG, engine)
+    # One test client per thread; they share the app and its engine
+    local = threading.local()
+
+    def call(query):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = flask_app.app.test_client()
+        response = client.post("/recommend", json={"query": query, "mode": mode})
+        if response.status_code == 404:
+            return []
+        if response.status_code != 200:
+            raise RuntimeError(f"/recommend returned {response.status_code}: {response.get_json()}")
+        return response.get_json()["recommended_assessments"]
+
+    return call
+
+
+CALLERS = {"engine": engine_caller, "flask": flask_caller}
+
+
+def run_pass(call, queries, concurrency):
+    """Send every query once from `concurrency` threads; returns (results, latencies, wall seconds, errors)."""
+    results = [None] * len(queries)
+    latencies = np.empty(len(queries))
+    errors = []
+
+    def timed(position):
+        started = time.perf_counter()
+        try:
+            results[position] = call(queries[position])
+        except Exception as e:
+            errors.append(e)
+            results[position] = []
+        latencies[position] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(timed, range(len(queries))))
+    return results, latencies, time.perf_counter() - started, errors
+
+
+def benchmark(engine, corpus, targets, modes, concurrency_levels, k, repeat, warm):
+    queries = [query for query, _ in corpus]
+    rows = []
+    for target in targets:
+        for mode in modes:
+            call = CALLERS[target](engine, mode)
+            for concurrency in concurrency_levels:
+                latencies, wall, errors, results = [], 0.0, [], None
+                for _ in range(repeat):
+                    if not warm:
+                        engine.embedding_cache.clear()
+                        engine.result_cache.clear()
+                        if engine.semantic_cache is not None:
+                            engine.semantic_cache.clear()
+                    pass_results, pass_latencies, pass_wall, pass_errors = run_pass(call, queries, concurrency)
+                    results = results or pass_results
+                    latencies.append(pass_latencies)
+                    wall += pass_wall
+                    errors.extend(pass_errors)
+                for error in errors[:3]:
+                    print(f"  {target}/{mode}: {error}", file=sys.stderr)
+                latencies = np.concatenate(latencies)
+                recommended = [[record["url"] for record in records] for records in results]
+                p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+                rows.append({
+                    "target": target,
+                    "mode": mode,
+                    "concurrency": concurrency,
+                    "requests": len(latencies),
+                    "errors": len(errors),
+                    "p50_ms": p50,
+                    "p95_ms": p95,
+                    "p99_ms": p99,
+                    "throughput_rps": len(latencies) / wall,
+                    f"map@{k}": float(np.mean([average_precision(urls, relevant, k)
+                                               for urls, (_, relevant) in zip(recommended, corpus)])),
+                    f"recall@{k}": float(np.mean([recall(urls, relevant, k)
+                                                  for urls, (_, relevant) in zip(recommended, corpus)])),
+                })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline latency and quality benchmark of the recommendation engine")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="Labeled queries (JSON Lines)")
+    parser.add_argument("--csv", default=DEFAULT_CSV, help="Catalog to build a hashing index from")
+    parser.add_argument("--index-dir", help="Use this hashing-backend index instead of building one")
+    parser.add_argument("--targets", default="engine,flask", help="Comma-separated: engine, flask")
+    parser.add_argument("--modes", default="llm,retrieval", help="Comma-separated: llm, retrieval")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated client thread counts")
+    parser.add_argument("--repeat", type=int, default=3, help="Passes over the corpus per concurrency level")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--embed-latency-ms", type=float, default=30.0)
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0)
+    parser.add_argument("--jitter", type=float, default=0.3, help="Log-normal spread of injected latencies (0 = constant)")
+    parser.add_argument("--warm", action="store_true", help="Keep query caches between passes")
+    parser.add_argument("--output", help="Also write the results as JSON to this file")
+    parser.add_argument("--min-map", type=float, help="Exit with status 1 if any MAP@k is below this")
+    parser.add_argument("--max-p95-ms", type=float, help="Exit with status 1 if any p95 latency is above this")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    corpus = load_corpus(args.corpus)
+    with tempfile.TemporaryDirectory() as tmp:
+        index_dir = args.index_dir
+        if index_dir is None:
+            index_dir = tmp
+            create_faiss_index(args.csv, index_dir, cache_dir=None, embedding_backend="hashing")
+        engine = RecommendationEngine(
+            args.csv, index_dir,
+            embedding_backend=SlowEmbeddings(Latency(args.embed_latency_ms / 1000, args.jitter, seed=1)),
+            model=FakeGenerativeModel(Latency(args.llm_latency_ms / 1000, args.jitter, seed=2)),
+        )
+        rows = benchmark(engine, corpus, args.targets.split(","), args.modes.split(","),
+                         [int(level) for level in args.concurrency.split(",")], args.k, args.repeat, args.warm)
+
+    k = args.k
+    print(f"{len(corpus)} labeled queries, embed {args.embed_latency_ms:g} ms, LLM {args.llm_latency_ms:g} ms, "
+          f"jitter {args.jitter:g}{', warm caches' if args.warm else ''}")
+    print(f"{'target':<7} {'mode':<10} {'conc':>4} {'reqs':>5} {'errs':>4} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'req/s':>8} {'MAP@' + str(k):>7} {'R@' + str(k):>6}")
+    for row in rows:
+        print(f"{row['target']:<7} {row['mode']:<10} {row['concurrency']:>4} {row['requests']:>5} {row['errors']:>4} "
+              f"{row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f} {row['throughput_rps']:>8.1f} "
+              f"{row[f'map@{k}']:>7.3f} {row[f'recall@{k}']:>6.3f}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+
+    failures = [row for row in rows if row["errors"]]
+    if args.min_map is not None:
+        failures += [row for row in rows if row[f"map@{k}"] < args.min_map]
+    if args.max_p95_ms is not None:
+        failures += [row for row in rows if row["p95_ms"] > args.max_p95_ms]
+    if failures:
+        print(f"{len(failures)} result(s) failed the error, --min-map or --max-p95-ms checks", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""How the engine behaves when the embedding or Gemini API slows down or fails.
+
+The labeled queries are sent through RecommendationEngine.get_recommendations
+in a sequence of phases, with faults injected into the local stand-ins of
+benchmarks.fakes:
+
+- healthy: no faults
+- slow_tail: a share of generations stall (hedging, if enabled, should hide them)
+- llm_errors: half of the generations fail with a 503
+- llm_outage: every generation fails; the circuit opens and requests get
+  retrieval-only results
+- embed_outage: every embedding call stalls; requests miss the embedding
+  deadline and are answered from a keyword-only search
+- recovery: faults off again. Stalled embedding calls gave up at their
+  deadline and freed their slots; only requests arriving while the
+  half-open circuit's probe call is in flight are still degraded
+
+Each phase starts with empty query caches, and once any open circuit has
+reached its reset timeout, so one phase's outage does not carry over. Reported per phase: latency
+percentiles and the worst case, errors raised to the caller, degraded
+(fallback) results, MAP@k and the circuit states at the end. Run from the
+repository root:
+
+    python -m benchmarks.upstream_faults
+    python -m benchmarks.upstream_faults --hedge-ms 150 --concurrency 16
+"""
+import argparse
+import logging
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.fakes import Faults, FakeGenerativeModel, Latency, SlowEmbeddings
+from benchmarks.recommend_eval import DEFAULT_CORPUS, DEFAULT_CSV, average_precision, load_corpus, run_pass
+from create_faiss_index import create_faiss_index
+from recommendation_engine import RecommendationEngine
+from upstream import CircuitBreaker, UpstreamClient
+
+# (phase, embedding faults, generation faults)
+PHASES = [
+    ("healthy", {}, {}),
+    ("slow_tail", {}, {"hang_rate": 0.05}),
+    ("llm_errors", {}, {"error_rate": 0.5}),
+    ("llm_outage", {}, {"error_rate": 1.0}),
+    ("embed_outage", {"hang_rate": 1.0}, {}),
+    ("recovery", {}, {}),
+]
+
+
+def set_faults(faults, settings):
+    faults.error_rate = settings.get("error_rate", 0.0)
+    faults.hang_rate = settings.get("hang_rate", 0.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Engine latency and degradation under injected upstream faults")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="Labeled queries (JSON Lines)")
+    parser.add_argument("--csv", default=DEFAULT_CSV, help="Catalog to build a hashing index from")
+    parser.add_argument("--index-dir", help="Use this hashing-backend index instead of building one")
+    parser.add_argument("--concurrency", type=int, default=8, help="Client threads")
+    parser.add_argument("--repeat", type=int, default=2, help="Passes over the corpus per phase")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--embed-latency-ms", type=float, default=30.0)
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0)
+    parser.add_argument("--hang-ms", type=float, default=3000.0, help="How long a stalled call stalls")
+    parser.add_argument("--embed-timeout-ms", type=float, default=500.0)
+    parser.add_argument("--llm-timeout-ms", type=float, default=1500.0)
+    parser.add_argument("--hedge-ms", type=float, default=0.0, help="Hedge generations after this long (0 = off)")
+    parser.add_argument("--max-concurrency", type=int, default=8, help="Upstream calls in flight per API")
+    parser.add_argument("--breaker-failures", type=int, default=5)
+    parser.add_argument("--breaker-reset-ms", type=float, default=1000.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    corpus = load_corpus(args.corpus)
+    queries = [query for query, _ in corpus]
+    embed_faults = Faults(hang_seconds=args.hang_ms / 1000, seed=3)
+    llm_faults = Faults(hang_seconds=args.hang_ms / 1000, seed=4)
+    embed_upstream = UpstreamClient(
+        "embed", timeout=args.embed_timeout_ms / 1000, max_concurrency=args.max_concurrency,
+        breaker=CircuitBreaker(args.breaker_failures, args.breaker_reset_ms / 1000, name="embed"))
+    generate_upstream = UpstreamClient(
+        "generate", timeout=args.llm_timeout_ms / 1000, max_concurrency=args.max_concurrency,
+        hedge_after=args.hedge_ms / 1000 if args.hedge_ms > 0 else None,
+        breaker=CircuitBreaker(args.breaker_failures, args.breaker_reset_ms / 1000, name="generate"))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index_dir = args.index_dir
+        if index_dir is None:
+            index_dir = tmp
+            create_faiss_index(args.csv, index_dir, cache_dir=None, embedding_backend="hashing")
+        engine = RecommendationEngine(
+            args.csv, index_dir,
+            embedding_backend=SlowEmbeddings(Latency(args.embed_latency_ms / 1000, 0.3, seed=1), faults=embed_faults),
+            model=FakeGenerativeModel(Latency(args.llm_latency_ms / 1000, 0.3, seed=2), faults=llm_faults),
+            embed_upstream=embed_upstream,
+            generate_upstream=generate_upstream,
+        )
+
+        k = args.k
+        print(f"{len(queries)} queries x {args.repeat}, concurrency {args.concurrency}; deadlines embed "
+              f"{args.embed_timeout_ms:g} ms, LLM {args.llm_timeout_ms:g} ms; stalls {args.hang_ms:g} ms; "
+              f"hedging {'after ' + format(args.hedge_ms, 'g') + ' ms' if args.hedge_ms > 0 else 'off'}")
+        print(f"{'phase':<13} {'reqs':>5} {'errs':>4} {'degraded':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+              f"{'max ms':>8} {'MAP@' + str(k):>7} {'embed':>9} {'generate':>9}")
+        failures = 0
+        # The slowest a request may take: both deadlines, plus the work around them
+        bound = (args.embed_timeout_ms + args.llm_timeout_ms) / 1000 + 0.5
+        for phase, embed_settings, llm_settings in PHASES:
+            if any(client.breaker.state != CircuitBreaker.CLOSED for client in (embed_upstream, generate_upstream)):
+                time.sleep(args.breaker_reset_ms / 1000)
+            set_faults(embed_faults, embed_settings)
+            set_faults(llm_faults, llm_settings)
+            fallbacks_before = sum(engine.upstream_stats()["fallbacks"].values())
+            latencies, errors, scores = [], [], []
+            for _ in range(args.repeat):
+                engine.embedding_cache.clear()
+                engine.result_cache.clear()
+                engine.semantic_cache.clear()
+                results, pass_latencies, _, pass_errors = run_pass(engine.get_recommendations, queries,
+                                                                   args.concurrency)
+                latencies.append(pass_latencies)
+                errors.extend(pass_errors)
+                scores.extend(average_precision([record["url"] for record in records], relevant, k)
+                              for records, (_, relevant) in zip(results, corpus))
+            latencies = np.concatenate(latencies)
+            stats = engine.upstream_stats()
+            degraded = sum(stats["fallbacks"].values()) - fallbacks_before
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+            print(f"{phase:<13} {len(latencies):>5} {len(errors):>4} {degraded:>8} {p50:>8.1f} {p95:>8.1f} "
+                  f"{p99:>8.1f} {latencies.max() * 1000:>8.1f} {np.mean(scores):>7.3f} "
+                  f"{stats['embed']['state']:>9} {stats['generate']['state']:>9}", flush=True)
+            for error in errors[:3]:
+                print(f"  {phase}: {type(error).__name__}: {error}", file=sys.stderr)
+            failures += len(errors) + int(latencies.max() > bound)
+        print(f"Upstream counters: embed {engine.embed_upstream.stats()}")
+        print(f"                   generate {engine.generate_upstream.stats()}")
+
+    if failures:
+        print(f"Requests raised errors or took longer than {bound:.1f}s", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import os
+
+import numpy as np
+
+from embeddings import tokenize
+
+# Reciprocal-rank fusion defaults: equal say for both retrievers, and the
+# usual rank constant of 60, which keeps a single top rank from dominating
+DEFAULT_FUSION = {"vector": 1.0, "lexical": 1.0, "k": 60}
+
+
+def bm25_terms(text):
+    """Index terms for `text`: its tokens, plus the parts of dotted ones (".net" also yields "net")."""
+    terms = []
+    for token in tokenize(text):
+        terms.append(token)
+        if "." in token:
+            terms.extend(part for part in token.split(".") if part and part != token)
+    return terms
+
+
+class BM25Index:
+    """Okapi BM25 inverted index over the catalog, one document per FAISS id.
+
+    Postings are stored CSR-style: the rows of ``doc_ids``/``weights`` between
+    ``indptr[t]`` and ``indptr[t + 1]`` belong to the t-th term of the sorted
+    ``vocab``. The BM25 weight of every posting is precomputed at build time,
+    so scoring a query is one ``searchsorted`` over the vocabulary and a sum
+    of posting slices. Saved as ``bm25.npz`` without pickle.
+    """
+
+    FILE_NAME = "bm25.npz"
+
+    def __init__(self, vocab, indptr, doc_ids, weights, num_docs):
+        self.vocab = vocab
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.num_docs = int(num_docs)
+
+    def __len__(self):
+        return self.num_docs
+
+    @classmethod
+    def from_texts(cls, texts, k1=1.2, b=0.75):
+        """Build the index from document texts, in FAISS id order."""
+        postings = {}
+        lengths = []
+        for doc_id, text in enumerate(texts):
+            terms = bm25_terms(text)
+            lengths.append(len(terms))
+            counts = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            for term, count in counts.items():
+                postings.setdefault(term, []).append((doc_id, count))
+
+        num_docs = len(lengths)
+        lengths = np.asarray(lengths, dtype=np.float32)
+        avg_length = float(lengths.mean()) if num_docs and lengths.mean() > 0 else 1.0
+        vocab = sorted(postings)
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        doc_ids, weights = [], []
+        for t, term in enumerate(vocab):
+            docs = np.array([doc_id for doc_id, _ in postings[term]], dtype=np.int32)
+            tf = np.array([count for _, count in postings[term]], dtype=np.float32)
+            idf = np.log1p((num_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = k1 * (1 - b + b * lengths[docs] / avg_length)
+            doc_ids.append(docs)
+            weights.append((idf * tf * (k1 + 1) / (tf + norm)).astype(np.float32))
+            indptr[t + 1] = indptr[t] + len(docs)
+        return cls(
+            vocab=np.array(vocab, dtype=np.str_),
+            indptr=indptr,
+            doc_ids=np.concatenate(doc_ids) if doc_ids else np.empty(0, dtype=np.int32),
+            weights=np.concatenate(weights) if weights else np.empty(0, dtype=np.float32),
+            num_docs=num_docs,
+        )
+
+    @classmethod
+    def from_docstore(cls, docstore, index_to_docstore_id):
+        """Build the index from a LangChain docstore and its FAISS id mapping."""
+        return cls.from_texts(docstore.search(index_to_docstore_id[i]).page_content
+                              for i in range(len(index_to_docstore_id)))
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore):
+        """Build the index from a LangChain FAISS store."""
+        return cls.from_docstore(vectorstore.docstore, vectorstore.index_to_docstore_id)
+
+    def save(self, index_dir):
+        np.savez(os.path.join(index_dir, self.FILE_NAME), vocab=self.vocab, indptr=self.indptr,
+                 doc_ids=self.doc_ids, weights=self.weights, num_docs=self.num_docs)
+
+    @classmethod
+    def load(cls, index_dir):
+        with np.load(os.path.join(index_dir, cls.FILE_NAME), allow_pickle=False) as data:
+            return cls(data["vocab"], data["indptr"], data["doc_ids"], data["weights"], data["num_docs"])
+
+    def scores(self, query):
+        """BM25 score of every document for `query`."""
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        terms = np.unique(np.array(bm25_terms(query), dtype=np.str_))
+        if not len(terms) or not len(self.vocab):
+            return scores
+        positions = np.searchsorted(self.vocab, terms)
+        in_range = positions < len(self.vocab)
+        positions, terms = positions[in_range], terms[in_range]
+        for t in positions[self.vocab[positions] == terms]:
+            start, end = self.indptr[t], self.indptr[t + 1]
+            scores[self.doc_ids[start:end]] += self.weights[start:end]
+        return scores
+
+    def search(self, query, k, allowed_ids=None):
+        """FAISS ids of the (at most `k`) best-scoring documents with a non-zero score, best first.
+
+        When `allowed_ids` is given only those documents are considered.
+        """
+        scores = self.scores(query)
+        if allowed_ids is not None:
+            mask = np.zeros(self.num_docs, dtype=bool)
+            mask[allowed_ids] = True
+            scores[~mask] = 0
+        hits = np.flatnonzero(scores > 0)
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        # Ties keep FAISS id order, so results are deterministic
+        return hits[np.lexsort((hits, -scores[hits]))].astype(np.int64)
+
+
+def fusion_weights(fusion=None):
+    """Validated `(vector, lexical, k)` fusion settings, with missing fields taken from DEFAULT_FUSION.
+
+    `fusion` is a dict like {"vector": 1.0, "lexical": 0.5, "k": 60}; a
+    weight of 0 turns that retriever off. Raises ValueError on bad values.
+    """
+    settings = dict(DEFAULT_FUSION)
+    if fusion:
+        if not isinstance(fusion, dict):
+            raise ValueError("fusion must be an object with 'vector', 'lexical' and/or 'k'")
+        unknown = set(fusion) - set(DEFAULT_FUSION)
+        if unknown:
+            raise ValueError(f"Unknown fusion fields: {', '.join(sorted(unknown))}")
+        settings.update(fusion)
+    try:
+        vector, lexical, k = float(settings["vector"]), float(settings["lexical"]), float(settings["k"])
+    except (TypeError, ValueError):
+        raise ValueError("fusion weights and k must be numbers")
+    if vector < 0 or lexical < 0 or vector + lexical == 0:
+        raise ValueError("fusion weights must be non-negative and not both zero")
+    if k < 0:
+        raise ValueError("fusion k must be non-negative")
+    return vector, lexical, k
+
+
+def reciprocal_rank_fusion(vector_ids, lexical_ids, weights, limit):
+    """Merge two ranked FAISS id lists with weighted reciprocal-rank fusion.
+
+    Each list contributes ``weight / (k + rank)`` (rank starting at 1) to the
+    documents it contains; the first `limit` ids by total score are returned.
+    """
+    vector_weight, lexical_weight, k = weights
+    ids = np.concatenate([vector_ids, lexical_ids]).astype(np.int64)
+    if not len(ids):
+        return ids
+    contributions = np.concatenate([
+        vector_weight / (k + np.arange(1, len(vector_ids) + 1)),
+        lexical_weight / (k + np.arange(1, len(lexical_ids) + 1)),
+    ])
+    unique_ids, inverse = np.unique(ids, return_inverse=True)
+    totals = np.zeros(len(unique_ids))
+    np.add.at(totals, inverse, contributions)
+    # Ties go to the better vector rank, then the better lexical rank
+    first_seen = np.full(len(unique_ids), len(ids))
+    np.minimum.at(first_seen, inverse, np.arange(len(ids)))
+    order = np.lexsort((first_seen, -totals))
+    return unique_ids[order][:limit]
@@ -0,0 +1,154 @@
+"""Catalog CSV ingestion shared by the index builder and the scraper.
+
+The CSV is read in chunks of plain strings and every field is normalised
+with column-wise pandas/NumPy operations, never row by row:
+
+- test_type: the catalog's newline-separated codes ("A\\nE\\nB") become "A E B"
+- name / description: runs of whitespace, newlines included, become one space
+- remote / adaptive: "Yes" / "No" (any case; also y/true/1) become booleans
+- duration: minutes as float, NaN when the page gives no positive time;
+  "30 minutes" or "20-25" are parsed to their largest number
+
+Embedding texts are assembled by concatenating whole columns.
+"""
+import os
+
+import pandas as pd
+from langchain.schema import Document
+
+CATALOG_COLUMNS = ["name", "url", "remote", "adaptive", "test_type", "description", "duration"]
+REQUIRED_COLUMNS = ["name", "url"]
+# Values assumed for columns the CSV does not have
+COLUMN_DEFAULTS = {"remote": "Yes", "adaptive": "No", "test_type": "", "description": "", "duration": ""}
+
+DEFAULT_CHUNK_SIZE = 100_000
+
+_TRUE_VALUES = ["yes", "y", "true", "1"]
+
+
+def _by_unique(values, parse):
+    """`parse` applied to each distinct value once, mapped back onto `values`.
+
+    Test types, Yes/No flags and durations take a handful of distinct values
+    across millions of rows, so this turns the string work into a take().
+    """
+    codes, uniques = pd.factorize(values)
+    parsed = parse(pd.Series(uniques, dtype=object))
+    return pd.Series(parsed.to_numpy()[codes], index=values.index, dtype=parsed.dtype)
+
+
+def parse_duration(values):
+    """Minutes as float32 for a Series of duration strings; NaN where there is no positive number."""
+    text = values.astype(str).str.strip()
+    minutes = pd.to_numeric(text, errors="coerce")
+    unparsed = minutes.isna() & text.str.contains(r"\d", regex=True)
+    if unparsed.any():
+        numbers = text[unparsed].str.extractall(r"(\d+(?:\.\d+)?)")[0].astype(float)
+        minutes[unparsed] = numbers.groupby(level=0).max()
+    # The scraper records 0 when a page gives no completion time
+    return minutes.where(minutes > 0).astype("float32")
+
+
+def parse_test_type(values):
+    """Space-separated upper-case test type codes, e.g. "A\\nE\\nB" -> "A E B"."""
+    return values.str.upper().str.replace(r"[\s,;]+", " ", regex=True).str.strip()
+
+
+def collapse_whitespace(values):
+    """Single-spaced, stripped text: descriptions repeat the multi-line test type cell."""
+    return values.str.replace(r"\s+", " ", regex=True).str.strip()
+
+
+def parse_yes_no(values):
+    return values.str.strip().str.lower().isin(_TRUE_VALUES)
+
+
+def normalize_catalog(df):
+    """Catalog frame with CATALOG_COLUMNS typed and cleaned, from a frame of strings."""
+    missing = [column for column in REQUIRED_COLUMNS if column not in df.columns]
+    if missing:
+        raise ValueError(f"CSV must contain {' and '.join(repr(c) for c in REQUIRED_COLUMNS)} columns")
+    columns = {}
+    for column in CATALOG_COLUMNS:
+        if column in df.columns:
+            columns[column] = df[column].fillna("").astype(str)
+        else:
+            columns[column] = pd.Series(COLUMN_DEFAULTS[column], index=df.index, dtype=object)
+    return pd.DataFrame({
+        "name": collapse_whitespace(columns["name"]),
+        "url": columns["url"].str.strip(),
+        "remote": _by_unique(columns["remote"], parse_yes_no),
+        "adaptive": _by_unique(columns["adaptive"], parse_yes_no),
+        "test_type": _by_unique(columns["test_type"], parse_test_type),
+        "description": collapse_whitespace(columns["description"]),
+        "duration": _by_unique(columns["duration"], parse_duration),
+    }, index=df.index)
+
+
+def iter_catalog(csv_path, chunksize=DEFAULT_CHUNK_SIZE):
+    """Normalised catalog frames of up to `chunksize` rows each."""
+    if not os.path.exists(csv_path):
+        raise FileNotFoundError(f"CSV file not found at {csv_path}")
+    with pd.read_csv(csv_path, dtype=str, keep_default_na=False, chunksize=chunksize) as reader:
+        for chunk in reader:
+            yield normalize_catalog(chunk)
+
+
+def read_catalog(csv_path, chunksize=DEFAULT_CHUNK_SIZE):
+    """The whole normalised catalog as one frame.
+
+    For callers that edit the catalog in place, like the scraper; this holds
+    every row at once. The index builder streams load_documents instead.
+    """
+    chunks = list(iter_catalog(csv_path, chunksize))
+    if not chunks:
+        return normalize_catalog(pd.DataFrame(columns=REQUIRED_COLUMNS))
+    return pd.concat(chunks, ignore_index=True)
+
+
+def write_catalog(df, csv_path):
+    """Write a normalised catalog back in the CSV's own format (Yes/No, 0 for no duration)."""
+    out = df.copy()
+    for column in ("remote", "adaptive"):
+        out[column] = _yes_no(out[column])
+    out["duration"] = out["duration"].fillna(0).round().astype("int64")
+    out.to_csv(csv_path, index=False)
+
+
+def _yes_no(flags):
+    return flags.map({True: "Yes", False: "No"})
+
+
+def embedding_texts(df):
+    """The text embedded and keyword-indexed for each assessment, built column by column."""
+    duration = df["duration"].fillna(0).round().astype("int64").astype(str).replace("0", "")
+    return ("Assessment: " + df["name"]
+            + "\nDescription: " + df["description"]
+            + "\nTest Type: " + df["test_type"]
+            + "\nRemote Testing: " + _yes_no(df["remote"])
+            + "\nAdaptive Testing: " + _yes_no(df["adaptive"])
+            + "\nDuration: " + duration)
+
+
+def build_documents(df):
+    """LangChain Documents for a normalised catalog frame, in row order."""
+    metadatas = pd.DataFrame({
+        "name": df["name"],
+        "url": df["url"],
+        "remote": _yes_no(df["remote"]),
+        "adaptive": _yes_no(df["adaptive"]),
+        "test_type": df["test_type"],
+        "duration": df["duration"].fillna(0).round().astype("int64"),
+    }).to_dict(orient="records")
+    return [Document(page_content=text, metadata=metadata)
+            for text, metadata in zip(embedding_texts(df).tolist(), metadatas)]
+
+
+def load_documents(csv_path, chunksize=DEFAULT_CHUNK_SIZE):
+    """One Document per catalog row, in order, read and built a chunk at a time.
+
+    A generator: only the current chunk's frame and Documents are held, so
+    `chunksize` bounds the memory of a caller that consumes them as they come.
+    """
+    for chunk in iter_catalog(csv_path, chunksize):
+        yield from build_documents(chunk)
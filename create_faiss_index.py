@@ -1,78 +1,275 @@
-import pandas as pd
 from langchain_community.vectorstores import FAISS
-from langchain.schema import Document
-import google.generativeai as genai
 import os
 from dotenv import load_dotenv
-from typing import List
+import argparse
+import logging
+from itertools import islice
+from embeddings import EMBEDDING_BACKENDS, check_index_info, get_embedding_backend, read_index_info, write_index_info
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+from metadata_store import MetadataStore
+from bm25 import BM25Index
+from ann_index import DEFAULT_INDEX_SPEC, build_ann_index, index_vectors
+from catalog import DEFAULT_CHUNK_SIZE, load_documents
+from index_versions import new_build_dir, publish_index_version, resolve_index_dir
+from upstream import configure_gemini
+
+logger = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Google GenAI embeddings
-google_api_key = os.getenv("GOOGLE_API_KEY")
-if not google_api_key:
-    raise ValueError("GOOGLE_API_KEY not found in .env file.")
-genai.configure(api_key=google_api_key)
-
-# Custom embedding class for Google GenAI
-class GoogleGenAIEmbeddings:
-    def __init__(self, model="models/embedding-001"):
-        self.model = model
-
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        """Embed a list of documents."""
-        embeddings = []
-        for text in texts:
-            result = genai.embed_content(model=self.model, content=text)
-            embeddings.append(result["embedding"])
-        return embeddings
-
-    def embed_query(self, text: str) -> List[float]:
-        """Embed a single query."""
-        result = genai.embed_content(model=self.model, content=text)
-        return result["embedding"]
-
-def create_faiss_index(csv_path, index_save_path):
-    if not os.path.exists(csv_path):
-        raise FileNotFoundError(f"CSV file not found at {csv_path}")
-    
-    # Load the CSV file
-    df = pd.read_csv(csv_path)
-    df.fillna("", inplace=True)
-    
-    # Prepare documents with metadata
-    documents = []
-    for _, row in df.iterrows():
-        metadata = {
-            "name": row.get("name", ""),
-            "url": row.get("url", ""),
-            "remote": row.get("remote", "Yes"),
-            "adaptive": row.get("adaptive", "No"),
-            "test_type": row.get("test_type", ""),
-            "duration": row.get("duration", "")  # Default duration
-        }
-        
-        page_content = f"""
-        Assessment: {row.get('name', '')}
-        Description: {row.get('description', '')}
-        Test Type: {row.get('test_type', '')}
-        Remote Testing: {row.get('remote', 'Yes')}
-        Adaptive Testing: {row.get('adaptive', 'No')}
-        Duration: {row.get('duration', '')}
-        """
-        
-        documents.append(Document(page_content=page_content, metadata=metadata))
-    
-    # Create FAISS index with Google embeddings
-    embeddings = GoogleGenAIEmbeddings()
-    vectorstore = FAISS.from_documents(documents, embedding=embeddings)
+DEFAULT_CACHE_DIR = os.path.join("data", "embedding_cache")
+
+def build_embeddings(batch_size=50, max_workers=4, cache_dir=DEFAULT_CACHE_DIR, backend="google", dim=512):
+    """Return (backend, embeddings): the raw backend and what to embed with (possibly cached)."""
+    if backend == "google":
+        # Initialize Google GenAI embeddings
+        google_api_key = os.getenv("GOOGLE_API_KEY")
+        if not google_api_key:
+            raise ValueError("GOOGLE_API_KEY not found in .env file.")
+        configure_gemini(google_api_key)
+        # Google embeddings are batched and concurrent; the vector order always
+        # follows the input order, whatever the concurrency
+        embedding_backend = get_embedding_backend(backend, batch_size=batch_size, max_workers=max_workers)
+    elif backend == "hashing":
+        embedding_backend = get_embedding_backend(backend, dim=dim)
+    else:
+        embedding_backend = get_embedding_backend(backend)
+    embeddings = embedding_backend
+    if cache_dir:
+        # Only rows whose text changed since the last build are sent to the API.
+        # Each model (and hashing dimension) has its own store under cache_dir
+        cache = EmbeddingCache.for_model(cache_dir, embedding_backend.model)
+        embeddings = CachedEmbeddings(embedding_backend, cache)
+    return embedding_backend, embeddings
+
+def report_cache_usage(embeddings):
+    if isinstance(embeddings, CachedEmbeddings):
+        print(f"Embedding cache: {embeddings.hits} hits, {embeddings.misses} misses")
+
+def save_index_atomically(vectorstore, index_save_path, embedding_backend, index_spec=DEFAULT_INDEX_SPEC):
+    """Write the index as a new version and switch `index_save_path` over to it.
+
+    index.faiss, index.pkl and the files derived from them are never visible
+    half-written or from different builds: a reader that resolves the
+    directory with resolve_index_dir finds either the complete old version
+    or the complete new one (see index_versions).
+    """
+    build_dir = new_build_dir(index_save_path)
+    vectorstore.save_local(build_dir)
+    # Columnar metadata (filter columns plus name/url/test type) that the
+    # engine loads instead of unpickling the docstore
+    MetadataStore.from_vectorstore(vectorstore).save(build_dir)
+    # BM25 inverted index over the same documents, for exact keyword matches
+    BM25Index.from_vectorstore(vectorstore).save(build_dir)
+    # Record the backend so the engine can refuse to query with a different one
+    write_index_info(build_dir, embedding_backend, vectorstore.index.d, index_spec)
+    publish_index_version(build_dir, index_save_path)
+
+def indexable_documents(documents, indexed=()):
+    """The documents an index holds: one per assessment URL, the last occurrence winning.
+
+    The index is keyed by URL, so full and incremental builds of the same CSV
+    hold the same rows. Rows without a URL (blank lines in the scraped CSV)
+    have no stable key and are left out. Both are logged as warnings, since
+    they leave CSV rows out of the index. `indexed` holds the URLs already
+    added by earlier chunks of the same build; a row repeating one of those
+    counts as a repeat too.
+    """
+    by_url = {}
+    no_url = 0
+    repeated = set()
+    for doc in documents:
+        url = doc.metadata["url"]
+        if not url:
+            no_url += 1
+            continue
+        if url in by_url or url in indexed:
+            repeated.add(url)
+        by_url[url] = doc
+    if no_url:
+        logger.warning(f"Skipping {no_url} CSV rows without a URL")
+    if repeated:
+        examples = ", ".join(sorted(repeated)[:3])
+        logger.warning(f"{len(repeated)} URLs appear in several CSV rows; indexing the last row of each "
+                       f"(e.g. {examples})")
+    return by_url
+
+def create_faiss_index(csv_path, index_save_path, batch_size=50, max_workers=4, cache_dir=DEFAULT_CACHE_DIR,
+                       embedding_backend="google", embedding_dim=512, index_spec=DEFAULT_INDEX_SPEC,
+                       chunksize=DEFAULT_CHUNK_SIZE):
+    """Build the index from scratch.
+
+    `index_spec` is a faiss.index_factory string: "Flat" (exact search),
+    "HNSW32" or e.g. "IVF256,PQ32"; IVF specs are trained on the catalog's
+    own vectors, so they need at least as many rows as lists.
+
+    The CSV is read, embedded and added `chunksize` rows at a time, so only
+    one chunk of rows, Documents and vectors is in flight at once.
+    """
+    build_faiss_index(load_documents(csv_path, chunksize), index_save_path, batch_size, max_workers, cache_dir,
+                      embedding_backend, embedding_dim, index_spec, chunksize)
+
+def build_faiss_index(documents, index_save_path, batch_size=50, max_workers=4, cache_dir=DEFAULT_CACHE_DIR,
+                      embedding_backend="google", embedding_dim=512, index_spec=DEFAULT_INDEX_SPEC,
+                      chunksize=DEFAULT_CHUNK_SIZE):
+    """Build the index from the iterable `documents`, consumed `chunksize` at a time (see create_faiss_index)."""
+    # Create FAISS index with the chosen embedding backend
+    backend, embeddings = build_embeddings(batch_size, max_workers, cache_dir, embedding_backend, embedding_dim)
+    documents = iter(documents)
+    vectorstore = None
+    indexed = set()
+    while True:
+        chunk = list(islice(documents, chunksize))
+        if not chunk:
+            break
+        chunk = indexable_documents(chunk, indexed)
+        if not chunk:
+            continue
+        # Docstore ids are the URLs, as incremental updates assign them
+        if vectorstore is None:
+            vectorstore = FAISS.from_documents(list(chunk.values()), embedding=embeddings, ids=list(chunk))
+        else:
+            # A URL repeated from an earlier chunk: its last row wins, as within a chunk
+            replaced = [url for url in chunk if url in indexed]
+            if replaced:
+                vectorstore.delete(replaced)
+            vectorstore.add_documents(list(chunk.values()), ids=list(chunk))
+        indexed.update(chunk)
+    if vectorstore is None:
+        raise ValueError("No catalog rows with a URL to index")
+    report_cache_usage(embeddings)
+    if index_spec != DEFAULT_INDEX_SPEC:
+        # LangChain always builds a flat index; rebuild it as the requested type, keeping ids
+        vectorstore.index = build_ann_index(index_vectors(vectorstore.index), index_spec)
     
     # Save index locally
-    vectorstore.save_local(index_save_path)
-    print(f"FAISS index saved to: {index_save_path}")
+    save_index_atomically(vectorstore, index_save_path, backend, index_spec)
+    print(f"FAISS index ({index_spec}) saved to: {index_save_path}")
+
+def upserted_documents(index_save_path, documents, embeddings):
+    """The documents of an existing index with `documents` added or replacing those with the same URL."""
+    vectorstore = FAISS.load_local(resolve_index_dir(index_save_path), embeddings,
+                                   allow_dangerous_deserialization=True)
+    merged = {}
+    for index_id in sorted(vectorstore.index_to_docstore_id):
+        doc = vectorstore.docstore.search(vectorstore.index_to_docstore_id[index_id])
+        merged.setdefault(doc.metadata.get("url", "") or f"#{index_id}", doc)
+    for doc in documents:
+        if doc.metadata["url"]:
+            merged[doc.metadata["url"]] = doc
+    return list(merged.values())
+
+def update_faiss_index(csv_path, index_save_path, batch_size=50, max_workers=4, cache_dir=DEFAULT_CACHE_DIR,
+                       embedding_backend="google", embedding_dim=512, index_spec=None, upsert=False):
+    """Bring an existing index in line with the CSV, touching only the rows that differ.
+
+    Documents are matched on their assessment URL: new URLs are added, URLs
+    missing from the CSV are removed, and documents whose content or metadata
+    changed are re-embedded. Falls back to a full build if no index exists yet.
+
+    With `upsert`, the CSV holds only changed rows (such as the scraper's
+    *_changed.csv): its rows are added or replaced and nothing is removed.
+
+    Only flat indexes are updated in place: HNSW graphs cannot delete vectors
+    and IVF deletions leave gaps in the ids LangChain maps to documents. Other
+    index types (or a different `index_spec`) are rebuilt in full, with
+    unchanged rows served from the embedding cache.
+    """
+    if not os.path.exists(os.path.join(index_save_path, "index.faiss")):
+        print(f"No existing index at {index_save_path}, building from scratch")
+        return create_faiss_index(csv_path, index_save_path, batch_size, max_workers, cache_dir,
+                                  embedding_backend, embedding_dim, index_spec or DEFAULT_INDEX_SPEC)
+    current_spec = read_index_info(index_save_path)["index_spec"]
+    index_spec = index_spec or current_spec
+    if current_spec != DEFAULT_INDEX_SPEC or index_spec != current_spec:
+        print(f"Rebuilding {index_save_path} as {index_spec} (in-place updates need a Flat index)")
+        documents = load_documents(csv_path)
+        if upsert:
+            _, embeddings = build_embeddings(batch_size, max_workers, cache_dir, embedding_backend, embedding_dim)
+            documents = upserted_documents(index_save_path, documents, embeddings)
+        return build_faiss_index(documents, index_save_path, batch_size, max_workers, cache_dir,
+                                 embedding_backend, embedding_dim, index_spec)
+
+    backend, embeddings = build_embeddings(batch_size, max_workers, cache_dir, embedding_backend, embedding_dim)
+    # Read one version throughout, even if another build publishes meanwhile
+    index_dir = resolve_index_dir(index_save_path)
+    vectorstore = FAISS.load_local(index_dir, embeddings, allow_dangerous_deserialization=True)
+    # New vectors must live in the same space as the ones already indexed
+    check_index_info(read_index_info(index_dir), backend, vectorstore.index.d)
+
+    wanted = indexable_documents(load_documents(csv_path))
+
+    current = {}
+    to_delete = []
+    for index_id in sorted(vectorstore.index_to_docstore_id):
+        doc_id = vectorstore.index_to_docstore_id[index_id]
+        doc = vectorstore.docstore.search(doc_id)
+        url = doc.metadata.get("url", "")
+        if upsert and url not in wanted:
+            # An upsert leaves every row it was not given alone
+            continue
+        if not url or url not in wanted or url in current:
+            to_delete.append(doc_id)
+        else:
+            current[url] = (doc_id, doc)
+
+    to_add = []
+    added = changed = 0
+    for url, doc in wanted.items():
+        if url not in current:
+            to_add.append(doc)
+            added += 1
+            continue
+        doc_id, existing = current[url]
+        if existing.page_content != doc.page_content or existing.metadata != doc.metadata:
+            to_delete.append(doc_id)
+            to_add.append(doc)
+            changed += 1
+    removed = len(to_delete) - changed
+
+    if not to_delete and not to_add:
+        print(f"FAISS index at {index_save_path} is already up to date")
+        return
+
+    if to_delete:
+        vectorstore.delete(to_delete)
+    if to_add:
+        vectorstore.add_documents(to_add, ids=[doc.metadata["url"] for doc in to_add])
+    report_cache_usage(embeddings)
+
+    save_index_atomically(vectorstore, index_save_path, backend)
+    print(f"FAISS index updated at {index_save_path}: {added} added, {changed} changed, {removed} removed")
 
 if __name__ == "__main__":
-    csv_path = r"data\updated_assessments.csv"
-    index_save_path = "data/faiss_index"
-    create_faiss_index(csv_path, index_save_path)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Build the FAISS index for the SHL assessment catalog")
+    parser.add_argument("--csv", default=os.path.join("data", "updated_assessments.csv"))
+    parser.add_argument("--out", default=os.path.join("data", "faiss_index"))
+    parser.add_argument("--batch-size", type=int, default=50, help="Texts per embedding request (max 100)")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent embedding requests")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="On-disk embedding cache location")
+    parser.add_argument("--no-cache", action="store_true", help="Re-embed every document")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Update the existing index in place of a full rebuild (rows matched by URL)")
+    parser.add_argument("--upsert", action="store_true",
+                        help="--csv holds only changed rows (e.g. the scraper's *_changed.csv): add or replace "
+                             "them and remove nothing; implies --incremental")
+    parser.add_argument("--embedding-backend", choices=sorted(EMBEDDING_BACKENDS), default="google",
+                        help="'hashing' builds offline on CPU, no API key needed")
+    parser.add_argument("--embedding-dim", type=int, default=512, help="Vector size for the hashing backend")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="CSV rows read, embedded and added at a time by a full build")
+    parser.add_argument("--index-spec", default=None,
+                        help="faiss.index_factory spec: Flat (default, exact), HNSW32, IVF256,PQ32, ... "
+                             "(with --incremental, defaults to the existing index's spec)")
+    args = parser.parse_args()
+    if args.incremental or args.upsert:
+        update_faiss_index(args.csv, args.out, batch_size=args.batch_size, max_workers=args.workers,
+                           cache_dir=None if args.no_cache else args.cache_dir,
+                           embedding_backend=args.embedding_backend, embedding_dim=args.embedding_dim,
+                           index_spec=args.index_spec, upsert=args.upsert)
+    else:
+        create_faiss_index(args.csv, args.out, batch_size=args.batch_size, max_workers=args.workers,
+                           cache_dir=None if args.no_cache else args.cache_dir,
+                           embedding_backend=args.embedding_backend, embedding_dim=args.embedding_dim,
+                           index_spec=args.index_spec or DEFAULT_INDEX_SPEC, chunksize=args.chunksize)
\ No newline at end of file
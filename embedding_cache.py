@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+class EmbeddingCache:
+    """Content-addressed store of embedding vectors on disk.
+
+    Vectors live in a flat float32 file (``vectors.f32``) that is memory-mapped
+    for reads; ``keys.json`` maps row numbers to sha256(model, text) keys.
+    Rows are only ever appended, and the key index is written after the
+    vectors, so a crash mid-write at worst leaves unreferenced trailing rows.
+
+    One directory holds vectors of one dimension; for_model gives each
+    embedding model its own subdirectory of a shared cache directory.
+    """
+
+    VECTORS_FILE = "vectors.f32"
+    KEYS_FILE = "keys.json"
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.vectors_path = os.path.join(cache_dir, self.VECTORS_FILE)
+        self.keys_path = os.path.join(cache_dir, self.KEYS_FILE)
+        self._lock = threading.Lock()
+        self.dim = None
+        self._keys = []
+        self._rows = {}
+        self._vectors = None
+        self._load()
+
+    @classmethod
+    def for_model(cls, cache_dir, model):
+        """The cache for `model` under `cache_dir`, e.g. data/embedding_cache/hashing-v1-512."""
+        return cls(os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9._-]+", "_", model)))
+
+    @staticmethod
+    def make_key(model, text):
+        return hashlib.sha256(f"{model}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _load(self):
+        if not os.path.exists(self.keys_path):
+            return
+        with open(self.keys_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.dim = meta["dim"]
+        self._keys = meta["keys"]
+        self._rows = {key: row for row, key in enumerate(self._keys)}
+        self._map_vectors()
+
+    def _map_vectors(self):
+        if not self._keys:
+            self._vectors = None
+            return
+        self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r",
+                                  shape=(len(self._keys), self.dim))
+
+    def __len__(self):
+        return len(self._keys)
+
+    def get(self, keys):
+        """Return the cached vector for each key, or None where it is missing."""
+        with self._lock:
+            return [np.array(self._vectors[self._rows[key]]) if key in self._rows else None for key in keys]
+
+    def put(self, keys, vectors):
+        """Append new vectors to the cache. Keys already present are skipped."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(keys):
+            raise ValueError("put() expects one vector per key")
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Vector dimension {vectors.shape[1]} does not match cache dimension {self.dim}")
+
+            new_rows = []
+            for i, key in enumerate(keys):
+                if key not in self._rows:
+                    self._rows[key] = len(self._keys) + len(new_rows)
+                    new_rows.append(i)
+            if not new_rows:
+                return
+
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Release the map before growing the file underneath it
+            self._vectors = None
+            with open(self.vectors_path, "ab") as f:
+                # Drop rows written by an interrupted run that never made it into keys.json
+                f.truncate(len(self._keys) * self.dim * 4)
+                f.write(vectors[new_rows].tobytes())
+            self._keys.extend(keys[i] for i in new_rows)
+
+            tmp_path = f"{self.keys_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"dim": self.dim, "keys": self._keys}, f)
+            os.replace(tmp_path, self.keys_path)
+            self._map_vectors()
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an embeddings backend so documents are only embedded once per (model, text)."""
+
+    def __init__(self, embeddings, cache):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of documents, reusing cached vectors where possible."""
+        texts = list(texts)
+        keys = [EmbeddingCache.make_key(self.embeddings.model, text) for text in texts]
+        vectors = self.cache.get(keys)
+
+        # Embed each distinct missing text once, in first-seen order
+        missing = {}
+        for key, text, vector in zip(keys, texts, vectors):
+            if vector is None and key not in missing:
+                missing[key] = text
+        self.hits += len(texts) - sum(vector is None for vector in vectors)
+        self.misses += sum(vector is None for vector in vectors)
+
+        if missing:
+            new_vectors = self.embeddings.embed_documents(list(missing.values()))
+            self.cache.put(list(missing.keys()), new_vectors)
+            fresh = dict(zip(missing.keys(), new_vectors))
+            vectors = [fresh[key] if vector is None else vector for key, vector in zip(keys, vectors)]
+
+        return [np.asarray(vector, dtype=np.float32).tolist() for vector in vectors]
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a single query (queries are not cached)."""
+        return self.embeddings.embed_query(text)
@@ -0,0 +1,260 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import numpy as np
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+from langchain_core.embeddings import Embeddings
+
+from upstream import request_options
+
+logger = logging.getLogger(__name__)
+
+# Errors worth retrying: quota/rate limiting and transient server failures
+RETRYABLE_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+)
+
+# The batchEmbedContents API accepts at most 100 texts per call
+MAX_BATCH_SIZE = 100
+
+
+# Written next to index.faiss: which embedding backend (and dimension) built the index
+INDEX_INFO_FILE = "index_info.json"
+
+
+# Custom embedding class for Google GenAI, inheriting from langchain_core.embeddings.Embeddings
+class GoogleGenAIEmbeddings(Embeddings):
+    """Gemini embeddings, batched over a pool of workers.
+
+    Every call takes an optional `timeout`. Without one, rate-limited and
+    transiently failed batches are retried with exponential backoff, as an
+    index build wants. With one, as the engine passes from its
+    upstream.UpstreamClient, each batch is a single request carrying that
+    deadline: the client already retries and hedges, and an attempt it has
+    given up on must not hold its slot through a backoff loop.
+    """
+
+    backend = "google"
+    requires_api_key = True
+    supports_timeout = True
+
+    def __init__(self, model="models/embedding-001", batch_size=50, max_workers=4,
+                 max_retries=5, backoff_base=1.0, backoff_max=30.0):
+        if not 1 <= batch_size <= MAX_BATCH_SIZE:
+            raise ValueError(f"batch_size must be between 1 and {MAX_BATCH_SIZE}, got {batch_size}")
+        if max_workers < 1:
+            raise ValueError(f"max_workers must be at least 1, got {max_workers}")
+        self.model = model
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def _embed_batch(self, texts: List[str], timeout=None) -> List[List[float]]:
+        """Embed one batch of texts, retrying with exponential backoff on rate limits unless `timeout` is set."""
+        if timeout is not None:
+            return genai.embed_content(model=self.model, content=texts,
+                                       request_options=request_options(timeout))["embedding"]
+        attempt = 0
+        while True:
+            try:
+                result = genai.embed_content(model=self.model, content=texts)
+                return result["embedding"]
+            except RETRYABLE_ERRORS as e:
+                attempt += 1
+                delay = self._retry_delay(attempt, e)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+
+    def _retry_delay(self, attempt, error):
+        """Backoff before retry `attempt`, or None once retries are exhausted."""
+        if attempt > self.max_retries:
+            return None
+        # Full jitter keeps concurrent workers from retrying in lockstep
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+        logger.warning(f"Embedding batch rate limited ({type(error).__name__}), "
+                       f"retry {attempt}/{self.max_retries} in {delay:.1f}s")
+        return delay
+
+    async def _aembed_batch(self, texts: List[str], timeout=None) -> List[List[float]]:
+        """Async variant of _embed_batch; waits on the network without blocking the event loop."""
+        if timeout is not None:
+            result = await genai.embed_content_async(model=self.model, content=texts,
+                                                     request_options=request_options(timeout))
+            return result["embedding"]
+        attempt = 0
+        while True:
+            try:
+                result = await genai.embed_content_async(model=self.model, content=texts)
+                return result["embedding"]
+            except RETRYABLE_ERRORS as e:
+                attempt += 1
+                delay = self._retry_delay(attempt, e)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+
+    def embed_documents(self, texts: List[str], timeout=None) -> List[List[float]]:
+        """Embed a list of documents in batches, using a bounded pool of workers."""
+        texts = list(texts)
+        if not texts:
+            return []
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if self.max_workers == 1 or len(batches) == 1:
+            results = [self._embed_batch(batch, timeout) for batch in batches]
+        else:
+            # executor.map yields in submission order, so the output order never
+            # depends on which batch finishes first
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as executor:
+                results = list(executor.map(self._embed_batch, batches, [timeout] * len(batches)))
+        return [embedding for batch in results for embedding in batch]
+
+    def embed_query(self, text: str, timeout=None) -> List[float]:
+        """Embed a single query."""
+        return self._embed_batch([text], timeout)[0]
+
+    async def aembed_query(self, text: str, timeout=None) -> List[float]:
+        """Embed a single query without blocking the event loop."""
+        return (await self._aembed_batch([text], timeout))[0]
+
+
+_TOKEN = re.compile(r"[a-z0-9+#]+(?:\.[a-z0-9+#]+)*|\.[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by can for from has have i in is it looking me my need of on or our "
+    "that the their this to we who will with you your".split()
+)
+
+
+def tokenize(text):
+    """Lower-cased word tokens without stopwords; keeps terms like "c++", "c#", ".net" and "asp.net" whole."""
+    return [w for w in _TOKEN.findall(text.lower()) if w not in _STOPWORDS]
+
+
+class HashingEmbeddings(Embeddings):
+    """Local CPU embeddings: signed feature hashing of words, word bigrams and character trigrams.
+
+    Term frequencies are log-scaled and each vector is L2-normalised, so
+    FAISS's L2 distance ranks like cosine similarity. Needs no network,
+    model download or fitted state, which makes index builds reproducible in
+    CI and air-gapped environments. Each batch is hashed into a single NumPy
+    matrix.
+    """
+
+    backend = "hashing"
+    requires_api_key = False
+
+    def __init__(self, dim=512):
+        if dim < 1:
+            raise ValueError(f"dim must be positive, got {dim}")
+        self.dim = dim
+        self.model = f"hashing-v1-{dim}"
+
+    @staticmethod
+    def _features(text):
+        words = tokenize(text)
+        features = list(words)
+        features.extend(f"{a} {b}" for a, b in zip(words, words[1:]))
+        for word in words:
+            # Character trigrams get their own namespace so "c++" the word and
+            # "c++" the trigram are different features
+            padded = f"<{word}>"
+            features.extend("#" + padded[i:i + 3] for i in range(len(padded) - 2))
+        return features
+
+    def _embed(self, texts):
+        rows, hashes = [], []
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                rows.append(row)
+                hashes.append(zlib.crc32(feature.encode("utf-8")))
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        if hashes:
+            hashes = np.asarray(hashes, dtype=np.uint32)
+            # The low bits pick the column, the top bit the sign
+            signs = np.where(hashes >> 31, -1.0, 1.0).astype(np.float32)
+            np.add.at(matrix, (np.asarray(rows), hashes % self.dim), signs)
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1.0, norms)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of documents."""
+        return self._embed(list(texts)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a single query."""
+        return self._embed([text])[0].tolist()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """Embed a single query (CPU-bound and fast, so computed inline)."""
+        return self.embed_query(text)
+
+
+EMBEDDING_BACKENDS = {
+    GoogleGenAIEmbeddings.backend: GoogleGenAIEmbeddings,
+    HashingEmbeddings.backend: HashingEmbeddings,
+}
+
+
+def get_embedding_backend(name, **kwargs):
+    """Instantiate an embedding backend by name ("google" or "hashing")."""
+    if name not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend {name!r}; choose from {sorted(EMBEDDING_BACKENDS)}")
+    return EMBEDDING_BACKENDS[name](**kwargs)
+
+
+def backend_from_index_info(info):
+    """Instantiate the backend an index was built with, as recorded in its index info."""
+    if info["backend"] == "google":
+        return GoogleGenAIEmbeddings(model=info["model"])
+    if info["backend"] == "hashing":
+        return HashingEmbeddings(dim=info["dim"])
+    return get_embedding_backend(info["backend"])
+
+
+def write_index_info(index_dir, embeddings, dim, index_spec="Flat"):
+    with open(os.path.join(index_dir, INDEX_INFO_FILE), "w", encoding="utf-8") as f:
+        json.dump({"backend": embeddings.backend, "model": embeddings.model, "dim": int(dim),
+                   "index_spec": index_spec}, f)
+
+
+def read_index_info(index_dir):
+    """The embedding backend and FAISS index spec recorded for an index.
+
+    Indexes built before this file existed were all flat indexes embedded with
+    Google's embedding-001, so that is assumed when it is missing.
+    """
+    path = os.path.join(index_dir, INDEX_INFO_FILE)
+    if not os.path.exists(path):
+        return {"backend": "google", "model": "models/embedding-001", "dim": None, "index_spec": "Flat"}
+    with open(path, "r", encoding="utf-8") as f:
+        info = json.load(f)
+    info.setdefault("index_spec", "Flat")
+    return info
+
+
+def check_index_info(info, embeddings, dim):
+    """Raise ValueError if an index was not built by `embeddings` or has the wrong dimension."""
+    if (info["backend"], info["model"]) != (embeddings.backend, embeddings.model):
+        raise ValueError(
+            f"Index was built with embedding backend {info['backend']} ({info['model']}) "
+            f"but {embeddings.backend} ({embeddings.model}) is configured"
+        )
+    if info.get("dim") is not None and info["dim"] != dim:
+        raise ValueError(f"Index info records dimension {info['dim']} but index.faiss has {dim}")
+    if getattr(embeddings, "dim", None) is not None and embeddings.dim != dim:
+        raise ValueError(f"Embedding backend produces {embeddings.dim}-d vectors but the index is {dim}-d")
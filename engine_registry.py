@@ -0,0 +1,144 @@
+"""RecommendationEngines for several catalogs, loaded on demand under one memory budget.
+
+Each catalog is a FAISS index directory: the default catalog is the app's
+own index, and any other catalog ID names a subdirectory of the catalogs
+directory (``data/catalogs/<id>/index.faiss``). A catalog's engine is
+loaded the first time a request asks for it; once the engines loaded
+together exceed the memory budget, the least recently used ones are
+dropped from the registry. A request that already holds an evicted engine
+finishes on it, and its memory is freed when the last such request ends.
+
+Index updates on disk need nothing from the registry: every engine checks
+its index files per request and swaps in the new index atomically, so
+requests already running keep the index they started with.
+"""
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CATALOG = "default"
+
+# Catalog IDs name directories, so nothing that could leave the catalogs directory
+_CATALOG_ID = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$")
+
+
+class UnknownCatalogError(KeyError):
+    """No index exists for the requested catalog ID."""
+
+
+class EngineRegistry:
+    """Thread-safe, lazily loaded engines by catalog ID, evicted LRU-first over `memory_budget_bytes`.
+
+    `factory(catalog_id, index_dir)` builds an engine; engines must provide
+    memory_bytes(). A budget of None or 0 never evicts. The engine being
+    loaded is never evicted, even when it alone exceeds the budget.
+    """
+
+    def __init__(self, factory, default_index_dir, catalogs_dir=None, memory_budget_bytes=None):
+        self._factory = factory
+        self.default_index_dir = default_index_dir
+        self.catalogs_dir = catalogs_dir
+        self.memory_budget_bytes = memory_budget_bytes or None
+        self._lock = threading.Lock()
+        self._engines = OrderedDict()
+        # One [lock, users] entry per catalog being loaded, so loading one index
+        # does not hold up requests for the others. An entry lives only while
+        # a request is loading or waiting on that catalog, whether the load
+        # succeeds or fails, so unknown or evicted catalogs leave none behind
+        self._load_locks = {}
+        self.loads = 0
+        self.evictions = 0
+
+    def index_dir(self, catalog_id):
+        """The index directory of `catalog_id`; raises UnknownCatalogError if it has no index."""
+        if catalog_id == DEFAULT_CATALOG:
+            return self.default_index_dir
+        if not isinstance(catalog_id, str) or not _CATALOG_ID.match(catalog_id) or not self.catalogs_dir:
+            raise UnknownCatalogError(catalog_id)
+        index_dir = os.path.join(self.catalogs_dir, catalog_id)
+        if not os.path.exists(os.path.join(index_dir, "index.faiss")):
+            raise UnknownCatalogError(catalog_id)
+        return index_dir
+
+    def get(self, catalog_id=None):
+        """The engine for `catalog_id` (the default catalog if None), loading it if needed."""
+        catalog_id = catalog_id or DEFAULT_CATALOG
+        with self._lock:
+            engine = self._engines.get(catalog_id)
+            if engine is not None:
+                self._engines.move_to_end(catalog_id)
+                return engine
+        index_dir = self.index_dir(catalog_id)
+        with self._lock:
+            entry = self._load_locks.setdefault(catalog_id, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                with self._lock:
+                    engine = self._engines.get(catalog_id)
+                if engine is None:
+                    engine = self._factory(catalog_id, index_dir)
+                    self.add(catalog_id, engine)
+                    logger.info(f"Loaded catalog {catalog_id!r} from {index_dir} "
+                                f"({engine.memory_bytes() / 2**20:.1f} MB)")
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._load_locks[catalog_id]
+        return engine
+
+    def add(self, catalog_id, engine):
+        """Register an already built engine for `catalog_id`, evicting others if over budget."""
+        with self._lock:
+            self._engines[catalog_id] = engine
+            self._engines.move_to_end(catalog_id)
+            self.loads += 1
+            self._evict_over_budget(keep=catalog_id)
+
+    def peek(self, catalog_id=None):
+        """The loaded engine for `catalog_id`, or None; never loads and does not count as a use."""
+        with self._lock:
+            return self._engines.get(catalog_id or DEFAULT_CATALOG)
+
+    def loaded(self):
+        """`[(catalog_id, engine), ...]` for every loaded engine, least recently used first; never loads."""
+        with self._lock:
+            return list(self._engines.items())
+
+    def _evict_over_budget(self, keep):
+        if self.memory_budget_bytes is None:
+            return
+        # Sizes are read now rather than at load time: engines reload their index when it changes
+        sizes = {catalog_id: engine.memory_bytes() for catalog_id, engine in self._engines.items()}
+        used = sum(sizes.values())
+        for catalog_id in list(self._engines):
+            if used <= self.memory_budget_bytes:
+                break
+            if catalog_id == keep:
+                continue
+            del self._engines[catalog_id]
+            used -= sizes[catalog_id]
+            self.evictions += 1
+            logger.info(f"Evicted catalog {catalog_id!r} ({sizes[catalog_id] / 2**20:.1f} MB) "
+                        f"to stay within the {self.memory_budget_bytes / 2**20:.0f} MB engine budget")
+        if used > self.memory_budget_bytes:
+            logger.warning(f"Catalog {keep!r} alone needs {used / 2**20:.1f} MB, "
+                           f"over the {self.memory_budget_bytes / 2**20:.0f} MB engine budget")
+
+    def stats(self):
+        with self._lock:
+            engines = list(self._engines.items())
+            loads, evictions = self.loads, self.evictions
+        sizes = {catalog_id: engine.memory_bytes() for catalog_id, engine in engines}
+        return {
+            "loaded": sizes,
+            "memory_bytes": sum(sizes.values()),
+            "memory_budget_bytes": self.memory_budget_bytes,
+            "loads": loads,
+            "evictions": evictions,
+        }
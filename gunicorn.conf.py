@@ -0,0 +1,17 @@
+# Gunicorn settings for the Flask API (gunicorn -c gunicorn.conf.py app:app)
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '10000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+
+# Import the app once in the master process...
+preload_app = True
+
+
+def when_ready(server):
+    # ...and load the index there before any worker is forked, so every worker
+    # shares the same pages copy-on-write instead of loading its own copy.
+    # No Gemini call is made here, so no gRPC channel exists across the fork.
+    from app import get_engine
+    get_engine()
@@ -0,0 +1,94 @@
+"""Versioned index directories, switched into place with one atomic rename.
+
+Each build is written to its own directory under ``<index_dir>/versions/``
+and published by pointing the ``<index_dir>/current`` symlink at it:
+
+    data/faiss_index/
+        current -> versions/20261018-120000-4242
+        versions/20261018-120000-4242/index.faiss, index.pkl, metadata.npz, ...
+        index.faiss -> current/index.faiss   (and likewise for the other files)
+
+Replacing ``current`` is a single os.replace, so there is never a moment
+without an index. A reader that opens the files one by one could still
+straddle a switch, so loaders resolve the directory once with
+resolve_index_dir and read every file from there. The top-level links keep
+``<index_dir>/index.faiss`` valid for existence checks and older tools. The
+previous version is kept, so a reader that resolved it just before a switch
+can finish loading it; older versions are deleted.
+
+Where symlinks are not available (Windows without developer mode), the
+files are moved into ``index_dir`` one by one instead.
+"""
+import logging
+import os
+import shutil
+import time
+
+from bm25 import BM25Index
+from embeddings import INDEX_INFO_FILE
+from metadata_store import MetadataStore
+
+logger = logging.getLogger(__name__)
+
+CURRENT_LINK = "current"
+VERSIONS_DIR = "versions"
+
+# Every file a build writes
+INDEX_FILE_NAMES = ("index.faiss", "index.pkl", MetadataStore.FILE_NAME, BM25Index.FILE_NAME, INDEX_INFO_FILE)
+
+
+def resolve_index_dir(index_dir):
+    """The directory holding the index version currently published at `index_dir`."""
+    current = os.path.join(index_dir, CURRENT_LINK)
+    if os.path.islink(current):
+        return os.path.realpath(current)
+    return index_dir
+
+
+def new_build_dir(index_dir):
+    """An empty directory to write a build into, later passed to publish_index_version."""
+    versions = os.path.join(index_dir, VERSIONS_DIR)
+    os.makedirs(versions, exist_ok=True)
+    # Dot-prefixed until published, so pruning never removes a build in progress
+    build_dir = os.path.join(versions, f".build-{os.getpid()}")
+    shutil.rmtree(build_dir, ignore_errors=True)
+    os.makedirs(build_dir)
+    return build_dir
+
+
+def _replace_with_link(path, target):
+    if os.path.islink(path) and os.readlink(path) == target:
+        return
+    tmp_link = f"{path}.tmp-{os.getpid()}"
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(target, tmp_link)
+    os.replace(tmp_link, path)
+
+
+def publish_index_version(build_dir, index_dir):
+    """Make the build written to `build_dir` the index served from `index_dir`."""
+    versions = os.path.join(index_dir, VERSIONS_DIR)
+    version = stamp = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+    suffix = 1
+    while os.path.exists(os.path.join(versions, version)):
+        # Several builds within a second
+        suffix += 1
+        version = f"{stamp}.{suffix}"
+    os.replace(build_dir, os.path.join(versions, version))
+    current = os.path.join(index_dir, CURRENT_LINK)
+    previous = os.path.basename(os.readlink(current)) if os.path.islink(current) else None
+    try:
+        _replace_with_link(current, os.path.join(VERSIONS_DIR, version))
+    except (OSError, NotImplementedError) as e:
+        logger.warning(f"Cannot create symlinks in {index_dir} ({str(e)}); moving the index files in place")
+        for name in INDEX_FILE_NAMES:
+            os.replace(os.path.join(versions, version, name), os.path.join(index_dir, name))
+        shutil.rmtree(versions, ignore_errors=True)
+        return
+    # Links are replaced one at a time, but loaders resolve `current`, which is already switched
+    for name in INDEX_FILE_NAMES:
+        _replace_with_link(os.path.join(index_dir, name), os.path.join(CURRENT_LINK, name))
+    for name in os.listdir(versions):
+        if name not in (version, previous) and not name.startswith("."):
+            shutil.rmtree(os.path.join(versions, name), ignore_errors=True)
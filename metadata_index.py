@@ -0,0 +1,89 @@
+import numpy as np
+
+# SHL test type codes: Ability & Aptitude, Biodata & Situational Judgement,
+# Competencies, Development & 360, Assessment Exercises, Knowledge & Skills,
+# Personality & Behavior, Simulations
+TEST_TYPE_CODES = "ABCDEKPS"
+TEST_TYPE_BITS = {code: 1 << i for i, code in enumerate(TEST_TYPE_CODES)}
+
+
+def test_type_mask(codes):
+    """Bitmask for an iterable of test type codes; unknown codes are ignored."""
+    mask = 0
+    for code in codes:
+        mask |= TEST_TYPE_BITS.get(code.strip().upper(), 0)
+    return mask
+
+
+class MetadataIndex:
+    """Columnar copy of the filterable document metadata, one row per FAISS id.
+
+    Hard query constraints are evaluated here with vectorized NumPy
+    comparisons, producing the set of FAISS ids a search may return. It is
+    stored on disk only as part of MetadataStore's metadata.npz.
+    """
+
+    def __init__(self, duration, test_types, remote, adaptive):
+        self.duration = duration
+        self.test_types = test_types
+        self.remote = remote
+        self.adaptive = adaptive
+
+    def __len__(self):
+        return len(self.duration)
+
+    @classmethod
+    def from_metadatas(cls, metadatas):
+        """Build the index from document metadata dicts, in FAISS id order."""
+        metadatas = list(metadatas)
+        duration = np.full(len(metadatas), np.nan, dtype=np.float32)
+        for i, metadata in enumerate(metadatas):
+            try:
+                value = float(metadata.get("duration"))
+            except (TypeError, ValueError):
+                continue
+            # The scraper records 0 when a page gives no completion time
+            if value > 0:
+                duration[i] = value
+        return cls(
+            duration=duration,
+            test_types=np.array([test_type_mask(str(m.get("test_type", "")).split()) for m in metadatas],
+                                dtype=np.uint32),
+            remote=np.array([m.get("remote") == "Yes" for m in metadatas], dtype=bool),
+            adaptive=np.array([m.get("adaptive") == "Yes" for m in metadatas], dtype=bool),
+        )
+
+    @classmethod
+    def from_docstore(cls, docstore, index_to_docstore_id):
+        """Build the index from a LangChain docstore and its FAISS id mapping."""
+        return cls.from_metadatas(docstore.search(index_to_docstore_id[i]).metadata
+                                  for i in range(len(index_to_docstore_id)))
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore):
+        """Build the index from a LangChain FAISS store."""
+        return cls.from_docstore(vectorstore.docstore, vectorstore.index_to_docstore_id)
+
+    def allowed_ids(self, max_duration=None, test_types=None, remote=None, adaptive=None):
+        """FAISS ids that satisfy every given constraint, or None if nothing is constrained.
+
+        Documents with an unknown duration pass a duration limit, since they are
+        not known to violate it. `test_types` matches documents sharing at least
+        one of the given codes.
+        """
+        mask = None
+
+        def narrow(condition):
+            return condition if mask is None else mask & condition
+
+        if max_duration is not None:
+            mask = narrow(np.isnan(self.duration) | (self.duration <= max_duration))
+        if test_types:
+            mask = narrow((self.test_types & test_type_mask(test_types)) != 0)
+        if remote:
+            mask = narrow(self.remote)
+        if adaptive:
+            mask = narrow(self.adaptive)
+        if mask is None:
+            return None
+        return np.flatnonzero(mask).astype(np.int64)
@@ -0,0 +1,102 @@
+import os
+from typing import List, Optional, TypedDict
+
+import numpy as np
+
+from metadata_index import MetadataIndex
+
+SHL_BASE_URL = "https://www.shl.com"
+
+
+class _AssessmentFields(TypedDict):
+    url: str
+    adaptive_support: str  # "Yes" / "No"
+    description: str  # the assessment name
+    duration: Optional[int]  # minutes; None when the catalog gives no time
+    remote_support: str  # "Yes" / "No"
+    test_type: List[str]  # test type codes, e.g. ["K", "P"]
+
+
+class AssessmentRecord(_AssessmentFields, total=False):
+    """One recommended assessment, the same in every mode, endpoint and frontend."""
+
+    rationale: str  # why the LLM picked it; LLM mode only
+
+
+class MetadataStore(MetadataIndex):
+    """All per-document metadata the engine serves, as NumPy columns indexed by FAISS id.
+
+    Extends the filter columns of MetadataIndex with fixed-width unicode
+    columns for the name, URL and test type codes. It is saved as a single
+    ``metadata.npz`` without pickle, so loading it builds no Python object per
+    document, and hits are turned into response records with column-wise
+    NumPy operations.
+    """
+
+    FILE_NAME = "metadata.npz"
+
+    def __init__(self, duration, test_types, remote, adaptive, name, url, test_type_codes):
+        super().__init__(duration, test_types, remote, adaptive)
+        self.name = name
+        self.url = url
+        self.test_type_codes = test_type_codes
+
+    @classmethod
+    def from_metadatas(cls, metadatas):
+        metadatas = list(metadatas)
+        filters = MetadataIndex.from_metadatas(metadatas)
+        return cls(
+            filters.duration, filters.test_types, filters.remote, filters.adaptive,
+            name=np.array([str(m.get("name", "")) for m in metadatas], dtype=np.str_),
+            url=np.array([str(m.get("url", "")) for m in metadatas], dtype=np.str_),
+            # "A\nE\nB" in the catalog becomes "A E B"
+            test_type_codes=np.array([" ".join(str(m.get("test_type", "")).split()) for m in metadatas],
+                                     dtype=np.str_),
+        )
+
+    def save(self, index_dir):
+        np.savez(os.path.join(index_dir, self.FILE_NAME), duration=self.duration,
+                 test_types=self.test_types, remote=self.remote, adaptive=self.adaptive,
+                 name=self.name, url=self.url, test_type_codes=self.test_type_codes)
+
+    @classmethod
+    def load(cls, index_dir):
+        with np.load(os.path.join(index_dir, cls.FILE_NAME), allow_pickle=False) as data:
+            return cls(data["duration"], data["test_types"], data["remote"], data["adaptive"],
+                       data["name"], data["url"], data["test_type_codes"])
+
+    def distinct(self, ids, k):
+        """First `k` of `ids` with a non-empty URL not seen earlier in `ids`."""
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0:
+            return ids
+        urls = self.url[ids]
+        _, first = np.unique(urls, return_index=True)
+        keep = np.zeros(len(ids), dtype=bool)
+        keep[first] = True
+        keep &= urls != ""
+        return ids[keep][:k]
+
+    def records(self, ids) -> List[AssessmentRecord]:
+        """`/recommend` response records for the documents with the given FAISS ids."""
+        ids = np.asarray(ids, dtype=np.int64)
+        urls = self.url[ids]
+        urls = np.where(np.char.startswith(urls, "http"), urls, np.char.add(SHL_BASE_URL, urls))
+        durations = self.duration[ids]
+        known = ~np.isnan(durations)
+        durations = np.where(known, durations, 0).astype(np.int64)
+        remote = np.where(self.remote[ids], "Yes", "No")
+        adaptive = np.where(self.adaptive[ids], "Yes", "No")
+        return [
+            {
+                "url": url,
+                "adaptive_support": adaptive_support,
+                "description": name,
+                "duration": duration if has_duration else None,
+                "remote_support": remote_support,
+                "test_type": codes.split(),
+            }
+            for url, adaptive_support, name, duration, has_duration, remote_support, codes in zip(
+                urls.tolist(), adaptive.tolist(), self.name[ids].tolist(), durations.tolist(),
+                known.tolist(), remote.tolist(), self.test_type_codes[ids].tolist())
+        ]
@@ -0,0 +1,307 @@
+"""In-process latency metrics in Prometheus text format, plus a sampling profiler.
+
+Histograms keep per-bucket counts under a lock; an observation is a bisect
+and three additions, so timing the hot path costs microseconds. Each process
+keeps its own numbers: with several gunicorn workers a scrape sees one
+worker, as with prometheus_client outside multiprocess mode.
+"""
+import bisect
+import collections
+import contextvars
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; spans cache hits (~1e-5) to slow LLM generations (~10 s)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # label values -> [per-bucket counts (+Inf last), sum]
+        self._series = {}
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+        for labelvalues, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labelvalues, [('le', le)])} "
+                             f"{cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = collections.defaultdict(float)
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for labelvalues, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {value}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("shl_stage_seconds", "Time spent in each recommendation stage", ["stage"])
+REQUEST_SECONDS = Histogram("shl_request_seconds", "HTTP request latency", ["endpoint", "status"])
+REQUESTS_TOTAL = Counter("shl_requests_total", "HTTP requests served", ["endpoint", "status"])
+REGISTRY = [STAGE_SECONDS, REQUEST_SECONDS, REQUESTS_TOTAL]
+
+# Stage timings of the request being handled, when something asked for them
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+_timings_lock = threading.Lock()
+
+
+def record_stage(stage, seconds):
+    """Add `seconds` to shl_stage_seconds{stage=...} and to the current request's timings."""
+    STAGE_SECONDS.observe(seconds, stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        # Batch generations of one request record from several threads
+        with _timings_lock:
+            timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def stage_timer(stage):
+    """Time the enclosed block with record_stage."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+
+def start_request_timing():
+    """Start collecting stage timings for the current request; returns a token for finish_request_timing."""
+    return _request_timings.set({})
+
+
+def request_timings():
+    """The current request's `{stage: seconds}` so far, or None if nothing is collecting them."""
+    return _request_timings.get()
+
+
+def finish_request_timing(token):
+    """Stop collecting and return the request's `{stage: seconds}`."""
+    timings = _request_timings.get() or {}
+    _request_timings.reset(token)
+    return timings
+
+
+def format_timing_header(timings, total=None):
+    """Server-Timing style value, e.g. "embed;dur=12.1, search;dur=0.4, total;dur=15.0" (milliseconds)."""
+    parts = [f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in timings.items()]
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+
+def render_metrics(extra_lines=()):
+    """Every registered metric, plus `extra_lines`, as Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    lines.extend(extra_lines)
+    return "\n".join(lines) + "\n"
+
+
+def sample_lines(name, metric_type, documentation, samples):
+    """Prometheus lines for a metric whose values are read elsewhere, from `[(labels dict, value), ...]`."""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_format_labels((), (), labels.items())} {value}")
+    return lines
+
+
+def engine_metric_lines(engines):
+    """Cache and LLM token metrics of every loaded engine, from `[(catalog_id, engine), ...]`.
+
+    Each series is labelled with its catalog, from the engine's cache_stats()
+    and token_stats().
+    """
+    stats = [(catalog, engine.cache_stats(), engine.token_stats()) for catalog, engine in engines]
+    lines = []
+    for field, metric_type, documentation in (
+        ("hits", "counter", "Query cache hits"),
+        ("misses", "counter", "Query cache misses"),
+        ("evictions", "counter", "Query cache evictions"),
+        ("size", "gauge", "Query cache entries"),
+        ("hit_rate", "gauge", "Query cache hits per lookup since startup"),
+    ):
+        name = f"shl_cache_{field}_total" if metric_type == "counter" else f"shl_cache_{field}"
+        lines.extend(sample_lines(name, metric_type, documentation,
+                                  [({"catalog": catalog, "cache": cache}, cache_stats[cache][field])
+                                   for catalog, cache_stats, _ in stats for cache in cache_stats]))
+    for field, documentation in (
+        ("requests", "LLM generations with usage metadata"),
+        ("prompt_tokens", "LLM prompt tokens"),
+        ("response_tokens", "LLM response tokens"),
+    ):
+        lines.extend(sample_lines(f"shl_llm_{field}_total", "counter", documentation,
+                                  [({"catalog": catalog}, token_stats[field]) for catalog, _, token_stats in stats]))
+    return lines
+
+
+def upstream_metric_lines(engines):
+    """Upstream call, circuit breaker and fallback metrics from `[(catalog_id, engine), ...]`.
+
+    Fallbacks are counted per engine and labelled with its catalog. Engines
+    of one process normally share their upstream clients, so a client's
+    series is written once, for the first engine that has it.
+    """
+    clients = {}
+    fallbacks = []
+    for catalog, engine in engines:
+        stats = engine.upstream_stats()
+        for name, client in stats.items():
+            if name != "fallbacks":
+                clients.setdefault(name, client)
+        fallbacks.extend(({"catalog": catalog, "kind": kind}, count) for kind, count in stats["fallbacks"].items())
+    lines = []
+    for field, documentation in (
+        ("calls", "Upstream calls"),
+        ("failures", "Upstream calls that failed"),
+        ("timeouts", "Upstream calls that missed their deadline"),
+        ("rejected", "Upstream calls refused by an open circuit"),
+        ("retries", "Upstream attempts retried after a failure"),
+        ("hedges", "Hedged upstream attempts started"),
+        ("hedge_wins", "Upstream calls answered by the hedged attempt"),
+    ):
+        lines.extend(sample_lines(f"shl_upstream_{field}_total", "counter", documentation,
+                                  [({"upstream": name}, client[field]) for name, client in clients.items()]))
+    lines.extend(sample_lines("shl_upstream_circuit_open", "gauge", "1 while the upstream's circuit is not closed",
+                              [({"upstream": name}, int(client["state"] != "closed"))
+                               for name, client in clients.items()]))
+    lines.extend(sample_lines("shl_fallbacks_total", "counter", "Degraded results served while an upstream was down",
+                              fallbacks))
+    return lines
+
+
+def registry_metric_lines(stats):
+    """Loaded catalogs and their memory, from EngineRegistry.stats()."""
+    lines = sample_lines("shl_engine_memory_bytes", "gauge", "Approximate index memory of each loaded catalog",
+                         [({"catalog": catalog}, size) for catalog, size in stats["loaded"].items()])
+    if stats["memory_budget_bytes"] is not None:
+        lines.extend(sample_lines("shl_engine_memory_budget_bytes", "gauge", "Memory budget for loaded catalogs",
+                                  [({}, stats["memory_budget_bytes"])]))
+    lines.extend(sample_lines("shl_engine_loads_total", "counter", "Catalog engines loaded", [({}, stats["loads"])]))
+    lines.extend(sample_lines("shl_engine_evictions_total", "counter", "Catalog engines evicted over the memory budget",
+                              [({}, stats["evictions"])]))
+    return lines
+
+
+class SamplingProfiler:
+    """Samples every thread's Python stack at a fixed interval while running.
+
+    Stacks are aggregated in collapsed form ("outer;inner;leaf count"), ready
+    for flamegraph.pl or speedscope. It can be started and stopped at
+    runtime; while stopped it costs nothing.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples_lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.interval = 0.005
+        self.samples = collections.Counter()
+        self.started_at = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval=0.005):
+        with self._lock:
+            if self.running:
+                return
+            self.interval = interval
+            with self._samples_lock:
+                self.samples.clear()
+            self.started_at = time.time()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            stacks = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]})")
+                    frame = frame.f_back
+                stacks.append(";".join(reversed(stack)))
+            with self._samples_lock:
+                self.samples.update(stacks)
+
+    def collapsed(self):
+        """Aggregated stacks, most sampled first, one "stack count" per line."""
+        with self._samples_lock:
+            samples = self.samples.most_common()
+        return "\n".join(f"{stack} {count}" for stack, count in samples) + "\n"
+
+    def status(self):
+        with self._samples_lock:
+            total = sum(self.samples.values())
+        return {
+            "running": self.running,
+            "interval": self.interval,
+            "started_at": self.started_at,
+            "samples": total,
+        }
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,74 @@
+import re
+
+# "30-45 minutes", "30 to 45 mins"
+_DURATION_RANGE = re.compile(r"(\d+)\s*(?:-|–|to)\s*(\d+)\s*(?:minutes?|mins?)\b")
+# "40 minutes", "40 min", "40-minute"
+_DURATION_MINUTES = re.compile(r"(\d+)\s*-?\s*(?:minutes?|mins?)\b")
+# "1 hour", "1.5 hrs"
+_DURATION_HOURS = re.compile(r"(\d+(?:\.\d+)?)\s*-?\s*(?:hours?|hrs?)\b")
+_HALF_HOUR = re.compile(r"\bhalf (?:an )?hour\b")
+_ONE_HOUR = re.compile(r"\b(?:an|one) hour\b")
+
+# Only an explicit request for remote testing: "remote testing", "taken
+# remotely", "online assessment". On its own "remote", "online" or "virtual"
+# usually describes the job ("online marketing manager", "virtual assistant"),
+# and the constraint rules out every assessment without remote support
+_REMOTE = re.compile(
+    r"\b(?:(?:remote(?:ly)?|online|virtual(?:ly)?)[- ](?:test(?:s|ing|ed)?|assess(?:ments?|ed)|exams?|"
+    r"proctor(?:ing|ed)?|administ(?:ered|ration)|delivered)|"
+    r"(?:take|taken|taking|sit|sat|complete|completed|administer|administered|deliver|delivered)\b"
+    r"(?: \w+){0,3} remotely)\b"
+)
+
+_ADAPTIVE = re.compile(r"\b(?:adaptive|irt)\b")
+
+# Phrases that name an SHL test type outright. "knowledge" and "behavioural"
+# alone usually describe the candidate ("SEO knowledge"), so they count only
+# when they name the test ("knowledge test", "behavioral assessment")
+_TEST_KIND = r"(?:tests?|testing|assessments?|exams?|questionnaires?)"
+_TEST_TYPES = {
+    "A": re.compile(r"\b(?:cognitive|aptitude|reasoning|numerical|verbal ability)\b"),
+    "B": re.compile(r"\b(?:situational judge?ments?|biodata)\b"),
+    "C": re.compile(r"\bcompetenc(?:y|ies)\b"),
+    "D": re.compile(r"\b(?:360|development report)\b"),
+    "E": re.compile(r"\bassessment exercises?\b"),
+    "K": re.compile(rf"\bknowledge(?: and skills?)?[- ]{_TEST_KIND}\b"),
+    "P": re.compile(rf"\b(?:personality|behaviou?ral?[- ]{_TEST_KIND})\b"),
+    "S": re.compile(r"\bsimulations?\b"),
+}
+
+
+def parse_query_constraints(query):
+    """Extract hard constraints from a free-text hiring query.
+
+    Returns a dict with:
+    - max_duration: longest acceptable test duration in minutes, or None
+    - remote: True if the query explicitly asks for remote testing, otherwise None
+    - adaptive: True if adaptive/IRT support is required, otherwise None
+    - test_types: list of SHL test type codes the query explicitly asks
+      for (any of them is acceptable), or None
+
+    When a query mentions several durations the most permissive one wins,
+    so a constraint never rules out more than the query asked for.
+    """
+    text = query.lower()
+    limits = []
+
+    for match in _DURATION_RANGE.finditer(text):
+        limits.append(int(match.group(2)))
+    text_without_ranges = _DURATION_RANGE.sub(" ", text)
+    for match in _DURATION_MINUTES.finditer(text_without_ranges):
+        limits.append(int(match.group(1)))
+    for match in _DURATION_HOURS.finditer(text):
+        limits.append(int(float(match.group(1)) * 60))
+    if _HALF_HOUR.search(text):
+        limits.append(30)
+    elif _ONE_HOUR.search(text):
+        limits.append(60)
+
+    return {
+        "max_duration": max(limits) if limits else None,
+        "remote": True if _REMOTE.search(text) else None,
+        "adaptive": True if _ADAPTIVE.search(text) else None,
+        "test_types": [code for code, pattern in _TEST_TYPES.items() if pattern.search(text)] or None,
+    }
@@ -1,108 +1,829 @@
-from langchain_community.vectorstores import FAISS
-from langchain_core.prompts import PromptTemplate
 import google.generativeai as genai
-import pandas as pd
 import os
+import pickle
+import shutil
+import time
+import logging
+import threading
+import asyncio
+import contextvars
+import json
+import textwrap
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import faiss
+import numpy as np
 from dotenv import load_dotenv
-from langchain_core.embeddings import Embeddings
-from typing import List
+from embeddings import backend_from_index_info, check_index_info, get_embedding_backend, read_index_info
+from query_cache import TTLCache, normalize_query
+from semantic_cache import SemanticCache
+from query_parser import parse_query_constraints
+from metadata_store import MetadataStore
+from bm25 import BM25Index, fusion_weights, reciprocal_rank_fusion
+from index_versions import resolve_index_dir
+from ann_index import DEFAULT_EF_SEARCH, DEFAULT_NPROBE, search_parameters
+from structured_output import RESPONSE_SCHEMA, SelectionStreamParser, StructuredOutputError, parse_selection
+from token_budget import TokenUsage, estimate_tokens, lines_within_budget
+from metrics import record_stage, stage_timer
+from upstream import UpstreamClient, UpstreamUnavailable, configure_gemini, request_options
 
 # Load environment variables
 load_dotenv()
 
-# Custom embedding class for Google GenAI, inheriting from langchain_core.embeddings.Embeddings
-class GoogleGenAIEmbeddings(Embeddings):
-    def __init__(self, model="models/embedding-001"):
-        self.model = model
+logger = logging.getLogger(__name__)
 
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        """Embed a list of documents."""
-        embeddings = []
-        for text in texts:
-            result = genai.embed_content(model=self.model, content=text)
-            embeddings.append(result["embedding"])
-        return embeddings
+# Files whose modification invalidates the loaded index and every cached result
+INDEX_FILES = ("index.faiss", "index.pkl")
 
-    def embed_query(self, text: str) -> List[float]:
-        """Embed a single query."""
-        result = genai.embed_content(model=self.model, content=text)
-        return result["embedding"]
+# Everything loaded from one version of the index directory, swapped as a unit on reload
+IndexSnapshot = namedtuple("IndexSnapshot", ["index", "metadata", "bm25", "signature"])
+
+# Hits each retriever contributes before reciprocal-rank fusion
+FUSION_CANDIDATES = 50
+
+# Most distinct assessments offered to the LLM to choose from; the prompt
+# token budget decides how many of them are actually sent
+LLM_CANDIDATES = 15
+
+# Recommendations returned by the LLM at most
+MAX_RECOMMENDATIONS = 10
+
+# Estimated tokens allowed per prompt (instructions, query and candidates)
+# and tokens allowed per response (about 10 ids with one-sentence rationales)
+DEFAULT_PROMPT_TOKEN_BUDGET = 400
+DEFAULT_MAX_OUTPUT_TOKENS = 512
+
+# LLM results kept for paraphrased queries, and the cosine similarity two
+# query embeddings need for one's result to be served for the other
+DEFAULT_SEMANTIC_CACHE_SIZE = 256
+DEFAULT_SEMANTIC_THRESHOLD = 0.95
+
+# Deadlines for one query embedding and one LLM generation, retries included
+DEFAULT_EMBED_TIMEOUT = 5.0
+DEFAULT_GENERATE_TIMEOUT = 20.0
 
 class RecommendationEngine:
-    def __init__(self, csv_path, index_dir):
-        if not os.path.exists(csv_path):
-            raise FileNotFoundError(f"CSV file not found at {csv_path}")
-        self.data = pd.read_csv(csv_path)
+    def __init__(self, csv_path, index_dir, cache_size=1024, cache_ttl=3600, embedding_backend=None,
+                 ef_search=DEFAULT_EF_SEARCH, nprobe=DEFAULT_NPROBE,
+                 prompt_token_budget=DEFAULT_PROMPT_TOKEN_BUDGET, max_output_tokens=DEFAULT_MAX_OUTPUT_TOKENS,
+                 model=None, semantic_cache_size=DEFAULT_SEMANTIC_CACHE_SIZE,
+                 semantic_threshold=DEFAULT_SEMANTIC_THRESHOLD, embed_upstream=None, generate_upstream=None):
+        """`embedding_backend` is a backend name ("google", "hashing") or an
+        Embeddings instance; by default the backend recorded with the index is
+        used. Either way it must match the one that built the index.
+
+        `ef_search` (HNSW indexes) and `nprobe` (IVF indexes) trade recall for
+        latency; both are plain attributes and can be changed at runtime.
+
+        `prompt_token_budget` caps the estimated size of each LLM prompt: as
+        many retrieved candidates are included as fit. `max_output_tokens`
+        caps each response.
+
+        `model` replaces the Gemini model with anything offering the same
+        generate_content / generate_content_async calls, such as the local
+        stand-in the offline benchmarks use.
+
+        LLM recommendations are also cached by query embedding: a query whose
+        embedding has cosine similarity of at least `semantic_threshold` with
+        a cached one, and the same parsed constraints, gets its result without
+        calling Gemini. `semantic_cache_size=0` turns this off.
+
+        Query embeddings and generations go through `embed_upstream` and
+        `generate_upstream` (upstream.UpstreamClient: deadline, concurrency
+        limit, circuit breaker, hedging), which engines can share. When
+        embedding is unavailable the engine searches by keyword only; when
+        generation is, it returns the retrieved candidates in ranked order.
+        Neither degraded result is cached.
+        """
+        # Everything the engine serves comes from the index; csv_path is only
+        # kept for callers that still pass it
+        started = time.perf_counter()
+        self.csv_path = csv_path
 
         # Load FAISS index
         index_faiss_path = os.path.join(index_dir, "index.faiss")
         if not os.path.exists(index_faiss_path):
             raise FileNotFoundError(f"FAISS index file not found at {index_faiss_path}")
         
-        # Initialize Google GenAI
+        if embedding_backend is None:
+            self.embeddings = backend_from_index_info(read_index_info(index_dir))
+        elif isinstance(embedding_backend, str):
+            self.embeddings = get_embedding_backend(embedding_backend)
+        else:
+            self.embeddings = embedding_backend
+
+        # Initialize Google GenAI. Only the Google embedding backend needs it to
+        # load; with a local backend, retrieval-only mode works without a key
         google_api_key = os.getenv("GOOGLE_API_KEY")
-        if not google_api_key:
+        if google_api_key:
+            try:
+                configure_gemini(google_api_key)
+            except Exception as e:
+                raise ValueError(f"Failed to configure Google GenAI: {str(e)}")
+        elif getattr(self.embeddings, "requires_api_key", True):
             raise ValueError("GOOGLE_API_KEY not found in .env file.")
-        try:
-            genai.configure(api_key=google_api_key)
-        except Exception as e:
-            raise ValueError(f"Failed to configure Google GenAI: {str(e)}")
+        else:
+            logger.warning("GOOGLE_API_KEY not set: only retrieval-only recommendations are available")
         
-        self.embeddings = GoogleGenAIEmbeddings()
-        self.faiss_index = FAISS.load_local(index_dir, self.embeddings, allow_dangerous_deserialization=True)
+        self.index_dir = index_dir
+        self.ef_search = ef_search
+        self.nprobe = nprobe
+        self.prompt_token_budget = prompt_token_budget
+        self.max_output_tokens = max_output_tokens
+        self.token_usage = TokenUsage()
+        self.embed_upstream = (embed_upstream if embed_upstream is not None
+                               else UpstreamClient("embed", timeout=DEFAULT_EMBED_TIMEOUT))
+        self.generate_upstream = (generate_upstream if generate_upstream is not None
+                                  else UpstreamClient("generate", timeout=DEFAULT_GENERATE_TIMEOUT))
+        self._fallback_lock = threading.Lock()
+        self.fallbacks = {"keyword_search": 0, "retrieval_only": 0}
+        self._index_lock = threading.Lock()
+        self._snapshot = self._load_index()
+
+        # Query embeddings and final results are cached separately: an embedding
+        # stays valid across index rebuilds, a result does not
+        self.embedding_cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self.result_cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self.semantic_cache = (SemanticCache(maxsize=semantic_cache_size, threshold=semantic_threshold,
+                                             ttl=cache_ttl) if semantic_cache_size else None)
 
         # Initialize Gemini model
-        self.model = genai.GenerativeModel("gemini-1.5-flash")
-
-        # Define prompt template
-        self.prompt_template = """
-        Given the following query: "{query}"
-        And the retrieved assessments: {retrieved_docs}
-
-        Recommend up to 10 relevant SHL assessments in a properly formatted markdown table with the following columns:
-        - Assessment Name
-        - Remote Testing Support (Yes/No)
-        - Adaptive/IRT Support (Yes/No)
-        - Test Type (with meaning)
-        - Test Duration (in minutes) 
-        - URL (use actual URLs from the metadata)
-
-        Use this exact table format:
-        | Assessment Name | Remote Testing Support | Adaptive/IRT Support | Test Type (with meaning) | Test Duration | URL |
-        |-----------------|-------------------------|----------------------|--------------------------|---------------|-----|
-        | [Name 1]        | Yes                     | No                   | [Type 1]                 | 30            | [URL 1] |
-        | [Name 2]        | No                      | Yes                  | [Type 2]                 | 45            | [URL 2] |
-
-        Ensure all recommendations meet any duration or other requirements mentioned in the query.
-        Return ONLY the markdown table (no additional text).
-        """
+        self.model = model if model is not None else genai.GenerativeModel("gemini-1.5-flash")
+
+        # Define prompt template. The response is JSON constrained by
+        # RESPONSE_SCHEMA: the model only picks ids, the server fills in the
+        # rest, so candidates carry only what the choice depends on
+        self.prompt_template = textwrap.dedent("""\
+            Query: "{query}"
+            Candidate assessments, one per line: [id] name | test types | minutes | support
+            {retrieved_docs}
+            Pick up to {max_results} candidates that best fit the query, best first, each with a one-sentence
+            rationale. Every pick must meet the query's duration and other requirements. Refer to candidates by id.""")
         
-        self.prompt = PromptTemplate.from_template(self.prompt_template)
-
-    def get_recommendations(self, query):
-        docs = self.faiss_index.similarity_search(query, k=10)
-        retrieved_docs = "\n".join([
-            f"{doc.metadata['name']} - Remote: {doc.metadata['remote']}, Adaptive: {doc.metadata['adaptive']}, "
-            f"Type: {doc.metadata['test_type']}, Duration: {doc.metadata['duration'] if doc.metadata['duration'] is not None else 'Variable Time'}, "
-            f"URL: https://www.shl.com{doc.metadata['url']}"
-            for doc in docs
-        ])
-
-        formatted_prompt = self.prompt.format(query=query, retrieved_docs=retrieved_docs)
+        self.prompt = self.prompt_template
+
+        # Upstream calls currently running on the event loop, by cache key, so
+        # identical concurrent async requests share one call
+        self._inflight = {}
+
+        self.startup_seconds = time.perf_counter() - started
+        logger.info(f"Recommendation engine ready in {self.startup_seconds:.2f}s")
+
+    def _read_index_signature(self, index_dir):
+        signature = [index_dir]
+        for name in INDEX_FILES:
+            stat = os.stat(os.path.join(index_dir, name))
+            signature.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+        return tuple(signature)
+
+    def _load_index(self):
+        """Load index.faiss, its columnar metadata store and its BM25 index.
+
+        Every file is read from the one version directory `index_dir` points
+        at when loading starts, so a build published meanwhile cannot mix
+        files from two versions into the snapshot.
+
+        The FAISS file is opened with IO_FLAG_MMAP so index types that support
+        it (IVF inverted lists) are paged in from disk on demand and shared
+        between processes; flat codes are read into memory, which gunicorn
+        workers share copy-on-write when the engine is preloaded in the master.
+        """
+        index_dir = resolve_index_dir(self.index_dir)
+        signature = self._read_index_signature(index_dir)
+        index = faiss.read_index(os.path.join(index_dir, "index.faiss"),
+                                 faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        # Query vectors from any other backend would be meaningless against this index
+        check_index_info(read_index_info(index_dir), self.embeddings, index.d)
+        metadata = bm25 = None
+        if os.path.exists(os.path.join(index_dir, MetadataStore.FILE_NAME)):
+            metadata = MetadataStore.load(index_dir)
+        if os.path.exists(os.path.join(index_dir, BM25Index.FILE_NAME)):
+            bm25 = BM25Index.load(index_dir)
+        stale_metadata = metadata is None or len(metadata) != index.ntotal
+        stale_bm25 = bm25 is None or len(bm25) != index.ntotal
+        if stale_metadata or stale_bm25:
+            # Indexes built before metadata.npz / bm25.npz existed: fall back to
+            # the pickled LangChain docstore and write the converted files next
+            # to the index, so later loads and reloads skip the pickle
+            with open(os.path.join(index_dir, "index.pkl"), "rb") as f:
+                docstore, index_to_docstore_id = pickle.load(f)
+            converted = []
+            if stale_metadata:
+                metadata = MetadataStore.from_docstore(docstore, index_to_docstore_id)
+                converted.append(metadata)
+            if stale_bm25:
+                bm25 = BM25Index.from_docstore(docstore, index_to_docstore_id)
+                converted.append(bm25)
+            self._save_converted(index_dir, converted)
+        return IndexSnapshot(index, metadata, bm25, signature)
+
+    @staticmethod
+    def _save_converted(index_dir, stores):
+        """Save MetadataStore / BM25Index `stores` converted from index.pkl into `index_dir`."""
+        tmp_dir = os.path.join(index_dir, f".convert-{os.getpid()}")
+        try:
+            os.makedirs(tmp_dir, exist_ok=True)
+            # Written aside and renamed in, so another worker never loads a half-written file
+            for store in stores:
+                store.save(tmp_dir)
+                os.replace(os.path.join(tmp_dir, store.FILE_NAME), os.path.join(index_dir, store.FILE_NAME))
+            logger.info(f"Converted the pickled docstore of {index_dir} to "
+                        f"{', '.join(store.FILE_NAME for store in stores)}")
+        except OSError as e:
+            logger.warning(f"Cannot save the converted docstore in {index_dir} ({str(e)}); it will be unpickled "
+                           f"again on every load until the index is rebuilt with create_faiss_index.py")
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _reload_index_if_changed(self):
+        """Reload the FAISS index and drop cached results if the files on disk changed."""
+        try:
+            signature = self._read_index_signature(resolve_index_dir(self.index_dir))
+        except FileNotFoundError:
+            # An index written by an older builder is being swapped; keep serving the loaded index
+            return
+        if signature == self._snapshot.signature:
+            return
+        with self._index_lock:
+            if signature == self._snapshot.signature:
+                return
+            try:
+                snapshot = self._load_index()
+            except Exception as e:
+                logger.error(f"Failed to reload FAISS index from {self.index_dir}: {str(e)}")
+                return
+            self._snapshot = snapshot
+            self.result_cache.clear()
+            if self.semantic_cache is not None:
+                self.semantic_cache.clear()
+            logger.info(f"Reloaded FAISS index from {self.index_dir}")
+
+    def _search(self, snapshot, query, embedding, k, constraints=None, weights=None):
+        """FAISS ids of the `k` best documents for `query` among those meeting the hard `constraints`.
+
+        The constraints are resolved to an allowed FAISS id set first, and both
+        retrievers only consider those ids, so every hit satisfies them.
+        """
+        with stage_timer("search"):
+            return self._search_many(snapshot, [query], [embedding], k, constraints, weights)[0]
+
+    def _search_many(self, snapshot, queries, embeddings, k, constraints=None, weights=None):
+        """Hybrid search for several queries sharing the same constraints.
+
+        The FAISS hits (one multi-query search for all `embeddings`) and the
+        BM25 hits for each query are merged with reciprocal-rank fusion,
+        weighted by `weights` as returned by bm25.fusion_weights. A retriever
+        with weight 0 is not run at all.
+        """
+        vector_weight, lexical_weight, _ = weights = weights or fusion_weights()
+        allowed_ids = snapshot.metadata.allowed_ids(**constraints) if constraints else None
+        if allowed_ids is not None and len(allowed_ids) == 0:
+            return [np.empty(0, dtype=np.int64) for _ in queries]
+        if not lexical_weight:
+            return self._vector_search_many(snapshot, embeddings, k, allowed_ids)
+        depth = max(k, FUSION_CANDIDATES)
+        lexical = [snapshot.bm25.search(query, depth, allowed_ids) for query in queries]
+        if not vector_weight:
+            return [ids[:k] for ids in lexical]
+        vector = self._vector_search_many(snapshot, embeddings, depth, allowed_ids)
+        return [reciprocal_rank_fusion(vector_ids, lexical_ids, weights, k)
+                for vector_ids, lexical_ids in zip(vector, lexical)]
+
+    def _vector_search_many(self, snapshot, embeddings, k, allowed_ids=None):
+        """Run one FAISS search for a matrix of query embeddings, restricted to `allowed_ids` if given."""
+        index = snapshot.index
+        selector = faiss.IDSelectorBatch(allowed_ids) if allowed_ids is not None else None
+        params = search_parameters(index, k, selector, ef_search=self.ef_search, nprobe=self.nprobe)
+        k = min(k, index.ntotal if allowed_ids is None else len(allowed_ids))
+        if k == 0:
+            return [np.empty(0, dtype=np.int64) for _ in embeddings]
+        _, ids = index.search(np.asarray(embeddings, dtype=np.float32), k, params=params)
+        return [row[row != -1] for row in ids]
+
+    def _embed_query(self, query, cache_key):
+        """The query's embedding, or None if the embedding API is unavailable."""
+        embedding = self.embedding_cache.get(cache_key)
+        if embedding is None:
+            try:
+                with stage_timer("embed"):
+                    embedding = self.embed_upstream.call(
+                        lambda timeout: self.embeddings.embed_query(query, **self._embed_options(timeout)))
+            except UpstreamUnavailable as e:
+                self._count_fallback("keyword_search", e)
+                return None
+            self.embedding_cache.set(cache_key, embedding)
+        return embedding
+
+    def _embed_options(self, timeout):
+        """Keyword arguments passing the upstream deadline to the embedding call, where the backend takes one."""
+        # Other LangChain Embeddings have no timeout parameter; their calls are
+        # abandoned at the deadline but run to completion in the background
+        return {"timeout": timeout} if getattr(self.embeddings, "supports_timeout", False) else {}
+
+    def _count_fallback(self, kind, error):
+        with self._fallback_lock:
+            self.fallbacks[kind] += 1
+        logger.warning(f"{error}: serving {kind.replace('_', ' ')} results")
+
+    @staticmethod
+    def _search_weights(weights, embedding):
+        # Without a query embedding only the keyword retriever can run
+        if embedding is not None:
+            return weights
+        _, lexical_weight, rrf_k = weights
+        return 0.0, lexical_weight or 1.0, rrf_k
+
+    async def _coalesce(self, key, make_coroutine):
+        """Await the in-flight call for `key`, starting one only if none is running."""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(make_coroutine())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # A client that disconnects must not cancel the call other requests are waiting on
+        return await asyncio.shield(task)
+
+    async def _aembed_query(self, query, cache_key):
+        embedding = self.embedding_cache.get(cache_key)
+        if embedding is None:
+            try:
+                with stage_timer("embed"):
+                    embedding = await self._coalesce(("embed", cache_key), lambda: self.embed_upstream.acall(
+                        lambda timeout: self.embeddings.aembed_query(query, **self._embed_options(timeout))))
+            except UpstreamUnavailable as e:
+                self._count_fallback("keyword_search", e)
+                return None
+            self.embedding_cache.set(cache_key, embedding)
+        return embedding
+
+    def get_retrieval_recommendations(self, query, k=10, candidates=50, fusion=None):
+        """Recommend assessments straight from the FAISS hits, without calling the LLM.
+
+        Constraints parsed from the query (duration, test type, remote,
+        adaptive) filter the search itself; up to `candidates` hits are
+        fetched and the first `k` distinct assessments are returned as
+        `/recommend` records. `fusion` sets the vector/BM25 weighting (see
+        bm25.fusion_weights) and raises ValueError if invalid.
+        """
+        weights = fusion_weights(fusion)
+        self._reload_index_if_changed()
+        snapshot = self._snapshot
+        cache_key = normalize_query(query)
+        result_key = (snapshot.signature, "retrieval", k, weights, cache_key)
+        cached = self.result_cache.get(result_key)
+        if cached is not None:
+            return cached
+
+        embedding = self._embed_query(query, cache_key)
+        ids = self._search(snapshot, query, embedding, max(k, candidates), parse_query_constraints(query),
+                           self._search_weights(weights, embedding))
+        with stage_timer("parse"):
+            records = snapshot.metadata.records(snapshot.metadata.distinct(ids, k))
+        if embedding is not None:
+            self.result_cache.set(result_key, records)
+        return records
+
+    async def aget_retrieval_recommendations(self, query, k=10, candidates=50, fusion=None):
+        """Async variant of get_retrieval_recommendations."""
+        weights = fusion_weights(fusion)
+        self._reload_index_if_changed()
+        snapshot = self._snapshot
+        cache_key = normalize_query(query)
+        result_key = (snapshot.signature, "retrieval", k, weights, cache_key)
+        cached = self.result_cache.get(result_key)
+        if cached is not None:
+            return cached
+
+        embedding = await self._aembed_query(query, cache_key)
+        ids = self._search(snapshot, query, embedding, max(k, candidates), parse_query_constraints(query),
+                           self._search_weights(weights, embedding))
+        with stage_timer("parse"):
+            records = snapshot.metadata.records(snapshot.metadata.distinct(ids, k))
+        if embedding is not None:
+            self.result_cache.set(result_key, records)
+        return records
+
+    def cache_stats(self):
+        stats = {
+            "query_embeddings": self.embedding_cache.stats(),
+            "results": self.result_cache.stats(),
+        }
+        if self.semantic_cache is not None:
+            stats["semantic"] = self.semantic_cache.stats()
+        return stats
+
+    def memory_bytes(self):
+        """Approximate memory held by the loaded index: the size of the files it was loaded from."""
+        sizes = {}
+        for name in INDEX_FILES + (MetadataStore.FILE_NAME, BM25Index.FILE_NAME):
+            try:
+                sizes[name] = os.path.getsize(os.path.join(self.index_dir, name))
+            except OSError:
+                pass
+        # The pickled docstore is only read for indexes without metadata.npz / bm25.npz
+        if MetadataStore.FILE_NAME in sizes and BM25Index.FILE_NAME in sizes:
+            sizes.pop("index.pkl", None)
+        return sum(sizes.values())
+
+    @staticmethod
+    def _constraint_key(constraints):
+        """Hashable form of parse_query_constraints' result."""
+        return tuple(sorted((name, tuple(value) if isinstance(value, list) else value)
+                            for name, value in constraints.items()))
+
+    def _semantic_scope(self, snapshot, weights, constraints):
+        # A paraphrase may only stand in for a query with the same hard constraints
+        return snapshot.signature, weights, self._constraint_key(constraints)
+
+    def _semantic_get(self, embedding, scope):
+        if self.semantic_cache is None or embedding is None:
+            return None
+        return self.semantic_cache.get(embedding, scope)
+
+    def _semantic_set(self, embedding, scope, records):
+        if self.semantic_cache is not None and embedding is not None:
+            self.semantic_cache.set(embedding, scope, records)
+
+    def _cache_result(self, result_key, embedding, scope, records):
+        # Results picked from keyword-only candidates stand in for a missing embedding; they are not kept
+        if embedding is None:
+            return
+        self.result_cache.set(result_key, records)
+        self._semantic_set(embedding, scope, records)
+
+    def get_recommendations(self, query, fusion=None):
+        """Recommend assessments chosen by the LLM from the retrieved candidates.
+
+        Returns `/recommend` records, each with the model's `rationale`, or an
+        empty list when no assessment meets the query's constraints. When
+        Gemini is unavailable the best retrieved candidates are returned
+        without rationales. Raises if Gemini rejects the request or returns
+        malformed output.
+        """
+        weights = fusion_weights(fusion)
+        self._reload_index_if_changed()
+        snapshot = self._snapshot
+        cache_key = normalize_query(query)
+        # Keying results on the index version keeps a request that raced a
+        # reload from caching an answer computed against the old index
+        result_key = (snapshot.signature, "llm", weights, cache_key)
+        cached = self.result_cache.get(result_key)
+        if cached is not None:
+            return cached
+
+        embedding = self._embed_query(query, cache_key)
+        constraints = parse_query_constraints(query)
+        scope = self._semantic_scope(snapshot, weights, constraints)
+        records = self._semantic_get(embedding, scope)
+        if records is not None:
+            self.result_cache.set(result_key, records)
+            return records
+        ids = self._llm_candidates(snapshot, query, embedding, weights, constraints)
+        if not len(ids):
+            return []
+        return self._generate(query, snapshot, ids, result_key, embedding, scope)
+
+    def _llm_candidates(self, snapshot, query, embedding, weights, constraints):
+        # Hard constraints are enforced by the search, not left to the LLM
+        ids = self._search(snapshot, query, embedding, 2 * LLM_CANDIDATES, constraints,
+                           self._search_weights(weights, embedding))
+        return snapshot.metadata.distinct(ids, LLM_CANDIDATES)
+
+    def _generate(self, query, snapshot, ids, result_key, embedding, scope):
+        formatted_prompt, offered = self._format_prompt(query, snapshot, ids)
         
         # Use Gemini model for text generation
         try:
-            response = self.model.generate_content(
-                formatted_prompt,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=0.7,
-                    max_output_tokens=1000
-                )
-            )
-            return response.candidates[0].content.parts[0].text.strip()
+            with stage_timer("generate"):
+                response = self.generate_upstream.call(lambda timeout: self.model.generate_content(
+                    formatted_prompt, generation_config=self._generation_config(),
+                    request_options=request_options(timeout)))
+            self._record_usage(response, formatted_prompt)
+            with stage_timer("parse"):
+                selections, complete = parse_selection(response.text, len(offered))
+                records = self._selected_records(snapshot, offered, selections)
+        except (UpstreamUnavailable, StructuredOutputError) as e:
+            return self._fallback_records(snapshot, ids, e)
+        except Exception as e:
+            logger.error(f"Error generating recommendations: {str(e)}")
+            raise
+        # A response cut short is served but not cached, as in iter_recommendations_stream
+        if complete:
+            self._cache_result(result_key, embedding, scope, records)
+        return records
+
+    def _fallback_records(self, snapshot, ids, error):
+        """The LLM candidates `ids` in ranked order, without rationales, for when Gemini gives no usable answer."""
+        self._count_fallback("retrieval_only", error)
+        return snapshot.metadata.records(ids[:MAX_RECOMMENDATIONS])
+
+    @staticmethod
+    def _selected_records(snapshot, ids, selections):
+        """`/recommend` records for the LLM's `(candidate position, rationale)` selections, in its order."""
+        if not selections:
+            return []
+        records = snapshot.metadata.records([ids[position] for position, _ in selections])
+        for record, (_, rationale) in zip(records, selections):
+            record["rationale"] = rationale
+        return records
+
+    def iter_recommendations_stream(self, query, fusion=None):
+        """Streaming variant of get_recommendations: yields each record as soon as Gemini has selected it.
+
+        Yields nothing when no assessment meets the query's constraints, and
+        re-raises generation errors (after any records already yielded) so the
+        caller can report them. If Gemini fails, its stream stalls past the
+        deadline or its response is unusable before any record was selected,
+        the retrieval-only fallback is yielded instead. A complete response is cached like
+        get_recommendations', and a cached one is replayed at once.
+        """
+        weights = fusion_weights(fusion)
+        self._reload_index_if_changed()
+        snapshot = self._snapshot
+        cache_key = normalize_query(query)
+        result_key = (snapshot.signature, "llm", weights, cache_key)
+        cached = self.result_cache.get(result_key)
+        if cached is not None:
+            yield from cached
+            return
+
+        embedding = self._embed_query(query, cache_key)
+        constraints = parse_query_constraints(query)
+        scope = self._semantic_scope(snapshot, weights, constraints)
+        cached = self._semantic_get(embedding, scope)
+        if cached is not None:
+            self.result_cache.set(result_key, cached)
+            yield from cached
+            return
+        ids = self._llm_candidates(snapshot, query, embedding, weights, constraints)
+        if not len(ids):
+            return
+        formatted_prompt, offered = self._format_prompt(query, snapshot, ids)
+        # Generation time here runs to the last chunk, so it includes the
+        # time the caller spends handling each record
+        started = time.perf_counter()
+        try:
+            # The whole stream, not only its first chunk, must arrive within the deadline
+            response = self.generate_upstream.stream(lambda timeout: self.model.generate_content(
+                formatted_prompt, generation_config=self._generation_config(), stream=True,
+                request_options=request_options(timeout)))
+        except UpstreamUnavailable as e:
+            yield from self._fallback_records(snapshot, ids, e)
+            return
+        parser = SelectionStreamParser(len(offered))
+        records = []
+        try:
+            chunk = None
+            for chunk in response:
+                for record in self._selected_records(snapshot, offered, parser.feed(self._chunk_text(chunk))):
+                    records.append(record)
+                    yield record
+            record_stage("generate", time.perf_counter() - started)
+            # Usage metadata comes with the last chunk
+            if chunk is not None:
+                self._record_usage(chunk, formatted_prompt)
+            complete = parser.close()
+        except (UpstreamUnavailable, StructuredOutputError) as e:
+            if records:
+                # Records already sent cannot be taken back; the caller reports the error after them
+                logger.error(f"Error streaming recommendations: {str(e)}")
+                raise
+            yield from self._fallback_records(snapshot, ids, e)
+            return
+        except Exception as e:
+            logger.error(f"Error streaming recommendations: {str(e)}")
+            raise
+        if complete:
+            self._cache_result(result_key, embedding, scope, records)
+
+    @staticmethod
+    def _chunk_text(chunk):
+        # The final chunk of a stream can carry only the finish reason, no parts
+        if not chunk.candidates:
+            return ""
+        return "".join(part.text for part in chunk.candidates[0].content.parts)
+
+    def iter_recommendations_batch(self, queries, mode="llm", max_workers=4, k=10, candidates=50, fusion=None):
+        """Recommend for many queries at once, yielding `(position, result)` as each completes.
+
+        Uncached query embeddings are fetched in batched embedding calls, and
+        queries that share the same parsed constraints are searched together
+        in a single multi-query FAISS search. In "llm" mode the generations then
+        run on a pool of `max_workers` threads; results are the same as
+        get_recommendations / get_retrieval_recommendations would return,
+        except that a failed generation is yielded as its exception instead
+        of being raised.
+        """
+        if mode not in ("llm", "retrieval"):
+            raise ValueError(f"mode must be 'llm' or 'retrieval', got {mode!r}")
+        weights = fusion_weights(fusion)
+        self._reload_index_if_changed()
+        snapshot = self._snapshot
+        queries = list(queries)
+        cache_keys = [normalize_query(query) for query in queries]
+        if mode == "llm":
+            result_keys = [(snapshot.signature, "llm", weights, key) for key in cache_keys]
+        else:
+            result_keys = [(snapshot.signature, "retrieval", k, weights, key) for key in cache_keys]
+
+        pending = []
+        for position, result_key in enumerate(result_keys):
+            cached = self.result_cache.get(result_key)
+            if cached is not None:
+                yield position, cached
+            else:
+                pending.append(position)
+        if not pending:
+            return
+
+        # Embed every distinct uncached query in batched calls
+        embeddings = {}
+        to_embed = {}
+        for position in pending:
+            key = cache_keys[position]
+            if key in embeddings or key in to_embed:
+                continue
+            embedding = self.embedding_cache.get(key)
+            if embedding is None:
+                to_embed[key] = queries[position]
+            else:
+                embeddings[key] = embedding
+        if to_embed:
+            try:
+                with stage_timer("embed"):
+                    batch_embeddings = self.embed_upstream.call(
+                        lambda timeout: self.embeddings.embed_documents(list(to_embed.values()),
+                                                                        **self._embed_options(timeout)))
+                for key, embedding in zip(to_embed, batch_embeddings):
+                    self.embedding_cache.set(key, embedding)
+                    embeddings[key] = embedding
+            except UpstreamUnavailable as e:
+                self._count_fallback("keyword_search", e)
+                embeddings.update(dict.fromkeys(to_embed))
+
+        # One FAISS search per distinct constraint set, covering all of its
+        # queries; queries left without an embedding are searched by keyword
+        groups = {}
+        scopes = {}
+        for position in pending:
+            constraints = parse_query_constraints(queries[position])
+            group_key = self._constraint_key(constraints)
+            embedding = embeddings[cache_keys[position]]
+            groups.setdefault((group_key, embedding is None), (constraints, embedding, []))[2].append(position)
+            scopes[position] = (snapshot.signature, weights, group_key)
+        ids_by_position = {}
+        search_k = max(k, candidates) if mode == "retrieval" else 2 * LLM_CANDIDATES
+        for constraints, embedding, positions in groups.values():
+            matrix = [embeddings[cache_keys[position]] for position in positions]
+            group_queries = [queries[position] for position in positions]
+            with stage_timer("search"):
+                group_ids = self._search_many(snapshot, group_queries, matrix, search_k, constraints,
+                                              self._search_weights(weights, embedding))
+            for position, ids in zip(positions, group_ids):
+                ids_by_position[position] = ids
+
+        if mode == "retrieval":
+            for position in pending:
+                with stage_timer("parse"):
+                    records = snapshot.metadata.records(snapshot.metadata.distinct(ids_by_position[position], k))
+                if embeddings[cache_keys[position]] is not None:
+                    self.result_cache.set(result_keys[position], records)
+                yield position, records
+            return
+
+        # Repeated queries in the batch share one generation; paraphrases of
+        # earlier queries are answered from the semantic cache
+        to_generate = {}
+        for position in pending:
+            ids = snapshot.metadata.distinct(ids_by_position[position], LLM_CANDIDATES)
+            ids_by_position[position] = ids
+            if not len(ids):
+                yield position, []
+                continue
+            cached = self._semantic_get(embeddings[cache_keys[position]], scopes[position])
+            if cached is not None:
+                self.result_cache.set(result_keys[position], cached)
+                yield position, cached
+                continue
+            to_generate.setdefault(result_keys[position], []).append(position)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Each generation runs in a copy of the caller's context, so the
+            # stage timings it records reach the request that asked for them
+            futures = {
+                executor.submit(contextvars.copy_context().run, self._generate, queries[positions[0]], snapshot,
+                                ids_by_position[positions[0]], result_key, embeddings[cache_keys[positions[0]]],
+                                scopes[positions[0]]): positions
+                for result_key, positions in to_generate.items()
+            }
+            for future in as_completed(futures):
+                # A failed generation is reported for its queries without ending the batch
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = e
+                for position in futures[future]:
+                    yield position, result
+
+    def get_recommendations_batch(self, queries, mode="llm", max_workers=4, fusion=None):
+        """Results for `queries`, in input order. See iter_recommendations_batch."""
+        queries = list(queries)
+        results = [None] * len(queries)
+        for position, result in self.iter_recommendations_batch(queries, mode=mode, max_workers=max_workers,
+                                                                fusion=fusion):
+            results[position] = result
+        return results
+
+    async def aget_recommendations(self, query, fusion=None):
+        """Async variant of get_recommendations.
+
+        Embedding and generation are awaited without blocking the event loop,
+        and concurrent identical queries share a single upstream round trip.
+        """
+        weights = fusion_weights(fusion)
+        self._reload_index_if_changed()
+        snapshot = self._snapshot
+        cache_key = normalize_query(query)
+        result_key = (snapshot.signature, "llm", weights, cache_key)
+        cached = self.result_cache.get(result_key)
+        if cached is not None:
+            return cached
+        return await self._coalesce(result_key,
+                                    lambda: self._agenerate(query, cache_key, snapshot, result_key, weights))
+
+    async def _agenerate(self, query, cache_key, snapshot, result_key, weights):
+        embedding = await self._aembed_query(query, cache_key)
+        constraints = parse_query_constraints(query)
+        scope = self._semantic_scope(snapshot, weights, constraints)
+        records = self._semantic_get(embedding, scope)
+        if records is not None:
+            self.result_cache.set(result_key, records)
+            return records
+        ids = self._llm_candidates(snapshot, query, embedding, weights, constraints)
+        if not len(ids):
+            return []
+        formatted_prompt, offered = self._format_prompt(query, snapshot, ids)
+        try:
+            with stage_timer("generate"):
+                response = await self.generate_upstream.acall(lambda timeout: self.model.generate_content_async(
+                    formatted_prompt,
+                    generation_config=self._generation_config(),
+                    request_options=request_options(timeout)
+                ))
+            self._record_usage(response, formatted_prompt)
+            with stage_timer("parse"):
+                selections, complete = parse_selection(response.text, len(offered))
+                records = self._selected_records(snapshot, offered, selections)
+        except (UpstreamUnavailable, StructuredOutputError) as e:
+            return self._fallback_records(snapshot, ids, e)
         except Exception as e:
             logger.error(f"Error generating recommendations: {str(e)}")
-            return "Error generating recommendations."
+            raise
+        # A response cut short is served but not cached, as in iter_recommendations_stream
+        if complete:
+            self._cache_result(result_key, embedding, scope, records)
+        return records
+
+    def _format_prompt(self, query, snapshot, ids):
+        """The prompt for `ids` and the ids it actually offers: the best-ranked that fit the token budget."""
+        with stage_timer("prompt"):
+            lines = []
+            for short_id, record in enumerate(snapshot.metadata.records(ids), start=1):
+                support = ", ".join(name for name, flag in (("remote", record["remote_support"]),
+                                                            ("adaptive", record["adaptive_support"])) if flag == "Yes")
+                duration = record["duration"] if record["duration"] is not None else "?"
+                lines.append(f"[{short_id}] {record['description']} | {' '.join(record['test_type'])} | {duration} | {support}")
+            fixed_text = self.prompt.format(query=query, retrieved_docs="", max_results=MAX_RECOMMENDATIONS)
+            count = lines_within_budget(lines, self.prompt_token_budget, fixed_text)
+            prompt = self.prompt.format(query=query, retrieved_docs="\n".join(lines[:count]),
+                                        max_results=min(MAX_RECOMMENDATIONS, count))
+            return prompt, ids[:count]
+
+    def _record_usage(self, response, prompt):
+        usage = self.token_usage.record(getattr(response, "usage_metadata", None))
+        if usage is not None:
+            logger.info(f"Gemini tokens: prompt={usage[0]} (estimated {estimate_tokens(prompt)}), response={usage[1]}")
+
+    def upstream_stats(self):
+        """Deadline, circuit breaker and hedging counters of the upstream clients, and degraded results served."""
+        with self._fallback_lock:
+            fallbacks = dict(self.fallbacks)
+        return {"embed": self.embed_upstream.stats(), "generate": self.generate_upstream.stats(),
+                "fallbacks": fallbacks}
+
+    def token_stats(self):
+        """Prompt/response token totals and means across LLM calls, plus the current limits."""
+        stats = self.token_usage.stats()
+        stats["prompt_token_budget"] = self.prompt_token_budget
+        stats["max_output_tokens"] = self.max_output_tokens
+        return stats
+
+    def _generation_config(self):
+        return genai.types.GenerationConfig(
+            temperature=0.7,
+            max_output_tokens=self.max_output_tokens,
+            response_mime_type="application/json",
+            response_schema=RESPONSE_SCHEMA,
+        )
 
 if __name__ == "__main__":
     try:
@@ -112,6 +833,6 @@ if __name__ == "__main__":
         )
         query = "I am hiring for JAVA Developers who can also collaborate effectively with my business teams. Looking for an assessment(s) that can be completed in 40 minutes."
         recommendations = engine.get_recommendations(query)
-        print(recommendations)
+        print(json.dumps(recommendations, indent=2))
     except Exception as e:
         logger.error(f"Error in main execution: {str(e)}")
\ No newline at end of file
@@ -1,12 +1,17 @@
 import pandas as pd
 import os
+import json
+import hashlib
 import logging
+import argparse
+import threading
 import requests
 from bs4 import BeautifulSoup
 from dotenv import load_dotenv
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
+from catalog import parse_duration, read_catalog, write_catalog
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
@@ -15,53 +20,172 @@ logger = logging.getLogger(__name__)
 # Load environment variables (optional, for future use)
 load_dotenv()
 
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+}
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` requests per second on average, bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity=1):
+        if rate <= 0:
+            raise ValueError(f"rate must be positive, got {rate}")
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available, then take it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+# Responses retried by NameScraper._fetch: overload and server errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Per-URL fields kept between runs for conditional requests and change detection
+STATE_FIELDS = ("name", "duration", "etag", "last_modified", "hash")
+
 class NameScraper:
-    def __init__(self, csv_path, output_csv_path="data/updated_assessments_test.csv"):
+    def __init__(self, csv_path, output_csv_path="data/updated_assessments_test.csv", max_workers=4,
+                 rate=1.0, burst=2, checkpoint_path=None, state_path="data/scrape_state.json",
+                 changes_csv_path=None, max_retries=3, retry_backoff=1.0):
+        """Pages are fetched by `max_workers` threads sharing one pooled session,
+        at no more than `rate` requests per second (bursts of `burst`).
+        Retries count against the rate too: a 429, 5xx or connection error is
+        retried up to `max_retries` times, after `retry_backoff` seconds
+        doubling each time, or the server's Retry-After if longer.
+
+        Every successful scrape is appended to `checkpoint_path` (by default
+        the output path + ".checkpoint.jsonl") as soon as it completes, so an
+        interrupted run resumes where it stopped; the checkpoint is removed
+        once the output CSV is written.
+
+        `state_path` keeps each URL's ETag, Last-Modified, page hash and parsed
+        fields between runs. Pages are requested conditionally and skipped when
+        the server answers 304 or the bytes hash the same; only rows whose
+        parsed fields changed are written to `changes_csv_path` (by default
+        the output path with a "_changed" suffix), which
+        `create_faiss_index.py --upsert` applies to an existing index.
+        """
         self.csv_path = csv_path
         self.output_csv_path = output_csv_path
+        self.max_workers = max_workers
+        self.rate_limiter = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.checkpoint_path = checkpoint_path or f"{output_csv_path}.checkpoint.jsonl"
+        self.state_path = state_path
+        self.changes_csv_path = changes_csv_path or f"{os.path.splitext(output_csv_path)[0]}_changed.csv"
         self.data = self._load_data()
+        self.state = self._load_state()
+        # One session for every fetch, so connections to the host are reused
+        self.session = self._setup_session()
 
     def _load_data(self):
         try:
-            if not os.path.exists(self.csv_path):
-                raise FileNotFoundError(f"CSV file not found at {self.csv_path}")
-            df = pd.read_csv(self.csv_path)
-            if "name" not in df.columns or "url" not in df.columns:
-                raise ValueError("CSV must contain 'name' and 'url' columns")
+            df = read_catalog(self.csv_path)
             logger.info(f"Loaded {len(df)} records from CSV")
-            return df.to_dict(orient="records")
+            return df
         except Exception as e:
             logger.error(f"Error loading data: {str(e)}")
             raise
 
     def _setup_session(self):
         session = requests.Session()
-        retry_strategy = Retry(
-            total=3,
-            backoff_factor=1,
-            status_forcelist=[500, 502, 503, 504],
-            allowed_methods=["GET"]
-        )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
+        # No retries in the adapter: they would bypass the rate limiter, which
+        # matters most when the server is pushing back. _fetch retries instead
+        adapter = HTTPAdapter(max_retries=0, pool_connections=1, pool_maxsize=self.max_workers)
         session.mount("https://", adapter)
         session.mount("http://", adapter)
         return session
 
-    def _scrape_assessment_details(self, url):
+    def _retry_delay(self, attempt, response):
+        delay = self.retry_backoff * 2 ** (attempt - 1)
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after is not None and retry_after.strip().isdigit():
+            delay = max(delay, float(retry_after))
+        return delay
+
+    def _fetch(self, url, headers):
+        """GET `url`, taking a rate-limit token for every attempt, and retrying overload and server errors."""
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            try:
+                response = self.session.get(url, headers=headers, timeout=10)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+                response = None
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    return response
+            attempt += 1
+            delay = self._retry_delay(attempt, response)
+            reason = response.status_code if response is not None else "connection error"
+            logger.warning(f"Retrying {url} ({reason}), attempt {attempt}/{self.max_retries} in {delay:g}s")
+            time.sleep(delay)
+
+    def _load_state(self):
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_state(self, done):
+        state = dict(self.state)
+        for url, details in done.items():
+            if details["status"] != "error":
+                state[url] = {field: details.get(field) for field in STATE_FIELDS}
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=1)
+        os.replace(tmp_path, self.state_path)
+        self.state = state
+
+    def _scrape_assessment_details(self, url, previous=None):
+        """Name and duration of the page at `url`, with its validators and a status.
+
+        The status is "not_modified" (304), "unchanged" (same bytes, or new
+        bytes that parse to the same fields as `previous`, the URL's saved
+        state), "changed" or "error".
+        """
         try:
-            session = self._setup_session()
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-            }
             full_url = f"https://www.shl.com{url}" if not url.startswith("http") and pd.notna(url) else url
             if pd.isna(url) or not full_url:
                 logger.warning(f"Skipping invalid URL: {url}")
-                return {"name": "Unknown", "duration": 0}
+                return {"name": "Unknown", "duration": 0, "status": "error"}
 
-            response = session.get(full_url, headers=headers, timeout=10)
+            headers = dict(HEADERS)
+            if previous:
+                if previous.get("etag"):
+                    headers["If-None-Match"] = previous["etag"]
+                if previous.get("last_modified"):
+                    headers["If-Modified-Since"] = previous["last_modified"]
+            response = self._fetch(full_url, headers)
+            if response.status_code == 304 and previous:
+                return {**previous, "status": "not_modified"}
             response.raise_for_status()
+            validators = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "hash": hashlib.sha256(response.content).hexdigest(),
+            }
+            if previous and previous.get("hash") == validators["hash"]:
+                # Servers that send no validators still send the same bytes
+                return {**previous, **validators, "status": "unchanged"}
             soup = BeautifulSoup(response.text, "html.parser")
-            time.sleep(2)
 
             # Extract name from <h1> or fallback to <title> or content
             name_tag = soup.find("h1")
@@ -79,49 +203,126 @@ class NameScraper:
             duration_tag = soup.find("p", text=lambda t: "Approximate Completion Time in minutes" in t)
             duration = int(duration_tag.text.split("=")[1].strip()) if duration_tag else 0
 
+            changed = previous is None or (previous.get("name"), previous.get("duration")) != (extracted_name, duration)
             return {
                 "name": extracted_name,
-                "duration": duration
+                "duration": duration,
+                **validators,
+                "status": "changed" if changed else "unchanged",
             }
         except Exception as e:
             logger.error(f"Error scraping {url}: {str(e)}")
-            return {"name": "Error", "duration": 0}
+            return {"name": "Error", "duration": 0, "status": "error"}
+
+    def _load_checkpoint(self):
+        """Scraped details by URL from an earlier, interrupted run."""
+        done = {}
+        if not os.path.exists(self.checkpoint_path):
+            return done
+        with open(self.checkpoint_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short by the crash that interrupted the run
+                    continue
+                # Entries written before statuses were recorded
+                entry.setdefault("status", "changed")
+                done[entry.pop("url")] = entry
+        logger.info(f"Resuming: {len(done)} URLs already scraped in {self.checkpoint_path}")
+        return done
+
+    def _scrape_all(self, done):
+        """Scrape every URL not in `done`, adding results to it and to the checkpoint as they complete."""
+        pending = [url for url in self.data["url"].unique() if url and url not in done]
+        if not pending:
+            return
+        logger.info(f"Scraping {len(pending)} URLs with {self.max_workers} workers")
+        with open(self.checkpoint_path, "a", encoding="utf-8") as checkpoint, \
+                ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {pool.submit(self._scrape_assessment_details, url, self.state.get(url)): url for url in pending}
+            for future in as_completed(futures):
+                url = futures[future]
+                details = future.result()
+                done[url] = details
+                # Failures are not checkpointed, so a resumed run retries them
+                if details["status"] != "error":
+                    checkpoint.write(json.dumps({"url": url, **details}) + "\n")
+                    checkpoint.flush()
+
+    def _remove_checkpoint(self):
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def _finish_run(self, changed, done):
+        """Write the changed rows, then remember this run's state and drop the checkpoint.
+
+        State is saved only after the outputs, so rows from a run that failed
+        to write are reported as changed again next time.
+        """
+        write_catalog(changed, self.changes_csv_path)
+        logger.info(f"{len(changed)} changed rows saved to {self.changes_csv_path}")
+        self._save_state(done)
+        self._remove_checkpoint()
 
     def update_assessment_details(self):
-        updated_data = []
-        # Process all entries (removed [:10] limit)
-        for item in self.data:
-            original_name = item["name"]
-            url = item["url"]
-            logger.info(f"Scraping {url} for details (original name: {original_name})")
-            scraped_details = self._scrape_assessment_details(url)
-
-            # Use scraped name if valid, otherwise keep original
-            final_name = scraped_details["name"] if scraped_details["name"] not in ["Error", "Unknown"] else original_name
-            if final_name != original_name and scraped_details["name"] not in ["Error", "Unknown"]:
-                logger.info(f"Updated name for {url}: {original_name} -> {final_name}")
-
-            updated_item = item.copy()
-            updated_item["name"] = final_name
-            updated_item["duration"] = scraped_details["duration"]
-            updated_data.append(updated_item)
+        done = self._load_checkpoint()
+        self._scrape_all(done)
+        statuses = pd.Series([details["status"] for details in done.values()]).value_counts().to_dict()
+        logger.info(f"Scrape results: {statuses}")
+
+        # One row of scrape results per distinct URL, joined onto the catalog
+        scraped = {}
+        for url in self.data["url"].unique():
+            details = done.get(url, {"name": "Unknown", "duration": 0, "status": "error"})
+            if details["status"] == "error" and url in self.state:
+                # Keep the last good scrape rather than blanking the row
+                details = self.state[url]
+            scraped[url] = details
+        scraped = pd.DataFrame.from_dict(scraped, orient="index", columns=["name", "duration", "status"])
+        scraped = scraped.reindex(self.data["url"]).set_index(self.data.index)
+
+        # Use scraped name if valid, otherwise keep original
+        valid = scraped["name"].notna() & ~scraped["name"].isin(["Error", "Unknown"])
+        renamed = valid & (scraped["name"] != self.data["name"])
+        for url, original_name, final_name in zip(self.data["url"][renamed], self.data["name"][renamed],
+                                                  scraped["name"][renamed]):
+            logger.info(f"Updated name for {url}: {original_name} -> {final_name}")
+
+        updated_df = self.data.copy()
+        updated_df["name"] = scraped["name"].where(valid, self.data["name"])
+        updated_df["duration"] = parse_duration(scraped["duration"].fillna(0))
+        changed_df = updated_df[scraped["status"] == "changed"]
 
         # Save to new CSV with permission error handling
         try:
-            updated_df = pd.DataFrame(updated_data)
-            updated_df.to_csv(self.output_csv_path, index=False)
+            write_catalog(updated_df, self.output_csv_path)
             logger.info(f"Updated data saved to {self.output_csv_path}")
+            self._finish_run(changed_df, done)
         except PermissionError as e:
             logger.error(f"Permission denied writing to {self.output_csv_path}: {str(e)}. Trying alternate path...")
             alternate_path = "updated_assessments_test.csv"  # Save in current directory
             try:
-                updated_df.to_csv(alternate_path, index=False)
+                write_catalog(updated_df, alternate_path)
                 logger.info(f"Updated data saved to alternate path: {alternate_path}")
+                self._finish_run(changed_df, done)
             except Exception as e:
                 logger.error(f"Failed to save to alternate path: {str(e)}")
         except Exception as e:
             logger.error(f"Error saving CSV: {str(e)}")
 
 if __name__ == "__main__":
-    scraper = NameScraper("data/shl_individual_assessments.csv")
+    parser = argparse.ArgumentParser(description="Scrape assessment names and durations from the SHL catalog")
+    parser.add_argument("--csv", default="data/shl_individual_assessments.csv", help="Input CSV with name and url columns")
+    parser.add_argument("--output", default="data/updated_assessments_test.csv", help="Output CSV path")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent fetches")
+    parser.add_argument("--rate", type=float, default=1.0, help="Requests per second across all workers")
+    parser.add_argument("--burst", type=int, default=2, help="Requests allowed back to back")
+    parser.add_argument("--checkpoint", help="Resume file (default: <output>.checkpoint.jsonl)")
+    parser.add_argument("--state", default="data/scrape_state.json",
+                        help="ETag/Last-Modified/hash per URL, kept between runs for conditional requests")
+    parser.add_argument("--changes", help="CSV of rows whose fields changed (default: <output>_changed.csv)")
+    args = parser.parse_args()
+    scraper = NameScraper(args.csv, args.output, max_workers=args.workers, rate=args.rate, burst=args.burst,
+                          checkpoint_path=args.checkpoint, state_path=args.state, changes_csv_path=args.changes)
     scraper.update_assessment_details()
\ No newline at end of file
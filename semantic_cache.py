@@ -0,0 +1,121 @@
+import threading
+import time
+
+import numpy as np
+
+
+class SemanticCache:
+    """Thread-safe cache of results keyed by query embedding, matched by cosine similarity.
+
+    A lookup returns the value stored for the most similar live embedding
+    in the same ``scope``, if that similarity is at least ``threshold``, so
+    paraphrases of a cached query share its result. Scopes are compared
+    exactly: callers put whatever must match (index version, hard
+    constraints) there. Embeddings live in one preallocated matrix and a
+    lookup is a single matrix-vector product over at most ``maxsize`` rows.
+    The least recently used entry is evicted when the cache is full;
+    entries also expire after ``ttl`` seconds.
+    """
+
+    def __init__(self, maxsize=256, threshold=0.95, ttl=3600.0, timer=time.monotonic):
+        if maxsize < 1:
+            raise ValueError(f"maxsize must be at least 1, got {maxsize}")
+        if not 0 < threshold <= 1:
+            raise ValueError(f"threshold must be in (0, 1], got {threshold}")
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.ttl = ttl
+        self._timer = timer
+        self._lock = threading.Lock()
+        # Allocated on the first insert, once the embedding size is known
+        self._vectors = None
+        self._scope_hashes = np.zeros(maxsize, dtype=np.int64)
+        self._expires = np.full(maxsize, -np.inf)
+        self._last_used = np.zeros(maxsize, dtype=np.int64)
+        self._scopes = [None] * maxsize
+        self._values = [None] * maxsize
+        self._clock = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _best_match(self, vector, scope):
+        """(slot, similarity) of the most similar live entry in `scope`, or (None, -inf)."""
+        if self._vectors is None or self._vectors.shape[1] != len(vector):
+            return None, -np.inf
+        candidates = np.flatnonzero((self._expires > self._timer()) & (self._scope_hashes == hash(scope)))
+        if not len(candidates):
+            return None, -np.inf
+        similarities = self._vectors[candidates] @ vector
+        for position in np.argsort(-similarities):
+            slot = candidates[position]
+            # Hashes can collide; the scope itself must match
+            if self._scopes[slot] == scope:
+                return slot, float(similarities[position])
+        return None, -np.inf
+
+    def get(self, embedding, scope, default=None):
+        vector = self._normalize(embedding)
+        with self._lock:
+            slot, similarity = self._best_match(vector, scope)
+            if slot is not None and similarity >= self.threshold:
+                self._clock += 1
+                self._last_used[slot] = self._clock
+                self.hits += 1
+                return self._values[slot]
+            self.misses += 1
+            return default
+
+    def set(self, embedding, scope, value):
+        vector = self._normalize(embedding)
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != len(vector):
+                self._vectors = np.zeros((self.maxsize, len(vector)), dtype=np.float32)
+                self._expires[:] = -np.inf
+            slot, similarity = self._best_match(vector, scope)
+            if slot is None or similarity < 0.999:
+                # Reuse an expired slot if there is one, else evict the least recently used
+                expired = np.flatnonzero(self._expires <= self._timer())
+                if len(expired):
+                    slot = expired[np.argmin(self._last_used[expired])]
+                else:
+                    slot = int(np.argmin(self._last_used))
+                    self.evictions += 1
+            self._clock += 1
+            self._vectors[slot] = vector
+            self._scope_hashes[slot] = hash(scope)
+            self._scopes[slot] = scope
+            self._values[slot] = value
+            self._expires[slot] = self._timer() + self.ttl
+            self._last_used[slot] = self._clock
+
+    def clear(self):
+        with self._lock:
+            self._expires[:] = -np.inf
+            self._scopes = [None] * self.maxsize
+            self._values = [None] * self.maxsize
+
+    def __len__(self):
+        with self._lock:
+            return int(np.count_nonzero(self._expires > self._timer()))
+
+    def stats(self):
+        size = len(self)
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": size,
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,233 @@
+"""What the Flask app (app.py) and the asyncio app (asgi_app.py) share.
+
+Both serve the same endpoints with the same JSON contract; only how a
+request is read and answered differs. This module holds the rest:
+configuration from the environment, the upstream clients, the catalog
+engines and readiness, request validation and error messages, the bodies
+of the streamed endpoints, metrics and the profiler switch. Validators
+return `(message, HTTP status)` for a bad request, or None, and each app
+turns that into its own JSON response.
+"""
+import json
+import logging
+import os
+import time
+
+from batch_recommend import iter_batch_lines
+from bm25 import fusion_weights
+from engine_registry import DEFAULT_CATALOG, EngineRegistry, UnknownCatalogError
+from metrics import (REQUEST_SECONDS, REQUESTS_TOTAL, engine_metric_lines, format_timing_header, profiler,
+                     registry_metric_lines, request_timings, upstream_metric_lines)
+from upstream import UpstreamClient
+
+logger = logging.getLogger(__name__)
+
+# Direct relative paths
+CSV_PATH = "data/shl_individual_assessments.csv"
+INDEX_DIR = "data/faiss_index"
+# Indexes of the other catalogs a request can name: CATALOGS_DIR/<catalog id>/index.faiss
+CATALOGS_DIR = os.getenv("CATALOGS_DIR", "data/catalogs")
+# Loaded catalogs beyond this many MB of index are evicted, least recently used first (0 = no limit)
+ENGINE_MEMORY_BUDGET_MB = float(os.getenv("ENGINE_MEMORY_BUDGET_MB", 0))
+
+# Upper bound on queries accepted by one /recommend/batch request
+MAX_BATCH_QUERIES = int(os.getenv("MAX_BATCH_QUERIES", 500))
+
+# X-Timing response header on every response; otherwise only when the
+# request carries an X-Timing header
+TIMING_HEADER = os.getenv("TIMING_HEADER", "").lower() in ("1", "true", "yes")
+
+# The runtime profiler endpoint is off unless explicitly enabled
+ENABLE_PROFILER = os.getenv("ENABLE_PROFILER", "").lower() in ("1", "true", "yes")
+
+MODES = ('llm', 'retrieval')
+
+# Deadlines, concurrency limits and circuit breakers for the embedding and
+# Gemini APIs, shared by every catalog's engine (EMBED_TIMEOUT, GENERATE_TIMEOUT,
+# EMBED_HEDGE_MS, GENERATE_HEDGE_MS, UPSTREAM_MAX_CONCURRENCY, UPSTREAM_*; see upstream.py)
+EMBED_UPSTREAM = UpstreamClient.from_env("embed", default_timeout=5.0)
+GENERATE_UPSTREAM = UpstreamClient.from_env("generate", default_timeout=20.0)
+
+
+# Initialize Recommendation Engine
+def init_recommendation_engine(csv_path=CSV_PATH, index_dir=INDEX_DIR):
+    # Imported here so the process is up (and /health answers) before the
+    # Gemini client and index-loading code are pulled in
+    from recommendation_engine import RecommendationEngine
+    try:
+        if not os.path.exists(os.path.join(index_dir, "index.faiss")):
+            raise FileNotFoundError(f"FAISS index not found at {index_dir}")
+        engine = RecommendationEngine(
+            csv_path,
+            index_dir,
+            cache_size=int(os.getenv("QUERY_CACHE_SIZE", 1024)),
+            cache_ttl=float(os.getenv("QUERY_CACHE_TTL", 3600)),
+            embedding_backend=os.getenv("EMBEDDING_BACKEND") or None,
+            ef_search=int(os.getenv("FAISS_EF_SEARCH", 64)),
+            nprobe=int(os.getenv("FAISS_NPROBE", 8)),
+            prompt_token_budget=int(os.getenv("PROMPT_TOKEN_BUDGET", 400)),
+            max_output_tokens=int(os.getenv("MAX_OUTPUT_TOKENS", 512)),
+            semantic_cache_size=int(os.getenv("SEMANTIC_CACHE_SIZE", 256)),
+            semantic_threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.95)),
+            embed_upstream=EMBED_UPSTREAM,
+            generate_upstream=GENERATE_UPSTREAM,
+        )
+        logger.info("Recommendation engine loaded successfully")
+        return engine
+    except Exception as e:
+        logger.error(f"Error loading recommendation engine: {str(e)}")
+        raise
+
+
+def _load_catalog(catalog_id, index_dir):
+    # Only the default catalog has a source CSV the engine is told about
+    return init_recommendation_engine(CSV_PATH if catalog_id == DEFAULT_CATALOG else None, index_dir)
+
+
+# Engines are loaded on first use, per catalog
+engines = EngineRegistry(_load_catalog, INDEX_DIR, catalogs_dir=CATALOGS_DIR,
+                         memory_budget_bytes=int(ENGINE_MEMORY_BUDGET_MB * 2**20))
+_process_started = time.time()
+_engine_ready_at = None
+
+
+def get_engine(catalog=None):
+    """The engine for `catalog` (the default catalog if None), loading it; raises UnknownCatalogError."""
+    global _engine_ready_at
+    engine = engines.get(catalog)
+    if _engine_ready_at is None and engines.peek() is not None:
+        _engine_ready_at = time.time()
+    return engine
+
+
+def is_ready():
+    """True once the default catalog's engine has loaded."""
+    return _engine_ready_at is not None
+
+
+def health():
+    """The /health body: liveness, readiness and how long startup took."""
+    engine = engines.peek()
+    ready = is_ready()
+    return {
+        "status": "healthy",
+        "ready": ready,
+        "engine_load_seconds": engine.startup_seconds if engine is not None else None,
+        "startup_seconds": _engine_ready_at - _process_started if ready else None,
+    }
+
+
+def metric_lines():
+    """Prometheus lines for the loaded catalogs, their caches, tokens and upstream calls."""
+    lines = registry_metric_lines(engines.stats())
+    loaded = engines.loaded()
+    lines += engine_metric_lines(loaded)
+    lines += upstream_metric_lines(loaded)
+    return lines
+
+
+def timing_requested(headers):
+    return TIMING_HEADER or "X-Timing" in headers
+
+
+def observe_request(endpoint, status, elapsed):
+    REQUEST_SECONDS.observe(elapsed, endpoint, status)
+    REQUESTS_TOTAL.inc(endpoint, status)
+
+
+def catalog_error(catalog):
+    """`(message, status)` for an invalid or unknown `catalog` field, or None if it is valid."""
+    if catalog is None:
+        return None
+    if not isinstance(catalog, str):
+        return "catalog must be a string", 400
+    try:
+        engines.index_dir(catalog)
+    except UnknownCatalogError:
+        return f"Unknown catalog: {catalog}", 404
+    return None
+
+
+def _options_error(data, mode=True):
+    if mode and data.get('mode', 'llm') not in MODES:
+        return "mode must be 'llm' or 'retrieval'", 400
+    # Optional vector/keyword weighting, e.g. {"vector": 1, "lexical": 2}
+    try:
+        fusion_weights(data.get('fusion'))
+    except ValueError as e:
+        return str(e), 400
+    # Optional catalog ID; the default catalog when absent
+    return catalog_error(data.get('catalog'))
+
+
+def recommend_error(data, mode=True):
+    """`(message, status)` for an invalid /recommend body, or None; /recommend/stream takes no `mode`."""
+    if not isinstance(data, dict) or not isinstance(data.get('query'), str) or not data['query'].strip():
+        return "Query field is required", 400
+    return _options_error(data, mode)
+
+
+def batch_error(data):
+    """`(message, status)` for an invalid /recommend/batch body, or None."""
+    if not isinstance(data, dict) or not isinstance(data.get('queries'), list) or not data['queries']:
+        return "queries must be a non-empty list", 400
+    if len(data['queries']) > MAX_BATCH_QUERIES:
+        return f"At most {MAX_BATCH_QUERIES} queries per batch", 400
+    return _options_error(data)
+
+
+def stream_events(engine, query, fusion, sse, timing_started=None):
+    """The /recommend/stream body: one event per assessment as the LLM selects it, then "done".
+
+    JSON Lines, or Server-Sent Events if `sse`. With `timing_started` (the
+    request's perf_counter start), the "done" event carries the request's
+    timings as X-Timing would.
+    """
+    def event(name, payload):
+        if sse:
+            return f"event: {name}\ndata: {json.dumps(payload)}\n\n"
+        return json.dumps(payload) + "\n"
+
+    count = 0
+    try:
+        for record in engine.iter_recommendations_stream(query, fusion=fusion):
+            yield event("assessment", {"index": count, "assessment": record})
+            count += 1
+    except Exception as e:
+        logger.error(f"Error streaming recommendations: {str(e)}")
+        yield event("error", {"error": f"Error generating recommendations: {str(e)}"})
+        return
+    if not count:
+        yield event("error", {"error": "No valid recommendations found"})
+        return
+    done = {"done": True, "count": count}
+    if timing_started is not None:
+        done["timing"] = format_timing_header(request_timings() or {}, time.perf_counter() - timing_started)
+    yield event("done", done)
+
+
+def batch_lines(engine, data):
+    """The /recommend/batch body for a valid request: one JSON line per query."""
+    try:
+        for line in iter_batch_lines(engine, data['queries'], mode=data.get('mode', 'llm'),
+                                     fusion=data.get('fusion')):
+            yield json.dumps(line) + "\n"
+    except Exception as e:
+        logger.error(f"Error processing batch: {str(e)}")
+        yield json.dumps({"error": f"Error generating recommendations: {str(e)}"}) + "\n"
+
+
+def update_profiler(data):
+    """Start (`{"enabled": true, "interval": 0.005}`) or stop the profiler; `(message, status)` if invalid."""
+    data = data if isinstance(data, dict) else {}
+    if data.get('enabled', True):
+        try:
+            interval = float(data.get('interval', 0.005))
+        except (TypeError, ValueError):
+            return "interval must be a number of seconds", 400
+        if interval <= 0:
+            return "interval must be positive", 400
+        profiler.start(interval)
+    else:
+        profiler.stop()
+    return None
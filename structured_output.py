@@ -0,0 +1,130 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# What Gemini is constrained to return: the short ids of the retrieved
+# assessments it picks, best first, each with a one-sentence rationale.
+# Everything else in a record is filled in from the index metadata.
+RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "recommendations": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "integer"},
+                    "rationale": {"type": "string"},
+                },
+                "required": ["id", "rationale"],
+            },
+        },
+    },
+    "required": ["recommendations"],
+}
+
+
+class StructuredOutputError(ValueError):
+    """The LLM response is not JSON of the shape RESPONSE_SCHEMA describes."""
+
+
+def _validate_item(item, num_candidates, seen):
+    """`(candidate position, rationale)` for a selected item, or None if it does not name a new candidate."""
+    if not isinstance(item, dict):
+        return None
+    short_id = item.get("id")
+    # Short ids are 1-based positions in the prompt's candidate list
+    if isinstance(short_id, bool) or not isinstance(short_id, int) or not 1 <= short_id <= num_candidates:
+        logger.warning(f"Ignoring selection of unknown assessment id {short_id!r}")
+        return None
+    if short_id in seen:
+        return None
+    seen.add(short_id)
+    rationale = item.get("rationale")
+    return short_id - 1, rationale.strip() if isinstance(rationale, str) else ""
+
+
+def parse_selection(text, num_candidates):
+    """`([(candidate position, rationale), ...], complete)` from a response, in the model's order.
+
+    Ids outside the candidate list and repeated ids are dropped. A response
+    cut short (the output token limit, say) keeps the selections completed
+    before the cut, as SelectionStreamParser does, with `complete` False; a
+    response with no usable selection raises StructuredOutputError.
+    """
+    try:
+        data = json.loads(text)
+    except ValueError:
+        selections = SelectionStreamParser(num_candidates).feed(text)
+        if not selections:
+            raise StructuredOutputError("LLM response is not valid JSON")
+        logger.warning(f"LLM response was cut short; keeping the {len(selections)} complete recommendations")
+        return selections, False
+    items = data.get("recommendations") if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        raise StructuredOutputError("LLM response has no 'recommendations' list")
+    seen = set()
+    return [selected for selected in (_validate_item(item, num_candidates, seen) for item in items)
+            if selected is not None], True
+
+
+class SelectionStreamParser:
+    """Incremental parse_selection for a response arriving in text chunks.
+
+    feed() returns the selections completed by a chunk: every JSON object
+    that closes inside the "recommendations" array is decoded on its own as
+    soon as its closing brace arrives. close() checks the whole response like
+    parse_selection: it returns False for a response cut short after some
+    selections, and raises StructuredOutputError if nothing usable came.
+    """
+
+    def __init__(self, num_candidates):
+        self.num_candidates = num_candidates
+        self.text = ""
+        self._seen = set()
+        self._position = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._item_start = None
+
+    def feed(self, chunk):
+        self.text += chunk
+        selections = []
+        text = self.text
+        for position in range(self._position, len(text)):
+            char = text[position]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                # Items are the objects directly inside the array inside the top-level object
+                if char == "{" and self._depth == 2:
+                    self._item_start = position
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if char == "}" and self._depth == 2 and self._item_start is not None:
+                    selected = self._decode(text[self._item_start:position + 1])
+                    self._item_start = None
+                    if selected is not None:
+                        selections.append(selected)
+        self._position = len(text)
+        return selections
+
+    def close(self):
+        return parse_selection(self.text, self.num_candidates)[1]
+
+    def _decode(self, item_text):
+        try:
+            item = json.loads(item_text)
+        except ValueError:
+            return None
+        return _validate_item(item, self.num_candidates, self._seen)
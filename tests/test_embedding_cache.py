@@ -0,0 +1,29 @@
+import os
+
+import pandas as pd
+
+from create_faiss_index import create_faiss_index
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+from embeddings import HashingEmbeddings
+
+
+def test_each_model_gets_its_own_store(tmp_path):
+    texts = ["Core Java", "Python", "Numerical reasoning"]
+    for dim in (512, 256, 512):
+        embeddings = HashingEmbeddings(dim=dim)
+        cached = CachedEmbeddings(embeddings, EmbeddingCache.for_model(str(tmp_path), embeddings.model))
+        assert cached.embed_documents(texts) == embeddings.embed_documents(texts)
+    assert sorted(os.listdir(tmp_path)) == ["hashing-v1-256", "hashing-v1-512"]
+    # The third pass was served from the 512-d store written by the first
+    assert cached.hits == len(texts)
+
+
+def test_builds_with_different_dimensions_share_a_cache_dir(tmp_path):
+    csv_path = tmp_path / "catalog.csv"
+    pd.DataFrame({"name": ["Core Java", "Python"], "url": ["/java/", "/python/"]}).to_csv(csv_path, index=False)
+    cache_dir = str(tmp_path / "cache")
+    for dim in (512, 256):
+        create_faiss_index(str(csv_path), str(tmp_path / f"index-{dim}"), cache_dir=cache_dir,
+                           embedding_backend="hashing", embedding_dim=dim)
+    assert EmbeddingCache.for_model(cache_dir, "hashing-v1-256").dim == 256
+    assert EmbeddingCache.for_model(cache_dir, "models/embedding-001").cache_dir.endswith("models_embedding-001")
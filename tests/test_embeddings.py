@@ -0,0 +1,79 @@
+import threading
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+import embeddings
+from embeddings import GoogleGenAIEmbeddings
+
+
+class FakeEmbedContent:
+    """Stands in for genai.embed_content: each text embeds to [index, length], and
+    the batches starting with a text in `exhaust` fail once with ResourceExhausted."""
+
+    def __init__(self, exhaust=()):
+        self.exhaust = set(exhaust)
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, model, content, **kwargs):
+        with self._lock:
+            self.calls.append(list(content))
+            if content[0] in self.exhaust:
+                self.exhaust.discard(content[0])
+                raise google_exceptions.ResourceExhausted("Quota exceeded")
+        return {"embedding": [[float(text.split()[1]), float(len(text))] for text in content]}
+
+
+@pytest.fixture
+def texts():
+    return [f"doc {i} " + "x" * (i % 7) for i in range(23)]
+
+
+def embed(monkeypatch, texts, fake, **kwargs):
+    monkeypatch.setattr(embeddings.genai, "embed_content", fake)
+    return GoogleGenAIEmbeddings(batch_size=4, backoff_base=0.001, **kwargs).embed_documents(texts)
+
+
+def test_parallel_output_matches_sequential(monkeypatch, texts):
+    sequential = embed(monkeypatch, texts, FakeEmbedContent(), max_workers=1)
+    parallel = embed(monkeypatch, texts, FakeEmbedContent(), max_workers=5)
+    assert parallel == sequential
+    assert parallel == [[float(i), float(len(text))] for i, text in enumerate(texts)]
+
+
+def test_rate_limited_batch_is_retried_in_place(monkeypatch, texts):
+    fake = FakeEmbedContent(exhaust={texts[8], texts[20]})
+    vectors = embed(monkeypatch, texts, fake, max_workers=5)
+    assert vectors == [[float(i), float(len(text))] for i, text in enumerate(texts)]
+    # Six batches, two of them sent twice
+    assert len(fake.calls) == 8
+    assert sum(batch[0] == texts[8] for batch in fake.calls) == 2
+
+
+def test_retries_give_up_after_max_retries(monkeypatch, texts):
+    class AlwaysExhausted(FakeEmbedContent):
+        def __call__(self, model, content, **kwargs):
+            raise google_exceptions.ResourceExhausted("Quota exceeded")
+
+    with pytest.raises(google_exceptions.ResourceExhausted):
+        embed(monkeypatch, texts, AlwaysExhausted(), max_workers=2, max_retries=2)
+
+
+def test_timeout_is_carried_by_a_single_attempt(monkeypatch, texts):
+    fake = FakeEmbedContent(exhaust={texts[0]})
+    options = []
+
+    def embed_content(model, content, request_options=None):
+        options.append(request_options)
+        return fake(model, content)
+
+    monkeypatch.setattr(embeddings.genai, "embed_content", embed_content)
+    backend = GoogleGenAIEmbeddings(batch_size=4, backoff_base=0.001)
+    # The caller owns retries when it sets a deadline: a rate limit is raised at once
+    with pytest.raises(google_exceptions.ResourceExhausted):
+        backend.embed_query(texts[0], timeout=1.5)
+    assert options == [{"timeout": 1.5, "retry": None}]
+    assert backend.embed_documents(texts, timeout=2.0) == [[float(i), float(len(text))]
+                                                          for i, text in enumerate(texts)]
+    assert options[1:] == [{"timeout": 2.0, "retry": None}] * 6
@@ -0,0 +1,59 @@
+import threading
+import time
+
+import pytest
+
+from engine_registry import DEFAULT_CATALOG, EngineRegistry
+
+
+class FakeEngine:
+    def __init__(self, size):
+        self.size = size
+
+    def memory_bytes(self):
+        return self.size
+
+
+@pytest.fixture
+def catalogs_dir(tmp_path):
+    for catalog_id in ("a", "b", "c", "broken"):
+        (tmp_path / catalog_id).mkdir()
+        (tmp_path / catalog_id / "index.faiss").write_bytes(b"")
+    return tmp_path
+
+
+def test_concurrent_requests_load_a_catalog_once(catalogs_dir):
+    loads = []
+
+    def factory(catalog_id, index_dir):
+        loads.append(catalog_id)
+        time.sleep(0.05)
+        return FakeEngine(1)
+
+    registry = EngineRegistry(factory, str(catalogs_dir / "a"), catalogs_dir=str(catalogs_dir))
+    engines = []
+    threads = [threading.Thread(target=lambda: engines.append(registry.get("b"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert loads == ["b"]
+    assert all(engine is engines[0] for engine in engines)
+
+
+def test_load_locks_do_not_outlive_loads(catalogs_dir):
+    def factory(catalog_id, index_dir):
+        if catalog_id == "broken":
+            raise ValueError("corrupt index")
+        return FakeEngine(10)
+
+    registry = EngineRegistry(factory, str(catalogs_dir / "a"), catalogs_dir=str(catalogs_dir),
+                              memory_budget_bytes=15)
+    for catalog_id in (DEFAULT_CATALOG, "b", "c", "b"):
+        registry.get(catalog_id)
+    with pytest.raises(ValueError):
+        registry.get("broken")
+    # Each load evicted the one before it
+    assert list(registry.stats()["loaded"]) == ["b"]
+    assert registry.evictions == 3
+    assert registry._load_locks == {}
@@ -0,0 +1,124 @@
+import os
+
+import pandas as pd
+import pytest
+
+import recommendation_engine
+from bm25 import BM25Index
+from embeddings import HashingEmbeddings
+from create_faiss_index import create_faiss_index, update_faiss_index
+from index_versions import CURRENT_LINK, INDEX_FILE_NAMES, VERSIONS_DIR, resolve_index_dir
+from metadata_store import MetadataStore
+from recommendation_engine import RecommendationEngine
+
+ROWS = [
+    ("Core Java (New)", "/view/core-java/", "K", "Core Java knowledge test", 20),
+    ("Python (New)", "/view/python/", "K", "Python programming test", 11),
+    ("", "", "", "", 0),
+    ("Verify Numerical", "/view/verify-numerical/", "A", "Numerical reasoning", 18),
+    ("Python (New)", "/view/python/", "K", "Python programming test", 11),
+    ("OPQ32r", "/view/opq32r/", "P", "Occupational personality questionnaire", 25),
+]
+
+
+def write_csv(path, rows):
+    pd.DataFrame(rows, columns=["name", "url", "test_type", "description", "duration"]).to_csv(path, index=False)
+
+
+def build(csv_path, index_dir, incremental=False, **kwargs):
+    build_index = update_faiss_index if incremental else create_faiss_index
+    build_index(str(csv_path), str(index_dir), cache_dir=None, embedding_backend="hashing", embedding_dim=64,
+                **kwargs)
+
+
+def urls(index_dir):
+    return sorted(MetadataStore.load(resolve_index_dir(str(index_dir))).url.tolist())
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    csv_path = tmp_path / "catalog.csv"
+    write_csv(csv_path, ROWS)
+    return csv_path
+
+
+def test_build_publishes_a_version_behind_current(tmp_path, catalog):
+    index_dir = tmp_path / "index"
+    build(catalog, index_dir)
+    first = resolve_index_dir(str(index_dir))
+    assert os.path.dirname(first) == os.path.realpath(index_dir / VERSIONS_DIR)
+    for name in INDEX_FILE_NAMES:
+        assert os.readlink(index_dir / name) == os.path.join(CURRENT_LINK, name)
+    build(catalog, index_dir)
+    second = resolve_index_dir(str(index_dir))
+    assert second != first
+    # The previous version stays for readers that resolved it just before the switch
+    assert os.path.isdir(first)
+    build(catalog, index_dir)
+    assert not os.path.exists(first)
+    assert len(os.listdir(index_dir / VERSIONS_DIR)) == 2
+
+
+def test_incremental_first_run_matches_full_build(tmp_path, catalog):
+    full, incremental = tmp_path / "full", tmp_path / "incremental"
+    build(catalog, full)
+    build(catalog, full, incremental=True)
+    # A first incremental run on an unchanged CSV leaves the full build as it is
+    assert len(os.listdir(full / VERSIONS_DIR)) == 1
+    build(catalog, incremental, incremental=True)
+    assert urls(full) == urls(incremental) == ["/view/core-java/", "/view/opq32r/", "/view/python/",
+                                               "/view/verify-numerical/"]
+
+
+def test_chunked_build_matches_a_single_chunk(tmp_path):
+    csv_path = tmp_path / "catalog.csv"
+    # The repeated Python row lands in a later chunk than the first, and replaces it
+    write_csv(csv_path, ROWS[:4] + [("Python (v2)",) + ROWS[4][1:]] + ROWS[5:])
+    whole, chunked = tmp_path / "whole", tmp_path / "chunked"
+    build(csv_path, whole)
+    build(csv_path, chunked, chunksize=2)
+    whole_store = MetadataStore.load(resolve_index_dir(str(whole)))
+    chunked_store = MetadataStore.load(resolve_index_dir(str(chunked)))
+    assert len(chunked_store) == 4
+    assert dict(zip(whole_store.url, whole_store.name)) == dict(zip(chunked_store.url, chunked_store.name))
+    assert dict(zip(chunked_store.url, chunked_store.name))["/view/python/"] == "Python (v2)"
+
+
+def test_skipped_rows_are_warned_about(tmp_path, catalog, caplog):
+    build(catalog, tmp_path / "index")
+    warnings = [record.getMessage() for record in caplog.records if record.levelname == "WARNING"]
+    assert "Skipping 1 CSV rows without a URL" in warnings
+    assert any(message.startswith("1 URLs appear in several CSV rows") and "/view/python/" in message
+               for message in warnings)
+
+
+def test_engine_reloads_a_published_version(tmp_path, catalog):
+    index_dir = tmp_path / "index"
+    build(catalog, index_dir)
+    engine = RecommendationEngine(str(catalog), str(index_dir), embedding_backend=HashingEmbeddings(dim=64))
+    assert engine._snapshot.index.ntotal == 4
+    write_csv(catalog, ROWS[:2])
+    build(catalog, index_dir, incremental=True)
+    engine._reload_index_if_changed()
+    assert engine._snapshot.index.ntotal == 2
+    assert engine._snapshot.signature[0] == resolve_index_dir(str(index_dir))
+
+
+def test_legacy_docstore_is_converted_once(tmp_path, catalog, monkeypatch):
+    index_dir = tmp_path / "index"
+    build(catalog, index_dir)
+    version = resolve_index_dir(str(index_dir))
+    # An index from before metadata.npz and bm25.npz existed
+    for name in (MetadataStore.FILE_NAME, BM25Index.FILE_NAME):
+        os.remove(os.path.join(version, name))
+    engine = RecommendationEngine(str(catalog), str(index_dir), embedding_backend=HashingEmbeddings(dim=64))
+    for name in (MetadataStore.FILE_NAME, BM25Index.FILE_NAME):
+        assert os.path.exists(os.path.join(version, name))
+
+    def no_unpickling(*args, **kwargs):
+        raise AssertionError("index.pkl was unpickled again")
+
+    monkeypatch.setattr(recommendation_engine.pickle, "load", no_unpickling)
+    snapshot = engine._load_index()
+    assert sorted(snapshot.metadata.url.tolist()) == urls(index_dir)
+    assert len(snapshot.bm25) == 4
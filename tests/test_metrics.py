@@ -0,0 +1,58 @@
+import pandas as pd
+import pytest
+
+from benchmarks.fakes import FakeGenerativeModel, SlowEmbeddings
+from create_faiss_index import create_faiss_index
+from metrics import engine_metric_lines, finish_request_timing, start_request_timing, upstream_metric_lines
+from recommendation_engine import RecommendationEngine
+from upstream import CircuitBreaker, UpstreamClient
+
+
+@pytest.fixture(scope="module")
+def index_dir(tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp("metrics")
+    csv_path = tmp_path / "catalog.csv"
+    pd.DataFrame({
+        "name": ["Core Java (New)", "Python (New)", "Verify Numerical", "OPQ32r"],
+        "url": ["/view/java/", "/view/python/", "/view/numerical/", "/view/opq32r/"],
+        "test_type": ["K", "K", "A", "P"],
+        "duration": [20, 11, 18, 25],
+    }).to_csv(csv_path, index=False)
+    create_faiss_index(str(csv_path), str(tmp_path / "index"), cache_dir=None, embedding_backend="hashing")
+    return str(tmp_path / "index")
+
+
+def make_engine(index_dir, generate_upstream):
+    return RecommendationEngine(None, index_dir, embedding_backend=SlowEmbeddings(), model=FakeGenerativeModel(),
+                                semantic_cache_size=0, generate_upstream=generate_upstream)
+
+
+def test_batch_generations_are_timed_for_the_request(index_dir):
+    engine = make_engine(index_dir, UpstreamClient("generate", timeout=2.0))
+    token = start_request_timing()
+    results = engine.get_recommendations_batch(["java developer", "python developer", "numerical reasoning"])
+    timings = finish_request_timing(token)
+    assert all(results)
+    # Recorded on the batch's worker threads
+    assert timings["generate"] > 0
+    assert "parse" in timings
+
+
+def test_every_loaded_catalog_is_labelled(index_dir):
+    client = UpstreamClient("generate", timeout=2.0, breaker=CircuitBreaker(failure_threshold=1))
+    first, second = make_engine(index_dir, client), make_engine(index_dir, client)
+    first.get_recommendations("java developer")
+    client.breaker.record_failure()
+    second.get_recommendations("python developer")
+
+    lines = engine_metric_lines([("default", first), ("other", second)])
+    assert 'shl_llm_requests_total{catalog="default"} 1' in lines
+    assert 'shl_llm_requests_total{catalog="other"} 0' in lines
+    assert 'shl_cache_misses_total{catalog="other",cache="results"} 1' in lines
+
+    lines = upstream_metric_lines([("default", first), ("other", second)])
+    assert 'shl_fallbacks_total{catalog="other",kind="retrieval_only"} 1' in lines
+    assert not any(line.startswith('shl_fallbacks_total{catalog="default"') and not line.endswith(" 0")
+                   for line in lines)
+    # The shared client is reported once
+    assert sum(line.startswith('shl_upstream_calls_total{upstream="generate"}') for line in lines) == 1
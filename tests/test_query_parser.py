@@ -0,0 +1,35 @@
+import pytest
+
+from query_parser import parse_query_constraints
+
+
+@pytest.mark.parametrize("query", [
+    "Java developer, the test must support remote testing",
+    "Candidates will take it remotely",
+    "We need remote proctoring",
+    "An online assessment for sales graduates",
+    "Tests administered remotely, 30 minutes max",
+])
+def test_explicit_remote_testing_is_a_constraint(query):
+    assert parse_query_constraints(query)["remote"] is True
+
+
+@pytest.mark.parametrize("query", [
+    "Hiring an online marketing manager",
+    "Need a virtual assistant",
+    "Remote Python developer",
+])
+def test_remote_work_is_not_a_constraint(query):
+    assert parse_query_constraints(query)["remote"] is None
+
+
+@pytest.mark.parametrize("query, test_types", [
+    ("Java developer, include a knowledge test", ["K"]),
+    ("A behavioral assessment and a knowledge exam", ["K", "P"]),
+    ("Behavioural questionnaire for team leads", ["P"]),
+    ("Personality and cognitive tests", ["A", "P"]),
+    ("Content writer with strong English, SEO knowledge", None),
+    ("Behavioral health counsellor", None),
+])
+def test_test_types_need_an_explicit_request(query, test_types):
+    assert parse_query_constraints(query)["test_types"] == test_types
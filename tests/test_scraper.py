@@ -0,0 +1,197 @@
+import hashlib
+import importlib.util
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The module's file name is not importable as written
+_spec = importlib.util.spec_from_file_location("scraper", os.path.join(ROOT, "scrapper..py"))
+scraper = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(scraper)
+
+
+class CatalogServer(ThreadingHTTPServer):
+    """Serves assessment pages from `pages` ({path: (name, minutes, etag or None)}),
+    recording every request it gets. `failures` ({path: [status, ...]}) are
+    answered first, one per request, with "Retry-After: 0"."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), CatalogHandler)
+        self.pages = {}
+        self.failures = {}
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server_address[1]}{path}"
+
+    def requested(self, path):
+        return sum(1 for request in self.requests if request["path"] == path)
+
+
+class CatalogHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so a pooled session reuses its connections
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests.append({"path": self.path, "port": self.client_address[1], "at": time.monotonic(),
+                                         "if_none_match": self.headers.get("If-None-Match")})
+            failures = self.server.failures.get(self.path)
+            status = failures.pop(0) if failures else None
+        if status is not None:
+            self._send(status, b"", {"Retry-After": "0"})
+            return
+        if self.path not in self.server.pages:
+            self._send(404, b"")
+            return
+        name, minutes, etag = self.server.pages[self.path]
+        if etag is not None and self.headers.get("If-None-Match") == etag:
+            self._send(304, b"")
+            return
+        body = (f"<html><title>SHL</title><h1>{name}</h1>"
+                f"<p>Approximate Completion Time in minutes = {minutes}</p></html>").encode()
+        self._send(200, body, {"ETag": etag} if etag else {})
+
+    def _send(self, status, body, headers=None):
+        self.send_response(status)
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = CatalogServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_scraper(server, tmp_path, paths, **kwargs):
+    csv_path = tmp_path / "catalog.csv"
+    pd.DataFrame({"name": [f"Old {path}" for path in paths],
+                  "url": [server.url(path) for path in paths]}).to_csv(csv_path, index=False)
+    kwargs.setdefault("rate", 1000)
+    kwargs.setdefault("burst", 100)
+    return scraper.NameScraper(str(csv_path), str(tmp_path / "out.csv"), state_path=str(tmp_path / "state.json"),
+                               **kwargs)
+
+
+def test_resumes_from_checkpoint(server, tmp_path):
+    paths = [f"/view/test-{i}/" for i in range(6)]
+    server.pages = {path: (f"Test {i}", 10 + i, None) for i, path in enumerate(paths)}
+    # An interrupted run: three pages checkpointed, the last line cut short
+    partial = make_scraper(server, tmp_path, paths[:3])
+    partial._scrape_all({})
+    with open(partial.checkpoint_path, "a", encoding="utf-8") as f:
+        f.write('{"url": "' + server.url(paths[3]))
+    assert len(server.requests) == 3
+
+    make_scraper(server, tmp_path, paths).update_assessment_details()
+    assert [server.requested(path) for path in paths] == [1] * 6
+    out = pd.read_csv(tmp_path / "out.csv")
+    assert out["name"].tolist() == [f"Test {i}" for i in range(6)]
+    assert out["duration"].tolist() == [10 + i for i in range(6)]
+    assert not os.path.exists(partial.checkpoint_path)
+
+
+def test_token_bucket_spaces_requests():
+    bucket = scraper.TokenBucket(rate=20, capacity=1)
+    times = []
+    for _ in range(5):
+        bucket.acquire()
+        times.append(time.monotonic())
+    assert min(b - a for a, b in zip(times, times[1:])) >= 0.045
+
+
+def test_rate_limit_holds_across_workers(server, tmp_path):
+    paths = [f"/view/test-{i}/" for i in range(5)]
+    server.pages = {path: (f"Test {i}", 10, None) for i, path in enumerate(paths)}
+    name_scraper = make_scraper(server, tmp_path, paths, max_workers=4, rate=10, burst=1)
+    # Timed as sent: the server can pick requests up late, squeezing the gaps it sees
+    sent, get = [], name_scraper.session.get
+
+    def timed_get(*args, **kwargs):
+        sent.append(time.monotonic())
+        return get(*args, **kwargs)
+
+    name_scraper.session.get = timed_get
+    name_scraper.update_assessment_details()
+    sent.sort()
+    assert len(sent) == len(server.requests) == 5
+    assert min(b - a for a, b in zip(sent, sent[1:])) >= 0.07
+    assert sent[-1] - sent[0] >= 0.38
+
+
+def test_retries_are_rate_limited(server, tmp_path):
+    path = "/view/flaky/"
+    server.pages = {path: ("Flaky", 10, None)}
+    server.failures = {path: [503, 429, 502]}
+    name_scraper = make_scraper(server, tmp_path, [path], rate=10, burst=1, retry_backoff=0)
+    sent, get = [], name_scraper.session.get
+
+    def timed_get(*args, **kwargs):
+        sent.append(time.monotonic())
+        return get(*args, **kwargs)
+
+    name_scraper.session.get = timed_get
+    name_scraper.update_assessment_details()
+    assert len(sent) == len(server.requests) == 4
+    # Without a backoff, only the token bucket spaces the retries
+    assert min(b - a for a, b in zip(sent, sent[1:])) >= 0.07
+    assert pd.read_csv(tmp_path / "out.csv")["name"].tolist() == ["Flaky"]
+
+    # Retries are bounded: a page that keeps failing is reported as an error
+    server.failures = {path: [503] * 5}
+    make_scraper(server, tmp_path, [path], max_retries=2, retry_backoff=0).update_assessment_details()
+    assert len(server.requests) == 4 + 3
+
+
+def test_unmodified_pages_are_skipped(server, tmp_path):
+    tagged, untagged, edited = "/view/tagged/", "/view/untagged/", "/view/edited/"
+    paths = [tagged, untagged, edited]
+    server.pages = {tagged: ("Tagged", 10, '"v1"'), untagged: ("Untagged", 20, None), edited: ("Edited", 30, None)}
+    make_scraper(server, tmp_path, paths).update_assessment_details()
+    first_run = len(server.requests)
+    assert len(pd.read_csv(tmp_path / "out_changed.csv")) == 3
+    state = json.loads((tmp_path / "state.json").read_text())
+    assert state[server.url(tagged)]["etag"] == '"v1"'
+    body = (b"<html><title>SHL</title><h1>Untagged</h1>"
+            b"<p>Approximate Completion Time in minutes = 20</p></html>")
+    assert state[server.url(untagged)]["hash"] == hashlib.sha256(body).hexdigest()
+
+    server.pages[edited] = ("Edited", 35, None)
+    make_scraper(server, tmp_path, paths).update_assessment_details()
+    second_run = server.requests[first_run:]
+    assert next(r for r in second_run if r["path"] == tagged)["if_none_match"] == '"v1"'
+    # 304 for the tagged page, the same bytes for the untagged one: only the edited row is reported
+    changed = pd.read_csv(tmp_path / "out_changed.csv")
+    assert changed["url"].tolist() == [server.url(edited)]
+    assert changed["duration"].tolist() == [35]
+    assert pd.read_csv(tmp_path / "out.csv")["name"].tolist() == ["Tagged", "Untagged", "Edited"]
+
+
+def test_workers_share_pooled_connections(server, tmp_path):
+    paths = [f"/view/test-{i}/" for i in range(12)]
+    server.pages = {path: (f"Test {i}", 10, None) for i, path in enumerate(paths)}
+    make_scraper(server, tmp_path, paths, max_workers=3).update_assessment_details()
+    assert len(server.requests) == 12
+    # One connection per worker at most, each reused for several pages
+    assert len({request["port"] for request in server.requests}) <= 3
@@ -0,0 +1,72 @@
+"""The Flask and asyncio apps against the same engine: one contract, from service.py."""
+import json
+
+import pandas as pd
+import pytest
+from starlette.testclient import TestClient
+
+import service
+from benchmarks.fakes import FakeGenerativeModel, SlowEmbeddings
+from create_faiss_index import create_faiss_index
+from engine_registry import DEFAULT_CATALOG
+from recommendation_engine import RecommendationEngine
+
+
+@pytest.fixture(scope="module")
+def clients(tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp("service")
+    csv_path = tmp_path / "catalog.csv"
+    pd.DataFrame({
+        "name": ["Core Java (New)", "Python (New)", "Verify Numerical", "OPQ32r"],
+        "url": ["/view/java/", "/view/python/", "/view/numerical/", "/view/opq32r/"],
+        "test_type": ["K", "K", "A", "P"],
+        "duration": [20, 11, 18, 25],
+    }).to_csv(csv_path, index=False)
+    create_faiss_index(str(csv_path), str(tmp_path / "index"), cache_dir=None, embedding_backend="hashing")
+    engine = RecommendationEngine(None, str(tmp_path / "index"), embedding_backend=SlowEmbeddings(),
+                                  model=FakeGenerativeModel(), semantic_cache_size=0)
+    # Registered before the apps are imported, so asgi_app's startup load finds it
+    service.engines.add(DEFAULT_CATALOG, engine)
+    import app
+    import asgi_app
+    return {"flask": app.app.test_client(), "asgi": TestClient(asgi_app.app)}
+
+
+def payload(response):
+    # Flask's test responses have get_json(), httpx's json()
+    return response.get_json() if hasattr(response, "get_json") else response.json()
+
+
+@pytest.mark.parametrize("body, status, error", [
+    (["java"], 400, "Query field is required"),
+    ({"query": "  "}, 400, "Query field is required"),
+    ({"query": "java", "mode": "fast"}, 400, "mode must be 'llm' or 'retrieval'"),
+    ({"query": "java", "catalog": 7}, 400, "catalog must be a string"),
+    ({"query": "java", "catalog": "missing"}, 404, "Unknown catalog: missing"),
+])
+def test_invalid_requests_are_rejected_alike(clients, body, status, error):
+    for client in clients.values():
+        response = client.post("/recommend", json=body)
+        assert response.status_code == status
+        assert payload(response) == {"error": error}
+
+
+def test_health_reports_readiness_in_both_apps(clients):
+    bodies = [payload(client.get("/health")) for client in clients.values()]
+    assert bodies[0].keys() == bodies[1].keys() == {"status", "ready", "engine_load_seconds", "startup_seconds"}
+    assert all(body["ready"] and body["startup_seconds"] is not None for body in bodies)
+
+
+def test_both_apps_serve_the_same_recommendations(clients):
+    results = {}
+    for name, client in clients.items():
+        single = payload(client.post("/recommend", json={"query": "java developer", "mode": "retrieval"}))
+        stream = [json.loads(line) for line in
+                  client.post("/recommend/stream", json={"query": "java developer"}).text.splitlines()]
+        batch = [json.loads(line) for line in
+                 client.post("/recommend/batch", json={"queries": ["java", "python"], "mode": "retrieval"})
+                 .text.splitlines()]
+        results[name] = (single, stream, batch)
+        assert stream[-1] == {"done": True, "count": len(stream) - 1}
+        assert len(batch) == 2
+    assert results["flask"] == results["asgi"]
@@ -0,0 +1,31 @@
+import pytest
+
+from structured_output import SelectionStreamParser, StructuredOutputError, parse_selection
+
+TRUNCATED = ('{"recommendations": [{"id": 1, "rationale": "Java."}, {"id": 2, "rationale": "Python."}, '
+             '{"id": 3, "rat')
+
+
+def test_complete_response_is_parsed_in_order():
+    text = '{"recommendations": [{"id": 2, "rationale": " Python. "}, {"id": 9}, {"id": 2}, {"id": 1}]}'
+    assert parse_selection(text, 3) == ([(1, "Python."), (0, "")], True)
+
+
+def test_truncated_response_keeps_the_complete_items_like_the_stream_parser():
+    assert parse_selection(TRUNCATED, 5) == ([(0, "Java."), (1, "Python.")], False)
+
+    parser = SelectionStreamParser(5)
+    chunks = [TRUNCATED[start:start + 7] for start in range(0, len(TRUNCATED), 7)]
+    streamed = [selected for chunk in chunks for selected in parser.feed(chunk)]
+    assert streamed == [(0, "Java."), (1, "Python.")]
+    assert parser.close() is False
+
+
+@pytest.mark.parametrize("text", ['{"recommendations": [{"id": 1, "rat', "Sorry, I can't help", '{"picks": []}'])
+def test_response_without_a_usable_selection_raises(text):
+    with pytest.raises(StructuredOutputError):
+        parse_selection(text, 5)
+    parser = SelectionStreamParser(5)
+    assert parser.feed(text) == []
+    with pytest.raises(StructuredOutputError):
+        parser.close()
@@ -0,0 +1,215 @@
+import time
+
+import pandas as pd
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from benchmarks.fakes import FakeGenerativeModel, Faults, Latency, SlowEmbeddings, _response
+from create_faiss_index import create_faiss_index
+from recommendation_engine import RecommendationEngine
+from upstream import CircuitBreaker, CircuitOpenError, UpstreamClient, UpstreamTimeout, UpstreamUnavailable
+
+
+class ScriptedFaults(Faults):
+    """Faults that play back `outcomes`, one (extra delay, exception) per call, then none."""
+
+    def __init__(self, outcomes):
+        super().__init__()
+        self.outcomes = list(outcomes)
+
+    def draw(self):
+        return self.outcomes.pop(0) if self.outcomes else (0.0, None)
+
+
+def generate(model):
+    """A call for UpstreamClient: one Gemini generation carrying the attempt's deadline."""
+    return lambda timeout: model.generate_content("[0] Core Java", request_options={"timeout": timeout})
+
+
+def test_breaker_opens_half_opens_and_closes():
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10, timer=lambda: now[0])
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    now[0] = 10.0
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # One probe at a time
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    now[0] = 20.0
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow() and breaker.allow()
+    assert breaker.opened == 2
+
+
+def test_call_fails_at_its_deadline():
+    client = UpstreamClient("embed", timeout=0.2, max_attempts=1)
+    embeddings = SlowEmbeddings(Latency(2.0))
+    started = time.monotonic()
+    # A backend that ignores the timeout is abandoned at the deadline
+    with pytest.raises(UpstreamTimeout):
+        client.call(lambda timeout: embeddings.embed_query("java"))
+    assert time.monotonic() - started < 0.5
+    # One that carries it gives up by itself, and the call fails just as soon
+    started = time.monotonic()
+    with pytest.raises(UpstreamUnavailable):
+        client.call(lambda timeout: embeddings.embed_query("java", timeout=timeout))
+    assert time.monotonic() - started < 0.5
+    assert client.stats()["timeouts"] + client.stats()["failures"] == 2
+
+
+def test_hedge_wins_over_a_stalled_attempt():
+    model = FakeGenerativeModel(Latency(0.01), faults=ScriptedFaults([(5.0, None)]))
+    client = UpstreamClient("generate", timeout=2.0, hedge_after=0.05)
+    started = time.monotonic()
+    response = client.call(generate(model))
+    assert time.monotonic() - started < 0.5
+    assert '"id": 0' in response.text
+    assert model.calls == 2
+    assert client.stats()["hedges"] == client.stats()["hedge_wins"] == 1
+
+
+def test_failed_attempt_is_retried():
+    model = FakeGenerativeModel(faults=ScriptedFaults([(0.0, google_exceptions.ServiceUnavailable("down"))]))
+    client = UpstreamClient("generate", timeout=2.0)
+    assert client.call(generate(model)).text
+    assert client.stats()["retries"] == 1
+
+
+def test_bad_requests_do_not_count_against_the_circuit():
+    bad_request = [(0.0, google_exceptions.InvalidArgument("bad prompt"))] * 5
+    model = FakeGenerativeModel(faults=ScriptedFaults(bad_request))
+    client = UpstreamClient("generate", timeout=1.0, breaker=CircuitBreaker(failure_threshold=2))
+    for _ in range(5):
+        # Raised as it is, without a retry
+        with pytest.raises(google_exceptions.InvalidArgument):
+            client.call(generate(model))
+    assert client.breaker.state == CircuitBreaker.CLOSED
+    assert model.calls == 5
+
+    # A 429 means the API is overloaded, and does count
+    rate_limited = [(0.0, google_exceptions.ResourceExhausted("quota"))] * 4
+    model = FakeGenerativeModel(faults=ScriptedFaults(rate_limited))
+    for _ in range(2):
+        with pytest.raises(UpstreamUnavailable):
+            client.call(generate(model))
+    assert client.breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        client.call(generate(model))
+
+
+def test_stream_chunks_share_the_deadline():
+    client = UpstreamClient("generate", timeout=0.3, breaker=CircuitBreaker(failure_threshold=1))
+
+    def stalling_stream(timeout):
+        yield "first"
+        time.sleep(2)
+        yield "second"
+
+    chunks = []
+    started = time.monotonic()
+    with pytest.raises(UpstreamTimeout):
+        for chunk in client.stream(stalling_stream):
+            chunks.append(chunk)
+    assert chunks == ["first"]
+    assert time.monotonic() - started < 0.6
+    assert client.breaker.state == CircuitBreaker.OPEN
+
+    client.breaker.reset_timeout = 0
+    assert list(client.stream(lambda timeout: iter(["a", "b"]))) == ["a", "b"]
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.fixture(scope="module")
+def index_dir(tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp("upstream")
+    csv_path = tmp_path / "catalog.csv"
+    pd.DataFrame({
+        "name": ["Core Java (New)", "Python (New)", "Verify Numerical", "OPQ32r", "Sales Interview"],
+        "url": ["/view/java/", "/view/python/", "/view/numerical/", "/view/opq32r/", "/view/sales/"],
+        "test_type": ["K", "K", "A", "P", "B"],
+        "duration": [20, 11, 18, 25, 30],
+    }).to_csv(csv_path, index=False)
+    create_faiss_index(str(csv_path), str(tmp_path / "index"), cache_dir=None, embedding_backend="hashing")
+    return str(tmp_path / "index")
+
+
+def make_engine(index_dir, model, generate_timeout=2.0):
+    return RecommendationEngine(None, index_dir, embedding_backend=SlowEmbeddings(), model=model,
+                                semantic_cache_size=0,
+                                generate_upstream=UpstreamClient("generate", timeout=generate_timeout,
+                                                                 breaker=CircuitBreaker(failure_threshold=1)))
+
+
+def test_open_circuit_serves_retrieval_only_results(index_dir):
+    model = FakeGenerativeModel()
+    engine = make_engine(index_dir, model)
+    engine.generate_upstream.breaker.record_failure()
+
+    records = engine.get_recommendations("java developer")
+    assert records and all("rationale" not in record for record in records)
+    assert records[0]["url"].endswith("/view/java/")
+    assert model.calls == 0
+    assert engine.upstream_stats()["fallbacks"]["retrieval_only"] == 1
+    assert engine.generate_upstream.stats()["rejected"] == 1
+
+    # The degraded result was not cached: once the circuit closes, Gemini answers
+    engine.generate_upstream.breaker.record_success()
+    records = engine.get_recommendations("java developer")
+    assert all("rationale" in record for record in records)
+    assert model.calls == 1
+
+
+def test_stalled_stream_falls_back_to_retrieval(index_dir):
+    class StallingModel(FakeGenerativeModel):
+        def _stream(self, text, prompt, delay):
+            # Half a record, then nothing until long after the deadline
+            yield _response(text[:10], prompt)
+            time.sleep(3)
+            yield _response(text[10:], prompt)
+
+    engine = make_engine(index_dir, StallingModel(), generate_timeout=0.3)
+    started = time.monotonic()
+    records = list(engine.iter_recommendations_stream("java developer"))
+    assert time.monotonic() - started < 1.0
+    assert records and all("rationale" not in record for record in records)
+    assert engine.generate_upstream.breaker.state == CircuitBreaker.OPEN
+    assert engine.upstream_stats()["fallbacks"]["retrieval_only"] == 1
+
+
+def test_truncated_response_is_served_but_not_cached(index_dir):
+    class TruncatingModel(FakeGenerativeModel):
+        def _answer(self, prompt):
+            # Cut off by the output token limit inside the third record
+            text = super()._answer(prompt)
+            return text[:text.index('{"id": 3')] + '{"id": 3, "rat'
+
+    model = TruncatingModel()
+    engine = make_engine(index_dir, model)
+    records = engine.get_recommendations("java developer")
+    assert len(records) == 2 and all(record["rationale"] for record in records)
+    engine.get_recommendations("java developer")
+    assert model.calls == 2
+
+
+def test_unparseable_response_falls_back_to_retrieval(index_dir):
+    class RefusingModel(FakeGenerativeModel):
+        def _answer(self, prompt):
+            return "I cannot help with that."
+
+    engine = make_engine(index_dir, RefusingModel())
+    records = engine.get_recommendations("java developer")
+    assert records and all("rationale" not in record for record in records)
+    assert engine.upstream_stats()["fallbacks"]["retrieval_only"] == 1
+    streamed = list(engine.iter_recommendations_stream("java developer"))
+    assert [record["url"] for record in streamed] == [record["url"] for record in records]
@@ -0,0 +1,194 @@
+"""UpstreamClient and the engine against a local fake of the Gemini REST API.
+
+The Gemini SDK is pointed at the fake with GEMINI_TRANSPORT=rest and
+GEMINI_API_ENDPOINT, so every call goes through its real HTTP session:
+keep-alive connections, request timeouts and HTTP error statuses.
+"""
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import google.generativeai as genai
+import pandas as pd
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+import upstream
+from benchmarks.fakes import SlowEmbeddings
+from create_faiss_index import create_faiss_index
+from embeddings import GoogleGenAIEmbeddings
+from recommendation_engine import RecommendationEngine
+from upstream import CircuitBreaker, UpstreamClient, UpstreamUnavailable
+
+_STATUS_NAMES = {400: "INVALID_ARGUMENT", 500: "INTERNAL", 503: "UNAVAILABLE"}
+
+
+class GeminiServer(ThreadingHTTPServer):
+    """Answers generateContent, embedContent and batchEmbedContents like the Gemini API.
+
+    `faults` is played back one (delay in seconds, HTTP status) per request,
+    then requests are answered at once. Every request is recorded with the
+    client port it came from.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), GeminiHandler)
+        self.faults = []
+        self.requests = []
+        self.lock = threading.Lock()
+
+    @property
+    def endpoint(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def ports(self):
+        with self.lock:
+            return {request["port"] for request in self.requests}
+
+
+class GeminiHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so a pooled session reuses its connections
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        method = self.path.split("?")[0].rsplit(":", 1)[-1]
+        with self.server.lock:
+            self.server.requests.append({"method": method, "port": self.client_address[1]})
+            delay, status = self.server.faults.pop(0) if self.server.faults else (0.0, 200)
+        time.sleep(delay)
+        if status != 200:
+            self._send(status, {"error": {"code": status, "message": "injected fault",
+                                          "status": _STATUS_NAMES.get(status, "UNKNOWN")}})
+        elif method == "generateContent":
+            text = json.dumps({"recommendations": [{"id": 1, "rationale": "The best match."}]})
+            self._send(200, {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"},
+                                             "finishReason": "STOP"}],
+                             "usageMetadata": {"promptTokenCount": 50, "candidatesTokenCount": 10}})
+        elif method == "batchEmbedContents":
+            self._send(200, {"embeddings": [{"values": [0.5, 0.5]} for _ in body["requests"]]})
+        else:
+            self._send(200, {"embedding": {"values": [0.5, 0.5]}})
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up at its deadline
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = GeminiServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("GOOGLE_API_KEY", "test-key")
+    monkeypatch.setenv("GEMINI_TRANSPORT", "rest")
+    monkeypatch.setenv("GEMINI_API_ENDPOINT", server.endpoint)
+    monkeypatch.setattr(upstream, "_gemini_settings", None)
+    yield server
+    server.shutdown()
+    server.server_close()
+    # Later tests must not reach the fake through the SDK's cached clients
+    genai.configure(api_key="unused")
+
+
+@pytest.fixture(scope="module")
+def index_dir(tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp("upstream_http")
+    csv_path = tmp_path / "catalog.csv"
+    pd.DataFrame({
+        "name": ["Core Java (New)", "Python (New)", "Verify Numerical", "OPQ32r"],
+        "url": ["/view/java/", "/view/python/", "/view/numerical/", "/view/opq32r/"],
+        "test_type": ["K", "K", "A", "P"],
+        "duration": [20, 11, 18, 25],
+    }).to_csv(csv_path, index=False)
+    create_faiss_index(str(csv_path), str(tmp_path / "index"), cache_dir=None, embedding_backend="hashing")
+    return str(tmp_path / "index")
+
+
+def make_engine(index_dir, generate_upstream):
+    # The real Gemini model, through the SDK configured for the fake
+    return RecommendationEngine(None, index_dir, embedding_backend=SlowEmbeddings(), semantic_cache_size=0,
+                                generate_upstream=generate_upstream)
+
+
+def test_engines_share_pooled_connections(server, index_dir):
+    client = UpstreamClient("generate", timeout=2.0, max_concurrency=4)
+    first = make_engine(index_dir, client)
+    for query in ("java developer", "python developer", "numerical reasoning"):
+        assert first.get_recommendations(query)[0]["rationale"] == "The best match."
+    assert len(server.requests) == 3
+    assert len(server.ports()) == 1
+
+    # Loading another catalog's engine does not reconfigure the SDK and drop its connections
+    second = make_engine(index_dir, client)
+    second.get_recommendations("personality questionnaire")
+    assert len(server.ports()) == 1
+
+    queries = [f"java developer {n}" for n in range(20)]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(second.get_recommendations, queries))
+    assert all(records[0]["rationale"] for records in results)
+    assert len(server.requests) == 24
+    # At most one connection per concurrent call
+    assert len(server.ports()) <= client.max_concurrency
+
+
+def test_slow_server_fails_at_the_deadline(server, index_dir):
+    engine = make_engine(index_dir, UpstreamClient("generate", timeout=0.3))
+    server.faults = [(2.0, 200)] * 2
+    started = time.monotonic()
+    records = engine.get_recommendations("java developer")
+    assert time.monotonic() - started < 1.0
+    assert records and all("rationale" not in record for record in records)
+    assert engine.upstream_stats()["fallbacks"]["retrieval_only"] == 1
+
+    # Embedding requests carry the deadline too
+    embeddings = GoogleGenAIEmbeddings(model="models/text-embedding-004")
+    client = UpstreamClient("embed", timeout=0.3, max_attempts=1)
+    server.faults = [(2.0, 200)]
+    started = time.monotonic()
+    with pytest.raises(UpstreamUnavailable):
+        client.call(lambda timeout: embeddings.embed_query("java", timeout=timeout))
+    assert time.monotonic() - started < 1.0
+    assert client.call(lambda timeout: embeddings.embed_query("java", timeout=timeout)) == [0.5, 0.5]
+
+
+def test_server_errors_are_retried_and_open_the_circuit(server, index_dir):
+    client = UpstreamClient("generate", timeout=2.0, breaker=CircuitBreaker(failure_threshold=1))
+    engine = make_engine(index_dir, client)
+    server.faults = [(0.0, 503)]
+    started = time.monotonic()
+    assert engine.get_recommendations("java developer")[0]["rationale"] == "The best match."
+    # Retried once by the client, at once; not by the SDK, which would back off for a second first
+    assert client.stats()["retries"] == 1
+    assert len(server.requests) == 2
+    assert time.monotonic() - started < 0.5
+
+    # A 400 is the request's fault: raised, and not counted against the circuit
+    server.faults = [(0.0, 400)]
+    with pytest.raises(google_exceptions.BadRequest):
+        engine.get_recommendations("python developer")
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+    server.faults = [(0.0, 500)] * 2
+    records = engine.get_recommendations("numerical reasoning")
+    assert records and all("rationale" not in record for record in records)
+    assert client.breaker.state == CircuitBreaker.OPEN
+    sent = len(server.requests)
+    engine.get_recommendations("personality questionnaire")
+    # Refused without reaching the server
+    assert len(server.requests) == sent
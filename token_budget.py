@@ -0,0 +1,61 @@
+import threading
+
+# Gemini's tokenizer averages about four characters of English per token.
+# Counting exactly would cost a count_tokens round trip per request, so the
+# budget is enforced on this estimate and the real counts are recorded from
+# each response's usage metadata.
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def lines_within_budget(lines, budget, fixed_text=""):
+    """How many of `lines` (in order, newline-joined) fit in `budget` tokens alongside `fixed_text`.
+
+    At least one line is always kept, so an overlong query still gets an answer.
+    """
+    used = estimate_tokens(fixed_text)
+    count = 0
+    for line in lines:
+        used += estimate_tokens(line + "\n")
+        if used > budget and count:
+            break
+        count += 1
+    return count
+
+
+class TokenUsage:
+    """Running prompt/response token totals for LLM calls, from Gemini's usage metadata."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.response_tokens = 0
+        self.last = None
+
+    def record(self, usage_metadata):
+        """Add one call's counts; returns them as (prompt_tokens, response_tokens)."""
+        if usage_metadata is None:
+            return None
+        prompt_tokens = int(getattr(usage_metadata, "prompt_token_count", 0) or 0)
+        response_tokens = int(getattr(usage_metadata, "candidates_token_count", 0) or 0)
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+            self.response_tokens += response_tokens
+            self.last = {"prompt_tokens": prompt_tokens, "response_tokens": response_tokens}
+        return prompt_tokens, response_tokens
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "prompt_tokens": self.prompt_tokens,
+                "response_tokens": self.response_tokens,
+                "mean_prompt_tokens": self.prompt_tokens / self.requests if self.requests else 0.0,
+                "mean_response_tokens": self.response_tokens / self.requests if self.requests else 0.0,
+                "last": self.last,
+            }
@@ -0,0 +1,409 @@
+"""Deadlines, concurrency limits, circuit breaking and hedging for calls to the embedding and Gemini APIs.
+
+The engine sends every upstream call through an UpstreamClient, one per
+API. The clients are created once per process and shared by every engine,
+so the same thread pool serves all requests. configure_gemini sets up the
+Gemini SDK once per process too, so every engine also shares its clients
+and their connections (one gRPC channel, or with GEMINI_TRANSPORT=rest a
+pooled keep-alive HTTP session):
+
+- deadline: a call returns or fails within `timeout` seconds; the
+  remaining time is passed to the call so the request itself can carry it
+  (see request_options)
+- concurrency: at most `max_concurrency` calls are in flight; a call that
+  gets no slot before its deadline fails instead of queueing
+- circuit breaker: after `failure_threshold` consecutive failures, calls
+  are refused at once for `reset_timeout` seconds, then a single probe
+  call decides whether to close the circuit again
+- retries and hedging: a failed attempt is retried while the deadline
+  allows, and with `hedge_after` set, an attempt still running after that
+  long gets a second identical one alongside it; the first answer wins.
+  A call makes at most `max_attempts` attempts
+- streams: `stream(fn)` opens a streamed response like a call (never
+  hedged), and its chunks must all arrive within the same deadline
+
+A call that cannot be made or completed raises UpstreamUnavailable. The
+engine answers such requests from retrieval alone. Errors caused by the
+request itself, such as a 400, are raised unchanged and do not count
+against the circuit.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from queue import Empty, Queue
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30.0
+
+
+_gemini_lock = threading.Lock()
+_gemini_settings = None
+
+
+def configure_gemini(api_key):
+    """Configure google.generativeai for `api_key`, unless it already is.
+
+    genai.configure drops the clients it has made, and with them their open
+    connections, so it is only called again when the settings change.
+    GEMINI_TRANSPORT selects "grpc" (the default) or "rest"; the asyncio
+    serving path needs gRPC. GEMINI_API_ENDPOINT overrides the API host,
+    e.g. "http://127.0.0.1:8080" for a proxy or a local fake.
+    """
+    global _gemini_settings
+    # Imported here so importing this module does not pull in the Gemini SDK
+    import google.generativeai as genai
+    settings = (api_key, os.getenv("GEMINI_TRANSPORT") or None, os.getenv("GEMINI_API_ENDPOINT") or None)
+    with _gemini_lock:
+        if settings == _gemini_settings:
+            return
+        _, transport, api_endpoint = settings
+        genai.configure(api_key=api_key, transport=transport,
+                        client_options={"api_endpoint": api_endpoint} if api_endpoint else None)
+        _gemini_settings = settings
+
+
+def request_options(timeout):
+    """Gemini SDK request options for one attempt of a call with `timeout` seconds left.
+
+    The SDK's own retry policy is turned off: it retries a 503 with backoff
+    for up to 600s, out of sight of the deadline and the circuit breaker.
+    UpstreamClient decides on retries instead.
+    """
+    return {"timeout": timeout, "retry": None}
+
+
+class UpstreamUnavailable(RuntimeError):
+    """The upstream API could not answer in time, failed, or is cut off by its circuit breaker."""
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    pass
+
+
+class UpstreamTimeout(UpstreamUnavailable):
+    pass
+
+
+def is_failure(error):
+    """Whether `error` says the upstream is unhealthy, rather than that the request was bad."""
+    # google.api_core exceptions carry the HTTP status; 429 means overloaded, other 4xx a bad request
+    code = getattr(error, "code", None)
+    if isinstance(code, int) and 400 <= code < 500:
+        return code == 429
+    return not isinstance(error, (ValueError, TypeError))
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker: closed -> open -> half open (one probe) -> closed or open."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_TIMEOUT,
+                 name="upstream", timer=time.monotonic):
+        if failure_threshold < 1:
+            raise ValueError(f"failure_threshold must be at least 1, got {failure_threshold}")
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.name = name
+        self._timer = timer
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.opened = 0
+
+    def _current_state(self):
+        if self._state == self.OPEN and self._timer() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._probing = False
+        return self._state
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def allow(self):
+        """Whether a call may go ahead; in the half-open state only the first caller gets through."""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info(f"{self.name} circuit closed")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._state == self.HALF_OPEN or (self._state == self.CLOSED
+                                                 and self._failures >= self.failure_threshold):
+                self._state = self.OPEN
+                self._opened_at = self._timer()
+                self.opened += 1
+                logger.warning(f"{self.name} circuit opened after {self._failures} consecutive failures; "
+                               f"retrying in {self.reset_timeout:g}s")
+
+
+class UpstreamClient:
+    """Runs calls to one upstream API under a deadline, a concurrency limit, a circuit breaker and hedging.
+
+    `call(fn)` runs `fn(timeout)` on the client's thread pool and waits
+    for it no longer than the deadline. A blocking call that is abandoned
+    keeps its slot until it really returns, so a hung upstream soon leaves
+    no free slots and later calls fail fast. `acall(fn)` awaits the
+    coroutine `fn(timeout)` and cancels attempts it gives up on.
+    """
+
+    def __init__(self, name, timeout=DEFAULT_TIMEOUT, max_concurrency=DEFAULT_MAX_CONCURRENCY, hedge_after=None,
+                 max_attempts=2, breaker=None):
+        if max_concurrency < 1:
+            raise ValueError(f"max_concurrency must be at least 1, got {max_concurrency}")
+        if max_attempts < 1:
+            raise ValueError(f"max_attempts must be at least 1, got {max_attempts}")
+        self.name = name
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.hedge_after = hedge_after
+        self.max_attempts = max_attempts
+        self.breaker = breaker if breaker is not None else CircuitBreaker(name=name)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        # Threads are started on first use, so a client created before a fork carries none across it
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix=f"upstream-{name}")
+        self._async_slots = None
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(("calls", "failures", "timeouts", "rejected", "retries", "hedges",
+                                      "hedge_wins"), 0)
+
+    @classmethod
+    def from_env(cls, name, default_timeout=DEFAULT_TIMEOUT):
+        """A client configured from <NAME>_TIMEOUT, <NAME>_HEDGE_MS and the shared UPSTREAM_* variables."""
+        prefix = name.upper()
+        hedge_ms = float(os.getenv(f"{prefix}_HEDGE_MS", 0))
+        return cls(
+            name,
+            timeout=float(os.getenv(f"{prefix}_TIMEOUT", default_timeout)),
+            max_concurrency=int(os.getenv("UPSTREAM_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)),
+            hedge_after=hedge_ms / 1000 if hedge_ms > 0 else None,
+            max_attempts=int(os.getenv("UPSTREAM_MAX_ATTEMPTS", 2)),
+            breaker=CircuitBreaker(
+                failure_threshold=int(os.getenv("UPSTREAM_BREAKER_FAILURES", DEFAULT_FAILURE_THRESHOLD)),
+                reset_timeout=float(os.getenv("UPSTREAM_BREAKER_RESET_SECONDS", DEFAULT_RESET_TIMEOUT)),
+                name=name,
+            ),
+        )
+
+    def _count(self, field):
+        with self._lock:
+            self._counts[field] += 1
+
+    def _admit(self):
+        self._count("calls")
+        if not self.breaker.allow():
+            self._count("rejected")
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        return time.monotonic() + self.timeout
+
+    def _next_wait(self, started, attempts, hedge):
+        """Seconds until the next hedge is due, or None if no hedge will be started."""
+        if not hedge or self.hedge_after is None or attempts >= self.max_attempts:
+            return None
+        return max(started + self.hedge_after - time.monotonic(), 0.0)
+
+    def _failed(self, error, timeout=False):
+        self._count("timeouts" if timeout else "failures")
+        self.breaker.record_failure()
+        if timeout:
+            raise UpstreamTimeout(error)
+        raise UpstreamUnavailable(f"{self.name} call failed: {error}") from error
+
+    def _finish(self, error, timed_out):
+        """Raise for a call that ended without an answer: `timed_out` if attempts were still running."""
+        if error is not None and not is_failure(error):
+            # The upstream answered; the request was at fault
+            self.breaker.record_success()
+            raise error
+        if timed_out:
+            self._failed(f"{self.name} call timed out after {self.timeout:g}s", timeout=True)
+        self._failed(error)
+
+    def call(self, fn, hedge=True):
+        """`fn(timeout)`'s result, from the first attempt to succeed before the deadline."""
+        deadline = self._admit()
+        if not self._slots.acquire(timeout=self.timeout):
+            self._failed(f"no free {self.name} slot within {self.timeout:g}s", timeout=True)
+
+        def start():
+            future = self._executor.submit(fn, max(deadline - time.monotonic(), 0.001))
+            future.add_done_callback(lambda _: self._slots.release())
+            return future
+
+        running = [start()]
+        hedges = []
+        attempts, started, error = 1, time.monotonic(), None
+        while running:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            hedge_wait = self._next_wait(started, attempts, hedge)
+            done, _ = wait(running, timeout=remaining if hedge_wait is None else min(remaining, hedge_wait),
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                running.remove(future)
+                if future.exception() is None:
+                    self.breaker.record_success()
+                    if future in hedges:
+                        self._count("hedge_wins")
+                    return future.result()
+                error = future.exception()
+            if error is not None and not is_failure(error):
+                break
+            if running and done:
+                continue
+            # Retry a failed attempt, or hedge a slow one, while attempts and slots remain
+            if not running or (hedge_wait is not None and time.monotonic() < deadline):
+                if attempts < self.max_attempts and self._slots.acquire(blocking=False):
+                    future = start()
+                    if running:
+                        self._count("hedges")
+                        hedges.append(future)
+                    else:
+                        self._count("retries")
+                    running.append(future)
+                    attempts += 1
+                    started = time.monotonic()
+                    continue
+                hedge = False
+        for future in running:
+            future.cancel()
+        self._finish(error, timed_out=bool(running))
+
+    def stream(self, fn):
+        """An iterator over the chunks of the stream `fn(timeout)` opens, all within one deadline.
+
+        Opening the stream fails like call(). Chunks are read on a thread of
+        their own, so one that does not arrive before the deadline raises
+        UpstreamTimeout even while the read is blocked. A stream that fails
+        or stalls part way counts against the circuit.
+        """
+        deadline = time.monotonic() + self.timeout
+        return self._read_stream(self.call(fn, hedge=False), deadline)
+
+    def _read_stream(self, chunks, deadline):
+        queue = Queue()
+
+        def read():
+            try:
+                for chunk in chunks:
+                    queue.put((True, chunk))
+                queue.put((False, None))
+            except Exception as e:
+                queue.put((False, e))
+
+        threading.Thread(target=read, name=f"upstream-{self.name}-stream", daemon=True).start()
+        while True:
+            try:
+                more, item = queue.get(timeout=max(deadline - time.monotonic(), 0.0))
+            except Empty:
+                self._failed(f"{self.name} stream timed out after {self.timeout:g}s", timeout=True)
+            if more:
+                yield item
+            elif item is None:
+                self.breaker.record_success()
+                return
+            else:
+                self._finish(item, timed_out=False)
+
+    def _loop_slots(self):
+        # asyncio primitives belong to one event loop; uvicorn runs one per worker
+        if self._async_slots is None:
+            self._async_slots = asyncio.Semaphore(self.max_concurrency)
+        return self._async_slots
+
+    async def acall(self, fn, hedge=True):
+        """Async variant of call: awaits `fn(timeout)`, cancelling attempts once it has an answer or gives up."""
+        deadline = self._admit()
+        slots = self._loop_slots()
+        try:
+            await asyncio.wait_for(slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self._failed(f"no free {self.name} slot within {self.timeout:g}s", timeout=True)
+
+        def start():
+            task = asyncio.ensure_future(fn(max(deadline - time.monotonic(), 0.001)))
+            task.add_done_callback(lambda _: slots.release())
+            return task
+
+        running = {start()}
+        hedges = set()
+        attempts, started, error = 1, time.monotonic(), None
+        try:
+            while running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                hedge_wait = self._next_wait(started, attempts, hedge)
+                done, running = await asyncio.wait(
+                    running, timeout=remaining if hedge_wait is None else min(remaining, hedge_wait),
+                    return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self.breaker.record_success()
+                        if task in hedges:
+                            self._count("hedge_wins")
+                        return task.result()
+                    error = task.exception()
+                if error is not None and not is_failure(error):
+                    break
+                if running and done:
+                    continue
+                if not running or (hedge_wait is not None and time.monotonic() < deadline):
+                    if attempts < self.max_attempts and not slots.locked():
+                        await slots.acquire()
+                        task = start()
+                        if running:
+                            self._count("hedges")
+                            hedges.add(task)
+                        else:
+                            self._count("retries")
+                        running.add(task)
+                        attempts += 1
+                        started = time.monotonic()
+                        continue
+                    hedge = False
+            self._finish(error, timed_out=bool(running))
+        finally:
+            for task in running:
+                task.cancel()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counts)
+        stats.update({
+            "state": self.breaker.state,
+            "opened": self.breaker.opened,
+            "timeout": self.timeout,
+            "max_concurrency": self.max_concurrency,
+            "hedge_after": self.hedge_after,
+        })
+        return stats